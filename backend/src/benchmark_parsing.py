@@ -0,0 +1,173 @@
+"""
+Benchmark of the HTML parsing done by the logo and stock info scrapers. The
+legacy path (the whole document with html.parser) is compared against
+parsing only the target element, with each available parser.
+"""
+
+import argparse
+import os
+import time
+import tracemalloc
+from typing import Callable, List, Tuple
+
+from html_parsing import HAVE_LXML, find_element  # pylint: disable=import-error
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def extract_logos(html: str, parser: str, parse_only_target: bool) -> List[Tuple]:
+    """
+    Extract the logos of a brandsoftheworld.com search page, as fetch_logo
+    does.
+
+    Parameters
+    ----------
+    html : str
+        The page.
+    parser : str
+        The BeautifulSoup parser.
+    parse_only_target : bool
+        Build only the target element.
+
+    Returns
+    -------
+    List[Tuple]
+        (url, title) of every logo.
+    """
+    content = find_element(html, "div", "view-content", parser, parse_only_target)
+    return [
+        (item.find("img")["src"].split("?")[0], item.find("span").text)
+        for item in content.find_all("li")
+    ]
+
+
+def extract_stock_rows(
+    html: str, parser: str, parse_only_target: bool
+) -> List[Tuple]:
+    """
+    Extract the rows of a stockanalysis.com symbol lookup page, as
+    fetch_stock_info does.
+
+    Parameters
+    ----------
+    html : str
+        The page.
+    parser : str
+        The BeautifulSoup parser.
+    parse_only_target : bool
+        Build only the target element.
+
+    Returns
+    -------
+    List[Tuple]
+        The cell texts of every row.
+    """
+    table = find_element(
+        html, "table", "svelte-1swpzu1", parser, parse_only_target
+    )
+    return [
+        tuple(cell.get_text() for cell in row.find_all(["td"]))
+        for row in table.find_all("tr")
+    ]
+
+
+def measure(
+    extract: Callable, html: str, parser: str, parse_only_target: bool, runs: int
+) -> Tuple[float, int, List[Tuple]]:
+    """
+    Time an extraction and measure its peak memory.
+
+    Parameters
+    ----------
+    extract : Callable
+        The extraction function.
+    html : str
+        The page.
+    parser : str
+        The BeautifulSoup parser.
+    parse_only_target : bool
+        Build only the target element.
+    runs : int
+        Number of timed runs.
+
+    Returns
+    -------
+    Tuple[float, int, List[Tuple]]
+        Mean seconds per run, peak bytes allocated and the extracted rows.
+    """
+    rows = extract(html, parser, parse_only_target)
+    start = time.perf_counter()
+    for _ in range(runs):
+        extract(html, parser, parse_only_target)
+    elapsed = (time.perf_counter() - start) / max(runs, 1)
+
+    tracemalloc.start()
+    extract(html, parser, parse_only_target)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, rows
+
+
+def main(runs: int):
+    """
+    Main processing method.
+
+    Parameters
+    ----------
+    runs : int
+        Number of timed runs of every variant.
+    """
+    parsers = ["html.parser"] + (["lxml"] if HAVE_LXML else [])
+    pages = [
+        ("brandsoftheworld_search.html", extract_logos),
+        ("stockanalysis_symbol_lookup.html", extract_stock_rows),
+    ]
+    for file_name, extract in pages:
+        with open(os.path.join(FIXTURES, file_name), encoding="utf-8") as f:
+            html = f.read()
+        print(f"{file_name} ({len(html) / 1024:.0f} KiB)")
+        # The first variant is the legacy path and the baseline of the others.
+        legacy_elapsed, expected = None, None
+        for parser in parsers:
+            for parse_only_target in (False, True):
+                elapsed, peak, rows = measure(
+                    extract, html, parser, parse_only_target, runs
+                )
+                if legacy_elapsed is None:
+                    legacy_elapsed, expected = elapsed, rows
+                if rows != expected:
+                    raise RuntimeError(
+                        f"{parser} parse_only_target={parse_only_target} "
+                        f"extracted different rows"
+                    )
+                label = f"{parser}{' target only' if parse_only_target else ''}"
+                print(
+                    f"  {label:<24} {elapsed * 1e3:7.2f} ms "
+                    f"peak {peak / 1024:7.0f} KiB "
+                    f"speedup {legacy_elapsed / elapsed:4.1f}x "
+                    f"rows={len(rows)}"
+                )
+    if not HAVE_LXML:
+        print("lxml is not installed, only html.parser was measured")
+
+
+if __name__ == "__main__":
+
+    # 1. Create an ArgumentParser object
+    parser = argparse.ArgumentParser(
+        description="Benchmark full-document versus target-only HTML parsing"
+    )
+
+    # 2. Add arguments
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=20,
+        help="number of timed runs of each variant",
+    )
+
+    # 3. Parse the arguments
+    args = parser.parse_args()
+
+    # 4. Invoke main method
+    main(args.runs)
@@ -0,0 +1,151 @@
+"""
+Benchmark comparing the asyncio orchestrator against the legacy bonobo graph
+for /get-all-data/, and a /get-all-data-batch/ call against a single request.
+Upstream sources are replaced by stand-ins with a fixed latency so the
+difference is pure scheduling overhead.
+"""
+
+import argparse
+import os
+import statistics
+import time
+from typing import Dict, List
+from unittest import mock
+
+import endpoint  # pylint: disable=import-error
+from cache import RESULT_CACHE  # pylint: disable=import-error
+from concurrency_test import stand_in_patches  # pylint: disable=import-error
+from model import ChainType, TargetQuery  # pylint: disable=import-error
+
+SOURCE_LATENCY: Dict[ChainType, float] = {
+    ChainType.LOGO_DATA: 0.20,
+    ChainType.DESCRPTION_DATA: 0.30,
+    ChainType.STOCK_INFO_DATA: 0.10,
+    ChainType.STOCK_PRICE_DATA: 0.10,
+    ChainType.YOUTUBE_SENTIMENT_DATA: 0.50,
+    ChainType.REDDIT_SENTIMENT_DATA: 0.40,
+}
+
+
+def fixed_pause(chain: ChainType):
+    """
+    Simulate the latency of an upstream source.
+
+    Parameters
+    ----------
+    chain : ChainType
+        The source being simulated.
+    """
+    time.sleep(SOURCE_LATENCY[chain])
+
+
+def measure(backend: str, n: int) -> List[float]:
+    """
+    Time n sequential /get-all-data/ calls.
+
+    Parameters
+    ----------
+    backend : str
+        The pipeline backend, "asyncio" or "bonobo".
+    n : int
+        Number of requests.
+
+    Returns
+    -------
+    List[float]
+        The latency of each request in seconds.
+    """
+    get_all_data = endpoint.get_all_data.__wrapped__
+    latencies = []
+    # The cache is bypassed so that every request reaches the sources.
+    with mock.patch.multiple(
+        endpoint, **stand_in_patches(fixed_pause)
+    ), mock.patch.dict(
+        os.environ, {"PIPELINE_BACKEND": backend}
+    ), mock.patch.object(
+        RESULT_CACHE, "enabled", False
+    ):
+        for i in range(n):
+            start = time.perf_counter()
+            get_all_data(TargetQuery(target=f"target-{i}"))
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def measure_batch(size: int) -> float:
+    """
+    Time one /get-all-data-batch/ call.
+
+    Parameters
+    ----------
+    size : int
+        Number of distinct targets in the batch.
+
+    Returns
+    -------
+    float
+        The latency of the batch in seconds.
+    """
+    get_all_data_batch = endpoint.get_all_data_batch.__wrapped__
+    queries = [TargetQuery(target=f"batch-{i}") for i in range(size)]
+    with mock.patch.multiple(
+        endpoint, **stand_in_patches(fixed_pause)
+    ), mock.patch.object(RESULT_CACHE, "enabled", False):
+        start = time.perf_counter()
+        batch = get_all_data_batch(queries)
+        elapsed = time.perf_counter() - start
+    assert len(batch.results) == size, batch.errors
+    return elapsed
+
+
+def main(n: int, batch_size: int):
+    """
+    Main processing method.
+
+    Parameters
+    ----------
+    n : int
+        Number of requests per backend.
+    batch_size : int
+        Number of targets in the batch request.
+    """
+    slowest = max(SOURCE_LATENCY.values())
+    for backend in ("asyncio", "bonobo"):
+        latencies = measure(backend, n)
+        mean = statistics.mean(latencies)
+        print(
+            f"{backend:8s} mean={mean * 1e3:.1f}ms "
+            + f"p50={statistics.median(latencies) * 1e3:.1f}ms "
+            + f"max={max(latencies) * 1e3:.1f}ms "
+            + f"overhead={(mean - slowest) * 1e3:.1f}ms"
+        )
+    elapsed = measure_batch(batch_size)
+    print(
+        f"batch    targets={batch_size} elapsed={elapsed * 1e3:.1f}ms "
+        + f"({elapsed / slowest:.1f}x one request)"
+    )
+
+
+if __name__ == "__main__":
+
+    # 1. Create an ArgumentParser object
+    parser = argparse.ArgumentParser(
+        description="Benchmark the asyncio orchestrator against bonobo"
+    )
+
+    # 2. Add arguments
+    parser.add_argument(
+        "-n", type=int, default=20, help="number of requests per backend"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=50,
+        help="number of targets in the batch request",
+    )
+
+    # 3. Parse the arguments
+    args = parser.parse_args()
+
+    # 4. Invoke main method
+    main(args.n, args.batch_size)
@@ -0,0 +1,483 @@
+"""
+Offline benchmark of the endpoints. Every upstream call is answered by a
+replay_server.py started for the run, so the benchmark needs no network and
+no keys, and runs of different commits can be compared. For every endpoint
+it measures the end-to-end latency, the CPU time and the peak memory of a
+request, and the time spent per pipeline stage and per upstream call. The
+results are written as JSON and compared with a stored baseline.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import requests
+from model import TargetQuery  # pylint: disable=import-error
+from replay_server import REPLAY_FIXTURES  # pylint: disable=import-error
+from replay_server import upstream_settings  # pylint: disable=import-error
+
+SERVER_SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "replay_server.py"
+)
+BASELINE = os.path.join(REPLAY_FIXTURES, "baseline.json")
+SCENARIOS = [
+    "get_logo",
+    "get_description",
+    "get_stock_info",
+    "get_stock_data",
+    "get_youtube_sentiment",
+    "get_reddit_sentiment",
+    "get_all_data",
+]
+TARGETS = ["Apple", "Microsoft", "Coca-Cola", "Tesla", "Boeing"]
+# Stores that would answer repeated requests locally and hide the upstream
+# calls. They are disabled unless --stores is given.
+STORE_SETTINGS = [
+    "DESCRIPTION_STORE_ENABLED",
+    "PRICE_STORE_ENABLED",
+    "LOGO_STORE_ENABLED",
+    "COMMENT_ARCHIVE_ENABLED",
+]
+# A metric regresses when it grows by more than the tolerance and by more
+# than its floor, so that noise on tiny values is not reported.
+FLOORS = {"wall_median": 0.005, "cpu_mean": 0.005, "peak_memory_mb": 1.0}
+# Scenarios that score comments, and so must use the scoring pool when it is
+# enabled.
+SCORING_SCENARIOS = [
+    "get_youtube_sentiment",
+    "get_reddit_sentiment",
+    "get_all_data",
+]
+
+
+def start_server(port: int, latency: float) -> subprocess.Popen:
+    """
+    Start a replay server and wait until it answers.
+
+    Parameters
+    ----------
+    port : int
+        Port the server listens on.
+    latency : float
+        Seconds every upstream response is delayed by.
+
+    Returns
+    -------
+    subprocess.Popen
+        The server process.
+    """
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            SERVER_SCRIPT,
+            f"--port={port}",
+            f"--latency={latency}",
+        ],
+        stdout=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/health", timeout=1)
+            return server
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"replay server did not start on port {port}")
+
+
+def configure(port: int, stores: bool, scoring_pool: bool):
+    """
+    Point the backend at the replay server. Must be called before endpoint
+    is imported, since the settings are read at import time.
+
+    Parameters
+    ----------
+    port : int
+        Port of the replay server.
+    stores : bool
+        Keep the local stores enabled.
+    scoring_pool : bool
+        Score comments in the scoring pool.
+    """
+    os.environ.update(upstream_settings(f"http://127.0.0.1:{port}"))
+    os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="benchmark-replay-")
+    os.environ["TRACING_ENABLED"] = "0"
+    os.environ["CACHE_ENABLED"] = "0"
+    if not stores:
+        for key in STORE_SETTINGS:
+            os.environ[key] = "0"
+    os.environ["SCORING_POOL_ENABLED"] = "1" if scoring_pool else "0"
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """
+    Summary statistics of a list of measurements.
+
+    Parameters
+    ----------
+    values : List[float]
+        The measurements.
+
+    Returns
+    -------
+    Dict[str, float]
+        min, median, p95 and mean.
+    """
+    return {
+        "min": float(np.min(values)),
+        "median": float(np.median(values)),
+        "p95": float(np.percentile(values, 95)),
+        "mean": float(np.mean(values)),
+    }
+
+
+def totals_diff(
+    before: Dict[Tuple[str, ...], Tuple[int, float]],
+    after: Dict[Tuple[str, ...], Tuple[int, float]],
+    runs: int,
+) -> Dict[str, Dict[str, float]]:
+    """
+    Calls and seconds per run of every histogram child between two
+    snapshots.
+
+    Parameters
+    ----------
+    before : Dict[Tuple[str, ...], Tuple[int, float]]
+        Totals of the histogram before the runs.
+    after : Dict[Tuple[str, ...], Tuple[int, float]]
+        Totals of the histogram after the runs.
+    runs : int
+        Number of runs between the snapshots.
+
+    Returns
+    -------
+    Dict[str, Dict[str, float]]
+        {"label/label": {"calls": ..., "seconds": ...}} for the children
+        that were observed.
+    """
+    diff = {}
+    for values, (count, total) in sorted(after.items()):
+        count_before, total_before = before.get(values, (0, 0.0))
+        if count > count_before:
+            diff["/".join(values)] = {
+                "calls": (count - count_before) / runs,
+                "seconds": (total - total_before) / runs,
+            }
+    return diff
+
+
+def measure(endpoint: Callable[[TargetQuery], Any], runs: int) -> Dict[str, Any]:
+    """
+    Measure one endpoint.
+
+    Parameters
+    ----------
+    endpoint : Callable[[TargetQuery], Any]
+        The endpoint function.
+    runs : int
+        Number of timed requests.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The measurements of the scenario.
+    """
+    # pylint: disable=import-outside-toplevel,import-error
+    from metrics import STAGE_DURATION, UPSTREAM_CALL_DURATION, totals
+
+    # Clients, the ticker index and the lexicon are set up by the warm-up.
+    random.seed(0)
+    endpoint(TargetQuery(target=TARGETS[0]))
+
+    stages_before = totals(STAGE_DURATION)
+    upstream_before = totals(UPSTREAM_CALL_DURATION)
+    wall, cpu = [], []
+    for run in range(runs):
+        # Video and submission sampling is random; seed it so that every
+        # run of the benchmark reads the same comments.
+        random.seed(run)
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        endpoint(TargetQuery(target=TARGETS[run % len(TARGETS)]))
+        wall.append(time.perf_counter() - start_wall)
+        cpu.append(time.process_time() - start_cpu)
+    stages = totals_diff(stages_before, totals(STAGE_DURATION), runs)
+    upstream = totals_diff(upstream_before, totals(UPSTREAM_CALL_DURATION), runs)
+
+    # tracemalloc slows allocation down, so memory is measured separately.
+    random.seed(0)
+    tracemalloc.start()
+    try:
+        endpoint(TargetQuery(target=TARGETS[0]))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "wall": summarize(wall),
+        "cpu": summarize(cpu),
+        "peak_memory_mb": peak / 2**20,
+        "stages": stages,
+        "upstream": upstream,
+    }
+
+
+def compare(
+    results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float
+) -> List[str]:
+    """
+    Print the change of every scenario against the baseline.
+
+    Parameters
+    ----------
+    results : Dict[str, Any]
+        The scenarios of this run.
+    baseline : Dict[str, Any]
+        The scenarios of the baseline.
+    tolerance : float
+        Relative growth above which a metric regresses.
+
+    Returns
+    -------
+    List[str]
+        "scenario metric" of every regression.
+    """
+    regressions = []
+    print(f"{'scenario':24s}{'metric':16s}{'baseline':>10s}{'current':>10s}")
+    for name, scenario in results.items():
+        if name not in baseline:
+            print(f"{name:24s}not in baseline")
+            continue
+        for metric, floor in FLOORS.items():
+            current = metric_value(scenario, metric)
+            previous = metric_value(baseline[name], metric)
+            regressed = (
+                current > previous * (1 + tolerance)
+                and current - previous > floor
+            )
+            change = (current - previous) / previous if previous else 0.0
+            print(
+                f"{name:24s}{metric:16s}{previous:10.4f}{current:10.4f} "
+                f"{change:+7.1%}{'  REGRESSION' if regressed else ''}"
+            )
+            if regressed:
+                regressions.append(f"{name} {metric}")
+    return regressions
+
+
+def metric_value(scenario: Dict[str, Any], metric: str) -> float:
+    """
+    Read a compared metric of a scenario.
+
+    Parameters
+    ----------
+    scenario : Dict[str, Any]
+        The measurements of the scenario.
+    metric : str
+        wall_median, cpu_mean or peak_memory_mb.
+
+    Returns
+    -------
+    float
+        The value.
+    """
+    if metric == "wall_median":
+        return scenario["wall"]["median"]
+    if metric == "cpu_mean":
+        return scenario["cpu"]["mean"]
+    return scenario["peak_memory_mb"]
+
+
+def main(
+    scenarios: List[str],
+    runs: int,
+    port: int,
+    latency: float,
+    stores: bool,
+    scoring_pool: bool,
+    output: Optional[str],
+    baseline: str,
+    save_baseline: bool,
+    tolerance: float,
+) -> int:
+    """
+    Main processing method.
+
+    Parameters
+    ----------
+    scenarios : List[str]
+        Names of the endpoint functions to measure.
+    runs : int
+        Timed requests per endpoint.
+    port : int
+        Port of the replay server.
+    latency : float
+        Seconds every upstream response is delayed by.
+    stores : bool
+        Keep the local stores enabled.
+    scoring_pool : bool
+        Score comments in the scoring pool, and fail if the scoring
+        scenarios did not use it.
+    output : Optional[str]
+        Path the JSON results are written to.
+    baseline : str
+        Path of the baseline results.
+    save_baseline : bool
+        Write the results to the baseline instead of comparing with it.
+    tolerance : float
+        Relative growth above which a metric regresses.
+
+    Returns
+    -------
+    int
+        The exit status, 1 if a metric regressed or the scoring pool was
+        not used.
+    """
+    server = start_server(port, latency)
+    try:
+        configure(port, stores, scoring_pool)
+        import endpoint  # pylint: disable=import-outside-toplevel,import-error
+
+        results = {}
+        for name in scenarios:
+            results[name] = measure(getattr(endpoint, name), runs)
+            result = results[name]
+            print(
+                f"{name:24s}median={result['wall']['median'] * 1e3:8.1f}ms "
+                f"cpu={result['cpu']['mean'] * 1e3:8.1f}ms "
+                f"peak={result['peak_memory_mb']:6.1f}MB"
+            )
+        pool_stats = endpoint.SCORING_POOL.stats()
+        endpoint.SCORING_POOL.stop()
+    finally:
+        server.terminate()
+        server.wait()
+
+    if scoring_pool:
+        print(
+            f"scoring pool: pooled_batches={pool_stats.pooled_batches} "
+            f"in_process_batches={pool_stats.in_process_batches}"
+        )
+        scored = any(name in SCORING_SCENARIOS for name in scenarios)
+        if scored and pool_stats.pooled_batches == 0:
+            print("The scoring pool was enabled but no request used it")
+            return 1
+
+    document = {
+        "meta": {
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "runs": runs,
+            "latency": latency,
+            "stores": stores,
+            "scoring_pool": scoring_pool,
+            "targets": TARGETS,
+        },
+        "scenarios": results,
+    }
+    if output:
+        with open(output, "w") as f:
+            json.dump(document, f, indent=2)
+    if save_baseline:
+        with open(baseline, "w") as f:
+            json.dump(document, f, indent=2)
+        print(f"Saved baseline {baseline}")
+        return 0
+    if not os.path.exists(baseline):
+        print(f"No baseline at {baseline}, nothing to compare with")
+        return 0
+    with open(baseline, "r") as f:
+        regressions = compare(results, json.load(f)["scenarios"], tolerance)
+    if regressions:
+        print(f"{len(regressions)} regressions: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+
+    # 1. Create an ArgumentParser object
+    parser = argparse.ArgumentParser(
+        description="Benchmark the endpoints against recorded upstream responses"
+    )
+
+    # 2. Add arguments
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=SCENARIOS,
+        help="endpoint to measure, may be repeated; all by default",
+    )
+    parser.add_argument(
+        "--runs", type=int, default=10, help="timed requests per endpoint"
+    )
+    parser.add_argument(
+        "--port", type=int, default=8021, help="port of the replay server"
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.02,
+        help="seconds every upstream response is delayed by",
+    )
+    parser.add_argument(
+        "--stores",
+        action="store_true",
+        help="keep the description, price, logo and comment stores enabled",
+    )
+    parser.add_argument(
+        "--scoring-pool",
+        action="store_true",
+        help="score comments in the scoring pool and check that it is used",
+    )
+    parser.add_argument(
+        "--output", type=str, default=None, help="file the JSON results go to"
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        default=BASELINE,
+        help="JSON results of an earlier run to compare with",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="write the results to the baseline instead of comparing",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="relative growth above which a metric regresses",
+    )
+
+    # 3. Parse the arguments
+    args = parser.parse_args()
+
+    # 4. Invoke main method
+    sys.exit(
+        main(
+            args.scenario or SCENARIOS,
+            args.runs,
+            args.port,
+            args.latency,
+            args.stores,
+            args.scoring_pool,
+            args.output,
+            args.baseline,
+            args.save_baseline,
+            args.tolerance,
+        )
+    )
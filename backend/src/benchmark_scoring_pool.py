@@ -0,0 +1,118 @@
+"""
+Benchmark of sentiment scoring throughput in-process versus with the scoring
+pool at increasing worker counts, on a fixed corpus of comments.
+"""
+
+import argparse
+import os
+import time
+from typing import List
+
+import numpy as np
+from benchmark_sentiment import build_corpus  # pylint: disable=import-error
+from common import score_batch  # pylint: disable=import-error
+from scoring_pool import ScoringPool  # pylint: disable=import-error
+
+
+def worker_counts(max_workers: int) -> List[int]:
+    """
+    Worker counts to measure: powers of two up to max_workers, and
+    max_workers itself.
+
+    Parameters
+    ----------
+    max_workers : int
+        The largest worker count.
+
+    Returns
+    -------
+    List[int]
+        The worker counts in increasing order.
+    """
+    counts = []
+    count = 1
+    while count < max_workers:
+        counts.append(count)
+        count *= 2
+    counts.append(max_workers)
+    return counts
+
+
+def main(n: int, max_workers: int, chunk_size: int, runs: int):
+    """
+    Main processing method.
+
+    Parameters
+    ----------
+    n : int
+        Number of comments in the corpus.
+    max_workers : int
+        The largest number of worker processes measured.
+    chunk_size : int
+        Number of comments sent to a worker at a time.
+    runs : int
+        Timed runs of every configuration. The fastest is reported.
+    """
+    corpus = build_corpus(n)
+
+    elapsed = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        expected = score_batch(corpus)
+        elapsed.append(time.perf_counter() - start)
+    baseline = min(elapsed)
+    print(f"comments={n} cores={os.cpu_count()}")
+    print(f"in-process:  {n / baseline:9.0f} comments/s")
+
+    for workers in worker_counts(max_workers):
+        pool = ScoringPool(workers=workers, min_batch=0, chunk_size=chunk_size)
+        pool.start()
+        elapsed = []
+        try:
+            for _ in range(runs):
+                start = time.perf_counter()
+                scores = pool.score(corpus)
+                elapsed.append(time.perf_counter() - start)
+        finally:
+            pool.stop()
+        if not np.array_equal(scores, expected):
+            raise RuntimeError(f"workers={workers} scored differently")
+        best = min(elapsed)
+        print(
+            f"workers={workers:<3}  {n / best:9.0f} comments/s "
+            f"speedup {baseline / best:4.1f}x"
+        )
+
+
+if __name__ == "__main__":
+
+    # 1. Create an ArgumentParser object
+    parser = argparse.ArgumentParser(
+        description="Benchmark in-process versus process-pool sentiment scoring"
+    )
+
+    # 2. Add arguments
+    parser.add_argument(
+        "-n", type=int, default=20000, help="number of comments to score"
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="largest number of worker processes",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=250,
+        help="number of comments sent to a worker at a time",
+    )
+    parser.add_argument(
+        "--runs", type=int, default=3, help="timed runs of each configuration"
+    )
+
+    # 3. Parse the arguments
+    args = parser.parse_args()
+
+    # 4. Invoke main method
+    main(args.n, args.max_workers, args.chunk_size, args.runs)
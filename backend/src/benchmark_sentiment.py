@@ -0,0 +1,160 @@
+"""
+Benchmark comparing the legacy per-comment sentiment path against the shared
+analyzer batch path, and a cold against a warm comment archive.
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from typing import List
+
+from comment_archive import CommentArchive  # pylint: disable=import-error
+from common import SENTIMENT_ANALYZER, score_batch  # pylint: disable=import-error
+from nltk.sentiment import SentimentIntensityAnalyzer
+
+FILLER_WORDS = [
+    "the",
+    "stock",
+    "company",
+    "video",
+    "this",
+    "is",
+    "they",
+    "product",
+    "price",
+    "really",
+    "not",
+    "very",
+    "just",
+    "quarter",
+    "earnings",
+]
+
+
+def build_corpus(n: int, seed: int = 42) -> List[str]:
+    """
+    Build a deterministic corpus of comment-like strings.
+
+    Parameters
+    ----------
+    n : int
+        Number of comments to generate.
+    seed : int, optional
+        Seed for the random generator, by default 42
+
+    Returns
+    -------
+    List[str]
+        The generated comments.
+    """
+    rng = random.Random(seed)
+    sentiment_words = sorted(SENTIMENT_ANALYZER.lexicon.keys())
+    corpus = []
+    for _ in range(n):
+        length = rng.randint(5, 40)
+        words = [
+            (
+                rng.choice(sentiment_words)
+                if rng.random() < 0.2
+                else rng.choice(FILLER_WORDS)
+            )
+            for _ in range(length)
+        ]
+        corpus.append(" ".join(words) + rng.choice([".", "!", "?", "!!"]))
+    return corpus
+
+
+def legacy_score(text: str) -> float:
+    """
+    The original implementation that built a new analyzer for every comment.
+
+    Parameters
+    ----------
+    text : str
+        The string to be analyzed.
+
+    Returns
+    -------
+    float
+        The VADER compound score.
+    """
+    sid = SentimentIntensityAnalyzer()
+    return sid.polarity_scores(text)["compound"]
+
+
+def main(n: int, legacy_n: int):
+    """
+    Main processing method.
+
+    Parameters
+    ----------
+    n : int
+        Number of comments scored by the batch path.
+    legacy_n : int
+        Number of comments scored by the (much slower) legacy path. The
+        result is extrapolated to n comments.
+    """
+    corpus = build_corpus(n)
+
+    start = time.perf_counter()
+    for text in corpus[:legacy_n]:
+        legacy_score(text)
+    legacy_elapsed = time.perf_counter() - start
+    legacy_per_comment = legacy_elapsed / max(legacy_n, 1)
+
+    start = time.perf_counter()
+    scores = score_batch(corpus)
+    batch_elapsed = time.perf_counter() - start
+    batch_per_comment = batch_elapsed / max(n, 1)
+
+    print(f"comments={n}")
+    print(
+        f"legacy: {legacy_per_comment * 1e3:.3f} ms/comment, "
+        f"{legacy_per_comment * n:.3f} s for {n} (extrapolated from {legacy_n})"
+    )
+    print(
+        f"batch:  {batch_per_comment * 1e6:.1f} us/comment, "
+        f"{batch_elapsed * 1e3:.1f} ms for {len(scores)}"
+    )
+    print(f"speedup: {legacy_per_comment / batch_per_comment:.2f}x")
+
+    comments = [(f"c{index}", text) for index, text in enumerate(corpus)]
+    with tempfile.TemporaryDirectory() as tmp:
+        archive = CommentArchive(os.path.join(tmp, "comments.sqlite3"))
+        start = time.perf_counter()
+        archive.score("benchmark", comments)
+        cold_elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        archive.score("benchmark", comments)
+        warm_elapsed = time.perf_counter() - start
+    print(
+        f"archive: cold {cold_elapsed * 1e3:.1f} ms, "
+        f"warm {warm_elapsed * 1e3:.1f} ms for {n}"
+    )
+
+
+if __name__ == "__main__":
+
+    # 1. Create an ArgumentParser object
+    parser = argparse.ArgumentParser(
+        description="Benchmark per-call versus batch sentiment scoring"
+    )
+
+    # 2. Add arguments
+    parser.add_argument(
+        "-n", type=int, default=5000, help="number of comments to score"
+    )
+    parser.add_argument(
+        "--legacy-n",
+        type=int,
+        default=50,
+        help="number of comments scored with the legacy per-call path",
+    )
+
+    # 3. Parse the arguments
+    args = parser.parse_args()
+
+    # 4. Invoke main method
+    main(args.n, args.legacy_n)
@@ -0,0 +1,157 @@
+"""
+Benchmark of the per-span overhead of span_decorator. Spans go to a stand-in
+exporter that simulates a slow collector, so the difference between
+synchronous and batched export is visible without a collector running.
+"""
+
+import argparse
+import time
+from typing import Callable, Sequence
+from unittest import mock
+
+import decorators  # pylint: disable=import-error
+from decorators import build_sampler  # pylint: disable=import-error
+from decorators import span_decorator  # pylint: disable=import-error
+from opentelemetry import trace  # pylint: disable=import-error
+from opentelemetry.sdk.trace import ReadableSpan  # pylint: disable=import-error
+from opentelemetry.sdk.trace import TracerProvider  # pylint: disable=import-error
+from opentelemetry.sdk.trace import sampling  # pylint: disable=import-error
+from opentelemetry.sdk.trace.export import (  # pylint: disable=import-error
+    BatchSpanProcessor,
+    SimpleSpanProcessor,
+    SpanExporter,
+    SpanExportResult,
+)
+
+
+class SlowExporter(SpanExporter):
+    """
+    Drops spans after a fixed delay per export call.
+    """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        time.sleep(self.delay)
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self):
+        pass
+
+
+DROPPED_ROOT = trace.NonRecordingSpan(
+    trace.SpanContext(
+        trace_id=1, span_id=1, is_remote=False, trace_flags=trace.TraceFlags(0)
+    )
+)
+
+
+@span_decorator
+def traced():
+    pass
+
+
+def untraced():
+    pass
+
+
+def per_call(fn: Callable[[], None], n: int) -> float:
+    """
+    Time n calls of fn.
+
+    Parameters
+    ----------
+    fn : Callable[[], None]
+        The function to call.
+    n : int
+        Number of calls.
+
+    Returns
+    -------
+    float
+        Seconds per call.
+    """
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n
+
+
+def main(n: int, export_delay: float):
+    """
+    Main processing method.
+
+    Parameters
+    ----------
+    n : int
+        Number of calls per configuration.
+    export_delay : float
+        Seconds the stand-in exporter takes per export call.
+    """
+    baseline = per_call(untraced, n)
+    print(f"{'undecorated':28s} {baseline * 1e6:8.2f} us/call")
+    print(f"{'not set up':28s} {per_call(traced, n) * 1e6:8.2f} us/call")
+
+    # (label, sampler, span processor, number of calls, inside a root span)
+    configurations = [
+        ("always_on, batch", "always_on", BatchSpanProcessor, n, False),
+        ("parent_ratio, root", "parent_ratio", BatchSpanProcessor, n, False),
+        (
+            "parent_ratio, dropped child",
+            "parent_ratio",
+            BatchSpanProcessor,
+            n,
+            True,
+        ),
+        ("always_off", "always_off", BatchSpanProcessor, n, False),
+        # Synchronous export is far slower, so fewer calls are timed.
+        ("always_on, simple", "always_on", SimpleSpanProcessor, 200, False),
+    ]
+    for label, name, processor, calls, nested in configurations:
+        sampler = build_sampler(name, 0.1)
+        provider = TracerProvider(sampler=sampler)
+        provider.add_span_processor(processor(SlowExporter(export_delay)))
+        tracer = provider.get_tracer(decorators.__name__)
+        with mock.patch.multiple(
+            decorators,
+            tracer=tracer,
+            _enabled=sampler is not sampling.ALWAYS_OFF,
+            _follow_parent=isinstance(sampler, sampling.ParentBased),
+        ):
+            if nested:
+                # Children of a request whose root span was not sampled.
+                with trace.use_span(DROPPED_ROOT):
+                    elapsed = per_call(traced, calls)
+            else:
+                elapsed = per_call(traced, calls)
+        provider.shutdown()
+        print(
+            f"{label:28s} {elapsed * 1e6:8.2f} us/call "
+            + f"(+{(elapsed - baseline) * 1e6:.2f})"
+        )
+
+
+if __name__ == "__main__":
+
+    # 1. Create an ArgumentParser object
+    parser = argparse.ArgumentParser(
+        description="Benchmark the per-span overhead of span_decorator"
+    )
+
+    # 2. Add arguments
+    parser.add_argument(
+        "-n", type=int, default=100000, help="number of calls per configuration"
+    )
+    parser.add_argument(
+        "--export-delay",
+        type=float,
+        default=0.001,
+        help="seconds the stand-in exporter takes per export call",
+    )
+
+    # 3. Parse the arguments
+    args = parser.parse_args()
+
+    # 4. Invoke main method
+    main(args.n, args.export_delay)
@@ -0,0 +1,264 @@
+"""
+A pool of warm Playwright browser contexts shared by all requests.
+
+Playwright objects are bound to the event loop that created them, so the pool
+owns a dedicated thread running an asyncio loop with a single Chromium
+instance. Requests lease one of a fixed number of contexts on that loop, which
+caps Chromium memory regardless of load.
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Awaitable, Callable, List, Optional, TypeVar
+
+from common import get_setting  # pylint: disable=import-error
+from model import BrowserPoolStats  # pylint: disable=import-error
+from playwright.async_api import Browser, BrowserContext
+from playwright.async_api import Error as PlaywrightError
+from playwright.async_api import Page, async_playwright
+
+T = TypeVar("T")
+
+
+class _PooledContext:
+    """
+    A browser context together with its usage counters.
+    """
+
+    def __init__(self, index: int, context: BrowserContext):
+        self.index = index
+        self.context = context
+        self.uses = 0
+        self.crashed = False
+        self.created = time.time()
+
+
+class BrowserPool:
+    """
+    A fixed-size pool of browser contexts on a dedicated event loop thread.
+    """
+
+    def __init__(self, size: int, max_uses: int):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        size : int
+            Number of browser contexts.
+        max_uses : int
+            Number of leases after which a context is replaced by a fresh one.
+        """
+        self.size = size
+        self.max_uses = max_uses
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._playwright: Any = None
+        self._browser: Optional[Browser] = None
+        self._browser_lock: Optional[asyncio.Lock] = None
+        self._idle: Optional[asyncio.Queue] = None
+        self._slots: List[_PooledContext] = []
+        self._busy = 0
+        self._waiting = 0
+        self._leases = 0
+        self._recycles = 0
+        self._crashes = 0
+        self._browser_launches = 0
+
+    @property
+    def started(self) -> bool:
+        """
+        Whether the pool thread and browser are running.
+        """
+        return self._loop is not None and self._browser is not None
+
+    def start(self):
+        """
+        Start the pool thread, launch the browser and create the contexts.
+        Calling start on a running pool has no effect.
+        """
+        with self._start_lock:
+            if self.started:
+                return
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(
+                    target=loop.run_forever, name="browser-pool", daemon=True
+                )
+                thread.start()
+                self._loop = loop
+                self._thread = thread
+            asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+
+    def stop(self):
+        """
+        Close all contexts and the browser, and stop the pool thread.
+        """
+        with self._start_lock:
+            if self._loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(self._stop(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            if self._thread is not None:
+                self._thread.join()
+            self._loop.close()
+            self._loop = None
+            self._thread = None
+
+    def run(
+        self,
+        fn: Callable[[Page], Awaitable[T]],
+        timeout: Optional[float] = None,
+    ) -> T:
+        """
+        Lease a context, open a page in it and run fn on the pool thread.
+        Blocks the calling thread until fn finishes.
+
+        Parameters
+        ----------
+        fn : Callable[[Page], Awaitable[T]]
+            A coroutine function that drives the page.
+        timeout : Optional[float], optional
+            Seconds to wait for a free context plus the run, by default none.
+
+        Returns
+        -------
+        T
+            The result of fn.
+        """
+        if not self.started:
+            self.start()
+        assert self._loop is not None
+        future = asyncio.run_coroutine_threadsafe(self._run(fn), self._loop)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise
+
+    def stats(self) -> BrowserPoolStats:
+        """
+        Health and utilization statistics of the pool.
+
+        Returns
+        -------
+        BrowserPoolStats
+            The current statistics.
+        """
+        browser = self._browser
+        return BrowserPoolStats(
+            size=self.size,
+            max_uses=self.max_uses,
+            healthy=bool(
+                self._thread is not None
+                and self._thread.is_alive()
+                and browser is not None
+                and browser.is_connected()
+            ),
+            busy=self._busy,
+            idle=self._idle.qsize() if self._idle is not None else 0,
+            waiting=self._waiting,
+            utilization=self._busy / self.size if self.size else 0.0,
+            leases=self._leases,
+            recycles=self._recycles,
+            crashes=self._crashes,
+            browser_launches=self._browser_launches,
+            context_uses=[slot.uses for slot in self._slots],
+        )
+
+    async def _start(self):
+        self._browser_lock = asyncio.Lock()
+        self._idle = asyncio.Queue()
+        if self._playwright is None:
+            self._playwright = await async_playwright().start()
+        await self._ensure_browser()
+        self._slots = []
+        for index in range(self.size):
+            slot = _PooledContext(index, await self._new_context())
+            self._slots.append(slot)
+            self._idle.put_nowait(slot)
+
+    async def _stop(self):
+        for slot in self._slots:
+            try:
+                await slot.context.close()
+            except PlaywrightError:
+                pass
+        self._slots = []
+        if self._browser is not None:
+            try:
+                await self._browser.close()
+            except PlaywrightError:
+                pass
+            self._browser = None
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+    async def _ensure_browser(self) -> Browser:
+        assert self._browser_lock is not None
+        async with self._browser_lock:
+            if self._browser is None or not self._browser.is_connected():
+                self._browser = await self._playwright.chromium.launch()
+                self._browser_launches += 1
+            return self._browser
+
+    async def _new_context(self) -> BrowserContext:
+        browser = await self._ensure_browser()
+        return await browser.new_context()
+
+    async def _recycle(self, slot: _PooledContext):
+        try:
+            await slot.context.close()
+        except PlaywrightError:
+            pass
+        slot.context = await self._new_context()
+        slot.uses = 0
+        slot.crashed = False
+        slot.created = time.time()
+        self._recycles += 1
+
+    async def _run(self, fn: Callable[[Page], Awaitable[T]]) -> T:
+        assert self._idle is not None
+        self._waiting += 1
+        try:
+            slot = await self._idle.get()
+        finally:
+            self._waiting -= 1
+        self._busy += 1
+        self._leases += 1
+        page = None
+        try:
+            if self._browser is None or not self._browser.is_connected():
+                # The browser crashed since this context was created.
+                await self._recycle(slot)
+            page = await slot.context.new_page()
+            return await fn(page)
+        except PlaywrightError:
+            # The page, context or whole browser may be gone. Replace the
+            # context before it is leased again.
+            slot.crashed = True
+            self._crashes += 1
+            raise
+        finally:
+            if page is not None:
+                try:
+                    await page.close()
+                except PlaywrightError:
+                    slot.crashed = True
+            slot.uses += 1
+            try:
+                if slot.crashed or slot.uses >= self.max_uses:
+                    await self._recycle(slot)
+            finally:
+                self._busy -= 1
+                self._idle.put_nowait(slot)
+
+
+BROWSER_POOL = BrowserPool(
+    size=get_setting("LOGO_BROWSER_POOL_SIZE", 2),
+    max_uses=get_setting("LOGO_BROWSER_MAX_USES", 50),
+)
@@ -0,0 +1,244 @@
+"""
+In-process result cache for the pipeline sources. Entries are keyed by chain
+type and normalized target, expire after a per-chain TTL, are evicted in LRU
+order once a memory budget is exceeded, and are served stale while a
+background refresh runs.
+"""
+
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Set, Tuple, TypeVar
+
+from common import get_setting, normalize_target  # pylint: disable=import-error
+from model import CacheStats, ChainType  # pylint: disable=import-error
+
+T = TypeVar("T")
+
+MINUTE = 60.0
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+# How long a result is fresh. It can be overridden with a
+# CACHE_TTL_<CHAIN TYPE> environmental variable (seconds).
+DEFAULT_TTLS: Dict[ChainType, float] = {
+    ChainType.LOGO_DATA: 3 * DAY,
+    ChainType.DESCRPTION_DATA: 1 * DAY,
+    ChainType.STOCK_INFO_DATA: 5 * MINUTE,
+    ChainType.STOCK_PRICE_DATA: 5 * MINUTE,
+    ChainType.YOUTUBE_SENTIMENT_DATA: 1 * HOUR,
+    ChainType.REDDIT_SENTIMENT_DATA: 1 * HOUR,
+}
+
+CacheKey = Tuple[ChainType, str]
+
+
+class _Entry:
+    """
+    A cached value with its size and expiry times.
+    """
+
+    __slots__ = ("value", "size", "fresh_until", "stale_until")
+
+    def __init__(
+        self, value: Any, size: int, fresh_until: float, stale_until: float
+    ):
+        self.value = value
+        self.size = size
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+
+
+class ResultCache:
+    """
+    A memory-bounded LRU cache with per-chain TTLs and stale-while-revalidate.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        ttls: Dict[ChainType, float],
+        stale_factor: float = 1.0,
+        refresh_workers: int = 4,
+        enabled: bool = True,
+    ):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        max_bytes : int
+            Memory budget for the cached values (pickled size).
+        ttls : Dict[ChainType, float]
+            Seconds a result stays fresh, per chain type.
+        stale_factor : float, optional
+            Once fresh, a result may be served stale for stale_factor * TTL
+            more seconds while it is refreshed, by default 1.0
+        refresh_workers : int, optional
+            Threads used for background refreshes, by default 4
+        enabled : bool, optional
+            When False every lookup is computed, by default True
+        """
+        self.max_bytes = max_bytes
+        self.ttls = ttls
+        self.stale_factor = stale_factor
+        self.enabled = enabled
+        self._entries: "OrderedDict[CacheKey, _Entry]" = OrderedDict()
+        self._refreshing: Set[CacheKey] = set()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=refresh_workers, thread_name_prefix="cache-refresh"
+        )
+        self._hits = 0
+        self._stale_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._refreshes = 0
+        self._refresh_errors = 0
+
+    def get_or_compute(
+        self,
+        chain: ChainType,
+        target: str,
+        compute: Callable[[], T],
+        refresh: Optional[Callable[[], T]] = None,
+    ) -> T:
+        """
+        Return the cached result for a chain type and target, computing it on
+        a miss. A stale result is returned immediately and refreshed in the
+        background.
+
+        Parameters
+        ----------
+        chain : ChainType
+            The type of data.
+        target : str
+            The target of the query. It is normalized before use.
+        compute : Callable[[], T]
+            Produces the result on a miss.
+        refresh : Optional[Callable[[], T]], optional
+            Produces the result for a background refresh, by default compute.
+
+        Returns
+        -------
+        T
+            The result.
+        """
+        if not self.enabled:
+            return compute()
+        key = (chain, normalize_target(target))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now < entry.stale_until:
+                self._entries.move_to_end(key)
+                if now < entry.fresh_until:
+                    self._hits += 1
+                else:
+                    self._stale_hits += 1
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        self._executor.submit(
+                            self._refresh, key, refresh or compute
+                        )
+                return entry.value
+            self._misses += 1
+        value = compute()
+        self.put(chain, target, value)
+        return value
+
+    def put(self, chain: ChainType, target: str, value: Any):
+        """
+        Store a result, evicting the least recently used entries if the
+        memory budget is exceeded.
+
+        Parameters
+        ----------
+        chain : ChainType
+            The type of data.
+        target : str
+            The target of the query. It is normalized before use.
+        value : Any
+            The result.
+        """
+        if not self.enabled:
+            return
+        key = (chain, normalize_target(target))
+        size = len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        if size > self.max_bytes:
+            return
+        ttl = self.ttls[chain]
+        now = time.time()
+        entry = _Entry(
+            value, size, now + ttl, now + ttl * (1.0 + self.stale_factor)
+        )
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old.size
+            self._entries[key] = entry
+            self._size += size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted.size
+                self._evictions += 1
+
+    def clear(self):
+        """
+        Remove every entry.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> CacheStats:
+        """
+        Counters used to size the cache.
+
+        Returns
+        -------
+        CacheStats
+            The current statistics.
+        """
+        with self._lock:
+            return CacheStats(
+                hits=self._hits,
+                stale_hits=self._stale_hits,
+                misses=self._misses,
+                evictions=self._evictions,
+                refreshes=self._refreshes,
+                refresh_errors=self._refresh_errors,
+                entries=len(self._entries),
+                size_bytes=self._size,
+                max_bytes=self.max_bytes,
+            )
+
+    def _refresh(self, key: CacheKey, refresh: Callable[[], Any]):
+        chain, target = key
+        try:
+            value = refresh()
+            self.put(chain, target, value)
+            with self._lock:
+                self._refreshes += 1
+        except Exception as e:  # pylint: disable=broad-except
+            # Keep serving the stale value until it expires.
+            print(f"Error: cache refresh failed key={key} e={e}")
+            with self._lock:
+                self._refresh_errors += 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+
+RESULT_CACHE = ResultCache(
+    max_bytes=get_setting("CACHE_MAX_BYTES", 64 * 1024 * 1024),
+    ttls={
+        chain: get_setting(f"CACHE_TTL_{chain.name}", ttl)
+        for chain, ttl in DEFAULT_TTLS.items()
+    },
+    stale_factor=get_setting("CACHE_STALE_FACTOR", 1.0),
+    enabled=get_setting("CACHE_ENABLED", True),
+)
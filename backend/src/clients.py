@@ -0,0 +1,197 @@
+"""
+Process-wide registry of upstream API clients. Each client is created on
+first use and then shared by every request, so connection pools, TLS sessions
+and OAuth tokens are reused instead of being set up per call.
+"""
+
+import json
+import threading
+from typing import Any, Callable, Dict, TypeVar
+
+import googleapiclient.discovery
+import googleapiclient.discovery_cache
+import httplib2
+import openai
+import praw
+import requests
+from common import get_secret, get_setting  # pylint: disable=import-error
+from polygon import RESTClient
+from requests.adapters import HTTPAdapter
+
+T = TypeVar("T")
+
+# Keep-alive connections kept per host by the shared requests session.
+HTTP_POOL_SIZE = get_setting("HTTP_POOL_SIZE", 16)
+# Timeouts in seconds for calls made with the shared clients.
+HTTP_TIMEOUT = get_setting("HTTP_TIMEOUT", 15.0)
+YOUTUBE_CALL_TIMEOUT = get_setting("YOUTUBE_CALL_TIMEOUT", 10.0)
+OPENAI_TIMEOUT = get_setting("OPENAI_TIMEOUT", 30.0)
+# Base urls of the upstream APIs, e.g. the local stand-ins of
+# openai_stub.py or replay_server.py. Empty means the public service.
+OPENAI_BASE_URL = get_setting("OPENAI_BASE_URL", "")
+POLYGON_BASE_URL = get_setting("POLYGON_BASE_URL", "")
+REDDIT_BASE_URL = get_setting("REDDIT_BASE_URL", "")
+YOUTUBE_ROOT_URL = get_setting("YOUTUBE_ROOT_URL", "")
+
+_clients: Dict[str, Any] = {}
+_clients_lock = threading.Lock()
+_thread_local = threading.local()
+
+
+def _get_or_create(name: str, factory: Callable[[], T]) -> T:
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = factory()
+                _clients[name] = client
+    return client
+
+
+def _new_http_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_http_session() -> requests.Session:
+    """
+    Get the shared requests session for plain HTTP calls.
+
+    Returns
+    -------
+    requests.Session
+        A session with a keep-alive pool of HTTP_POOL_SIZE connections per
+        host.
+    """
+    return _get_or_create("http", _new_http_session)
+
+
+def get_openai_client() -> openai.OpenAI:
+    """
+    Get the shared OpenAI client. Its httpx connection pool is thread-safe.
+
+    Returns
+    -------
+    openai.OpenAI
+        The OpenAI client.
+    """
+    return _get_or_create(
+        "openai",
+        lambda: openai.OpenAI(
+            api_key=get_secret("OPENAI_API_KEY"),
+            base_url=OPENAI_BASE_URL or None,
+            timeout=OPENAI_TIMEOUT,
+        ),
+    )
+
+
+def get_polygon_client() -> RESTClient:
+    """
+    Get the shared Polygon client. Its urllib3 pool manager is thread-safe.
+
+    Returns
+    -------
+    RESTClient
+        The Polygon client.
+    """
+    return _get_or_create(
+        "polygon",
+        lambda: RESTClient(
+            api_key=get_secret("POLYGON_API_KEY"),
+            connect_timeout=HTTP_TIMEOUT,
+            read_timeout=HTTP_TIMEOUT,
+            **({"base": POLYGON_BASE_URL} if POLYGON_BASE_URL else {}),
+        ),
+    )
+
+
+def get_reddit_client() -> praw.Reddit:
+    """
+    Get the shared Reddit client. It is authenticated once so that the OAuth
+    token and connection pool are reused.
+
+    Returns
+    -------
+    praw.Reddit
+        The Reddit client.
+    """
+    return _get_or_create(
+        "reddit",
+        lambda: praw.Reddit(
+            client_id=get_secret("REDDIT_CLIENT_ID"),
+            client_secret=get_secret("REDDIT_CLIENT_SECRET"),
+            user_agent="sdimig-user-agent",
+            **(
+                {"oauth_url": REDDIT_BASE_URL, "reddit_url": REDDIT_BASE_URL}
+                if REDDIT_BASE_URL
+                else {}
+            ),
+        ),
+    )
+
+
+def get_youtube_discovery_document() -> Dict[str, Any]:
+    """
+    Get the YouTube Data API discovery document. It is read from the static
+    copy bundled with googleapiclient and parsed once, so building a client
+    needs no network call and no JSON parsing. YOUTUBE_ROOT_URL replaces the
+    root url of the API, for single and batch requests alike.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The parsed discovery document.
+    """
+
+    def load() -> Dict[str, Any]:
+        document = googleapiclient.discovery_cache.get_static_doc("youtube", "v3")
+        if document is None:
+            raise RuntimeError("no static discovery document for youtube v3")
+        document = json.loads(document)
+        if YOUTUBE_ROOT_URL:
+            document["rootUrl"] = YOUTUBE_ROOT_URL
+            document["baseUrl"] = YOUTUBE_ROOT_URL + document["servicePath"]
+        return document
+
+    return _get_or_create("youtube_discovery", load)
+
+
+def get_youtube_client() -> Any:
+    """
+    Get the YouTube client of the calling thread. googleapiclient's httplib2
+    transport is not thread-safe, so every thread keeps its own client, built
+    from the shared discovery document.
+
+    Returns
+    -------
+    Any
+        A googleapiclient Resource for the YouTube Data API.
+    """
+    youtube = getattr(_thread_local, "youtube", None)
+    if youtube is None:
+        youtube = googleapiclient.discovery.build_from_document(
+            get_youtube_discovery_document(),
+            developerKey=get_secret("GOOGLE_API_KEY"),
+            http=httplib2.Http(timeout=YOUTUBE_CALL_TIMEOUT),
+        )
+        _thread_local.youtube = youtube
+    return youtube
+
+
+def close_clients():
+    """
+    Close the shared clients that hold connection pools.
+    """
+    with _clients_lock:
+        session = _clients.pop("http", None)
+        if session is not None:
+            session.close()
+        client = _clients.pop("openai", None)
+        if client is not None:
+            client.close()
@@ -0,0 +1,200 @@
+"""
+SQLite archive of comment sentiment scores. Each comment is stored under its
+platform id together with a hash of its text, so a comment is only scored
+again when it is new or has been edited. The archive is kept on disk and
+survives restarts.
+"""
+
+import hashlib
+import sqlite3
+import threading
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+from common import get_data_path  # pylint: disable=import-error
+from common import get_setting  # pylint: disable=import-error
+from model import CommentArchiveStats  # pylint: disable=import-error
+from scoring_pool import SCORING_POOL  # pylint: disable=import-error
+
+# SQLite limits the number of host parameters in a single statement.
+LOOKUP_CHUNK_SIZE = 500
+
+# A comment as (platform comment id, text).
+Comment = Tuple[str, str]
+
+
+def text_hash(text: str) -> str:
+    """
+    Hash of a comment text used to detect edits.
+
+    Parameters
+    ----------
+    text : str
+        The comment text.
+
+    Returns
+    -------
+    str
+        A hex digest of the text.
+    """
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class CommentArchive:
+    """
+    A persistent map from (source, comment id) to the VADER compound score of
+    the comment.
+    """
+
+    def __init__(self, path: str, enabled: bool = True):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        path : str
+            Path of the SQLite database file.
+        enabled : bool, optional
+            When False every comment is scored and nothing is stored, by
+            default True
+        """
+        self.path = path
+        self.enabled = enabled
+        self._connection = None
+        self._lock = threading.Lock()
+        self._reused = 0
+        self._scored = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # Called with the lock held. The connection is opened on first use
+        # and shared by all threads.
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS comments ("
+                "source TEXT NOT NULL, "
+                "comment_id TEXT NOT NULL, "
+                "text_hash TEXT NOT NULL, "
+                "score REAL NOT NULL, "
+                "PRIMARY KEY (source, comment_id))"
+            )
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def _lookup(
+        self, source: str, comment_ids: List[str]
+    ) -> Dict[str, Tuple[str, float]]:
+        found: Dict[str, Tuple[str, float]] = {}
+        with self._lock:
+            connection = self._connect()
+            for start in range(0, len(comment_ids), LOOKUP_CHUNK_SIZE):
+                chunk = comment_ids[start : start + LOOKUP_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                rows = connection.execute(
+                    "SELECT comment_id, text_hash, score FROM comments "
+                    f"WHERE source = ? AND comment_id IN ({placeholders})",
+                    [source, *chunk],
+                )
+                for comment_id, digest, score in rows:
+                    found[comment_id] = (digest, score)
+        return found
+
+    def _store(self, source: str, rows: List[Tuple[str, str, float]]):
+        with self._lock:
+            connection = self._connect()
+            connection.executemany(
+                "INSERT OR REPLACE INTO comments "
+                "(source, comment_id, text_hash, score) VALUES (?, ?, ?, ?)",
+                [(source, *row) for row in rows],
+            )
+            connection.commit()
+
+    def score(
+        self, source: str, comments: Sequence[Comment]
+    ) -> Tuple[np.ndarray, int]:
+        """
+        Score a batch of comments, reusing the archived score of every
+        comment whose text has not changed since it was last seen.
+
+        Parameters
+        ----------
+        source : str
+            The platform the comment ids belong to, e.g. "youtube".
+        comments : Sequence[Comment]
+            (comment id, text) pairs. Comments without an id are scored but
+            not archived.
+
+        Returns
+        -------
+        Tuple[np.ndarray, int]
+            An array of VADER compound scores in the same order as comments,
+            and the number of comments that were scored rather than reused.
+        """
+        if not self.enabled:
+            return SCORING_POOL.score([text for _, text in comments]), len(
+                comments
+            )
+
+        digests = [text_hash(text) for _, text in comments]
+        archived = self._lookup(
+            source, list({comment_id for comment_id, _ in comments if comment_id})
+        )
+
+        scores = np.empty(len(comments), dtype=np.float64)
+        missing: List[int] = []
+        for index, ((comment_id, _), digest) in enumerate(zip(comments, digests)):
+            entry = archived.get(comment_id)
+            if entry is not None and entry[0] == digest:
+                scores[index] = entry[1]
+            else:
+                missing.append(index)
+
+        if missing:
+            new_scores = SCORING_POOL.score(
+                [comments[index][1] for index in missing]
+            )
+            scores[missing] = new_scores
+            self._store(
+                source,
+                [
+                    (comments[index][0], digests[index], float(score))
+                    for index, score in zip(missing, new_scores)
+                    if comments[index][0]
+                ],
+            )
+
+        with self._lock:
+            self._reused += len(comments) - len(missing)
+            self._scored += len(missing)
+        return scores, len(missing)
+
+    def stats(self) -> CommentArchiveStats:
+        """
+        Counters showing how much scoring the archive saved.
+
+        Returns
+        -------
+        CommentArchiveStats
+            The current statistics.
+        """
+        with self._lock:
+            entries = 0
+            if self.enabled:
+                entries = (
+                    self._connect()
+                    .execute("SELECT COUNT(*) FROM comments")
+                    .fetchone()[0]
+                )
+            return CommentArchiveStats(
+                reused=self._reused, scored=self._scored, entries=entries
+            )
+
+
+COMMENT_ARCHIVE = CommentArchive(
+    path=get_setting("COMMENT_ARCHIVE_PATH", "")
+    or get_data_path("comments.sqlite3"),
+    enabled=get_setting("COMMENT_ARCHIVE_ENABLED", True),
+)
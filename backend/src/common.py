@@ -3,16 +3,31 @@ Some common utility functions
 """
 
 import os
-from typing import Any, Dict, Union
+import threading
+from typing import Any, Dict, Iterable, TypeVar, Union
 
+import numpy as np
+from model import ChainType, TargetQuery  # pylint: disable=import-error
 from nltk.sentiment import SentimentIntensityAnalyzer
 
-SERVICES: Dict[str, Any] = {}
+T = TypeVar("T")
+
+# Comments scoring at or above / below these compound values are counted as
+# positive / negative. Anything in between is treated as neutral.
+POSITIVE_THRESHOLD = 0.1
+NEGATIVE_THRESHOLD = -0.1
+
+# A single analyzer is created when the process starts and shared by every
+# request. Only the first analyzer reads the vader_lexicon; later ones reuse
+# nltk's cached copy, so sharing saves little next to polarity_scores itself.
+# polarity_scores does not mutate the analyzer, so it is safe to call from
+# multiple threads.
+SENTIMENT_ANALYZER = SentimentIntensityAnalyzer()
 
 
 def perform_sentiment_analysis(text: str) -> float:
     """
-    Perform a sentiment analysis on each comment.
+    Perform a sentiment analysis on a single comment.
 
     Parameters
     ----------
@@ -22,15 +37,131 @@ def perform_sentiment_analysis(text: str) -> float:
     Returns
     -------
     float
-        A value between 0.0 and 1.0 with 0.0 being no positive sentiment and
-        1.0 being 100% positive sentiment.
+        The VADER compound score between -1.0 (most negative) and 1.0
+        (most positive).
+    """
+    return SENTIMENT_ANALYZER.polarity_scores(text)["compound"]
+
+
+def score_batch(texts: Iterable[str]) -> np.ndarray:
+    """
+    Perform a sentiment analysis on a batch of comments using the shared
+    analyzer. Identical texts (e.g. spam or copy-paste replies) are only
+    scored once.
+
+    Parameters
+    ----------
+    texts : Iterable[str]
+        The comments to be analyzed.
+
+    Returns
+    -------
+    np.ndarray
+        An array of VADER compound scores in the same order as texts.
+    """
+    polarity_scores = SENTIMENT_ANALYZER.polarity_scores
+    seen: Dict[str, float] = {}
+    scores = []
+    for text in texts:
+        score = seen.get(text)
+        if score is None:
+            score = polarity_scores(text)["compound"]
+            seen[text] = score
+        scores.append(score)
+    return np.asarray(scores, dtype=np.float64)
+
+
+def compute_positive_percentage(scores: np.ndarray) -> float:
+    """
+    Turn a set of compound scores into the percentage of positive comments.
+    Neutral comments are ignored.
+
+    Parameters
+    ----------
+    scores : np.ndarray
+        VADER compound scores as returned by score_batch.
+
+    Returns
+    -------
+    float
+        A value between 0.0 and 100.0 with 0.0 being no positive sentiment and
+        100.0 being 100% positive sentiment.
+    """
+    positive = int(np.count_nonzero(scores >= POSITIVE_THRESHOLD))
+    negative = int(np.count_nonzero(scores <= NEGATIVE_THRESHOLD))
+    total = positive + negative
+    return (positive / total) * 100.0 if total > 0 else 0.0
+
+
+def normalize_target(target: str) -> str:
+    """
+    Normalize a query target so that trivially different spellings of the
+    same company (case, surrounding or repeated whitespace) share cache
+    entries.
+
+    Parameters
+    ----------
+    target : str
+        The common name of the company.
+
+    Returns
+    -------
+    str
+        The normalized target.
+    """
+    return " ".join(target.lower().split())
+
+
+class PipelineContext:
     """
-    # Initialize VADER sentiment analyzer
-    sid = SentimentIntensityAnalyzer()
+    Per-request state that is passed through the pipeline. It carries the
+    query and collects the result of each chain so that concurrent requests
+    never share data.
+    """
+
+    def __init__(self, query: TargetQuery):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        query : TargetQuery
+            The common name of the company.
+        """
+        self.query = query
+        self.results: Dict[ChainType, Any] = {}
+        self._lock = threading.Lock()
+
+    def store(self, key: ChainType, data: Any):
+        """
+        Store the result of a chain.
 
-    # Perform sentiment analysis
-    sentiment_score = sid.polarity_scores(text)["compound"]
-    return sentiment_score
+        Parameters
+        ----------
+        key : ChainType
+            The type of data.
+        data : Any
+            The chain output.
+        """
+        with self._lock:
+            self.results[key] = data
+
+    def get(self, key: ChainType) -> Any:
+        """
+        Get the result of a chain.
+
+        Parameters
+        ----------
+        key : ChainType
+            The type of data.
+
+        Returns
+        -------
+        Any
+            The chain output.
+        """
+        with self._lock:
+            return self.results[key]
 
 
 def get_secret(key: str) -> Union[str, None]:
@@ -54,3 +185,51 @@ def get_secret(key: str) -> Union[str, None]:
             return f.read().strip()
     # Fall back to environment variable
     return os.environ.get(key)
+
+
+def get_setting(key: str, default: T) -> T:
+    """
+    Read a tunable setting from the environment.
+
+    Parameters
+    ----------
+    key : str
+        Name of the environmental variable.
+    default : T
+        Value used when the variable is not set. The raw string is cast to the
+        type of the default.
+
+    Returns
+    -------
+    T
+        The setting value.
+    """
+    value = os.environ.get(key)
+    if value is None:
+        return default
+    if isinstance(default, bool):
+        return value.strip().lower() in ("1", "true", "yes", "on")  # type: ignore
+    return type(default)(value)  # type: ignore
+
+
+def get_data_path(name: str) -> str:
+    """
+    Get the path of a file in the persistent data directory. The directory is
+    set with the DATA_DIR environmental variable and created if needed.
+
+    Parameters
+    ----------
+    name : str
+        The file name.
+
+    Returns
+    -------
+    str
+        The full path of the file.
+    """
+    data_dir = get_setting(
+        "DATA_DIR",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data"),
+    )
+    os.makedirs(data_dir, exist_ok=True)
+    return os.path.join(data_dir, name)
@@ -0,0 +1,257 @@
+"""
+This module is a test driver for concurrent pipeline requests. The upstream
+sources are replaced by stand-ins that echo the target back after a random
+delay, so every response can be matched against the request that produced it.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Generator, List, Tuple
+from unittest import mock
+
+import endpoint  # pylint: disable=import-error
+from bonobo.config import use
+from common import PipelineContext  # pylint: disable=import-error
+from model import (  # pylint: disable=import-error
+    ChainType,
+    CombinedData,
+    Description,
+    Logo,
+    Sentiment,
+    StockData,
+    StockInfo,
+    TargetQuery,
+)
+
+MAX_DELAY = 0.05
+
+
+def random_pause(chain: ChainType):
+    """
+    Default delay of the stand-ins.
+
+    Parameters
+    ----------
+    chain : ChainType
+        The source being simulated.
+    """
+    time.sleep(random.uniform(0, MAX_DELAY))
+
+
+def _target_number(target: str) -> float:
+    return float(target.rsplit("-", 1)[1])
+
+
+def stand_in_patches(pause: Callable[[ChainType], None] = random_pause) -> Dict:
+    """
+    Build stand-ins for every upstream source used by either pipeline backend.
+    Each stand-in echoes the target back after calling pause.
+
+    Parameters
+    ----------
+    pause : Callable[[ChainType], None], optional
+        Called by each source to simulate upstream latency, by default a
+        random delay of up to MAX_DELAY seconds.
+
+    Returns
+    -------
+    Dict
+        Replacements for the names used in the endpoint module.
+    """
+
+    def fetch_logo(query: TargetQuery) -> List[Logo]:
+        pause(ChainType.LOGO_DATA)
+        return [
+            Logo(
+                index=0,
+                url=f"https://logo/{query.target}",
+                title=query.target,
+                distance=0,
+            )
+        ]
+
+    def fetch_description(query: TargetQuery) -> Description:
+        pause(ChainType.DESCRPTION_DATA)
+        return Description(text=query.target)
+
+    def fetch_stock_info(query: TargetQuery) -> StockInfo:
+        pause(ChainType.STOCK_INFO_DATA)
+        return StockInfo(
+            ticker_symbol=query.target.upper(),
+            company_name=query.target,
+            stock_price=_target_number(query.target),
+        )
+
+    def fetch_stock_data(query: TargetQuery) -> List[StockData]:
+        pause(ChainType.STOCK_PRICE_DATA)
+        return [StockData(month=query.target, price=_target_number(query.target))]
+
+    def sentiment_stand_ins(chain: ChainType) -> Tuple[Callable, ...]:
+        def perform_search(query: TargetQuery) -> str:
+            pause(chain)
+            return query.target
+
+        def perform_extract(target: str) -> str:
+            return target
+
+        def perform_transform(target: str) -> Sentiment:
+            return Sentiment(score=_target_number(target))
+
+        @use("context")
+        def search(context: PipelineContext) -> Generator[str, None, None]:
+            yield perform_search(context.query)
+
+        def extract(target: str) -> Generator[str, None, None]:
+            yield perform_extract(target)
+
+        def transform(
+            target: str,
+        ) -> Generator[Tuple[ChainType, Sentiment], None, None]:
+            yield (chain, perform_transform(target))
+
+        return (
+            perform_search,
+            perform_extract,
+            perform_transform,
+            search,
+            extract,
+            transform,
+        )
+
+    patches = {
+        "fetch_logo": fetch_logo,
+        "fetch_description": fetch_description,
+        "fetch_stock_info": fetch_stock_info,
+        "fetch_stock_data": fetch_stock_data,
+    }
+    youtube_names = (
+        "perform_extract_search_data",
+        "perform_extract_comment_thread_data",
+        "perform_transform_comment_thread_data",
+        "extract_search_data",
+        "extract_comment_thread_data",
+        "transform_comment_thread_data",
+    )
+    reddit_names = (
+        "perform_reddit_extract_search_data",
+        "perform_reddit_extract_comment_thread_data",
+        "perform_reddit_transform_comment_thread_data",
+        "reddit_extract_search_data",
+        "reddit_extract_comment_thread_data",
+        "reddit_transform_comment_thread_data",
+    )
+    patches.update(
+        zip(youtube_names, sentiment_stand_ins(ChainType.YOUTUBE_SENTIMENT_DATA))
+    )
+    patches.update(
+        zip(reddit_names, sentiment_stand_ins(ChainType.REDDIT_SENTIMENT_DATA))
+    )
+    return patches
+
+
+def check(target: str, data: CombinedData) -> List[str]:
+    """
+    Compare every field of a response against the target that requested it.
+
+    Parameters
+    ----------
+    target : str
+        The target of the request.
+    data : CombinedData
+        The response.
+
+    Returns
+    -------
+    List[str]
+        A list of mismatch descriptions. Empty if the response is correct.
+    """
+    number = _target_number(target)
+    expected = {
+        "logo": data.logo[0].title == target,
+        "description": data.description.text == target,
+        "stock_info": data.stock_info.company_name == target,
+        "stock_data": data.stock_data[0].month == target,
+        "youtube_sentiment": data.youtube_sentiment.score == number,
+        "reddit_sentiment": data.reddit_sentiment.score == number,
+    }
+    return [
+        f"{target}: {field} mismatch" for field, ok in expected.items() if not ok
+    ]
+
+
+def main(n: int, backend: str) -> int:
+    """
+    Main processing method.
+
+    Parameters
+    ----------
+    n : int
+        Number of concurrent requests, each for a different target.
+    backend : str
+        The pipeline backend, "asyncio" or "bonobo".
+
+    Returns
+    -------
+    int
+        The number of mismatched fields.
+    """
+    targets = [f"target-{i}" for i in range(n)]
+    patches = stand_in_patches()
+    # Call the undecorated endpoint so the driver does not need a trace
+    # collector.
+    get_all_data = endpoint.get_all_data.__wrapped__
+    with mock.patch.multiple(endpoint, **patches), mock.patch.dict(
+        os.environ, {"PIPELINE_BACKEND": backend}
+    ):
+        with ThreadPoolExecutor(max_workers=n) as executor:
+            start = time.perf_counter()
+            responses = list(
+                executor.map(
+                    lambda t: get_all_data(TargetQuery(target=t)), targets
+                )
+            )
+            elapsed = time.perf_counter() - start
+
+    errors = []
+    for target, data in zip(targets, responses):
+        errors.extend(check(target, data))
+    print(
+        f"backend={backend} requests={n} elapsed={elapsed:.2f}s "
+        + f"mismatches={len(errors)}"
+    )
+    for error in errors:
+        print(error)
+    return len(errors)
+
+
+if __name__ == "__main__":
+
+    # 1. Create an ArgumentParser object
+    parser = argparse.ArgumentParser(
+        description="Fire concurrent requests for different targets and check "
+        + "that no data is mixed between them"
+    )
+
+    # 2. Add arguments
+    parser.add_argument(
+        "-n", type=int, default=20, help="number of concurrent requests"
+    )
+
+    parser.add_argument(
+        "--backend",
+        type=str,
+        default="all",
+        choices=["asyncio", "bonobo", "all"],
+        help="the pipeline backend, by default both in turn",
+    )
+
+    # 3. Parse the arguments
+    args = parser.parse_args()
+
+    # 4. Invoke main method
+    backends = ["asyncio", "bonobo"] if args.backend == "all" else [args.backend]
+    sys.exit(1 if sum(main(args.n, backend) for backend in backends) else 0)
@@ -1,27 +1,150 @@
 """
 Decorators to simplify opentel tracing.
+
+Tracing is configured once per process with setup_tracing. Spans are exported
+in the background by a BatchSpanProcessor, and parent spans are tracked by
+the OpenTelemetry context, which is stored in contextvars, so concurrent
+requests each get their own trace tree.
 """
 
 import functools
+import threading
+from typing import Optional
 
-from opentelemetry import trace  # pylint: disable=import-error
+from common import get_setting  # pylint: disable=import-error
+from opentelemetry import context, trace  # pylint: disable=import-error
 from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import (  # pylint: disable=import-error, disable=line-too-long
     OTLPSpanExporter,
 )
 from opentelemetry.sdk.resources import Resource  # pylint: disable=import-error
 from opentelemetry.sdk.trace import TracerProvider  # pylint: disable=import-error
+from opentelemetry.sdk.trace import sampling  # pylint: disable=import-error
 from opentelemetry.sdk.trace.export import (  # pylint: disable=import-error
-    SimpleSpanProcessor,
+    BatchSpanProcessor,
+    SpanExporter,
 )
 from opentelemetry.trace import Status, StatusCode  # pylint: disable=import-error
-from opentelemetry.trace.propagation.tracecontext import (  # pylint: disable=import-error, disable=line-too-long
-    TraceContextTextMapPropagator,
-)
+
+SERVICE_NAME = "stock-analyzer"
+
+tracer = trace.get_tracer(__name__)
+
+# Set by setup_tracing. Until then, or when every span would be dropped, the
+# decorator calls straight through.
+_enabled = False
+# True when the sampler follows the parent's decision, so the children of a
+# dropped span can be skipped without asking the sampler.
+_follow_parent = False
+
+_setup_lock = threading.Lock()
+_provider = None
+
+
+def build_sampler(name: str, ratio: float) -> sampling.Sampler:
+    """
+    Build a sampler from its name.
+
+    Parameters
+    ----------
+    name : str
+        One of "always_on", "always_off", "ratio", "parent_always_on",
+        "parent_always_off" or "parent_ratio". The parent variants follow the
+        sampling decision of the parent span and only decide for root spans.
+    ratio : float
+        Fraction of traces kept by the ratio samplers.
+
+    Returns
+    -------
+    sampling.Sampler
+        The sampler.
+
+    Raises
+    ------
+    ValueError
+        Will raise an exception if the name is unknown.
+    """
+    roots = {
+        "always_on": sampling.ALWAYS_ON,
+        "always_off": sampling.ALWAYS_OFF,
+        "ratio": sampling.TraceIdRatioBased(ratio),
+    }
+    if name in roots:
+        return roots[name]
+    prefix, _, root = name.partition("_")
+    if prefix == "parent" and root in roots:
+        return sampling.ParentBased(roots[root])
+    raise ValueError(f"unknown sampler {name}")
+
+
+def setup_tracing(exporter: Optional[SpanExporter] = None) -> bool:
+    """
+    Install the tracer provider. Calling it again has no effect.
+
+    The sampler is set with TRACE_SAMPLER (default "parent_ratio") and
+    TRACE_SAMPLE_RATIO (default 1.0), the collector with
+    OTEL_EXPORTER_ENDPOINT, and TRACING_ENABLED=false leaves tracing off.
+
+    Parameters
+    ----------
+    exporter : Optional[SpanExporter], optional
+        The span exporter, by default an OTLP gRPC exporter.
+
+    Returns
+    -------
+    bool
+        True if a provider is installed.
+    """
+    global _provider, _enabled, _follow_parent  # pylint: disable=global-statement
+    with _setup_lock:
+        if _provider is not None:
+            return True
+        if not get_setting("TRACING_ENABLED", True):
+            return False
+        sampler = build_sampler(
+            get_setting("TRACE_SAMPLER", "parent_ratio"),
+            get_setting("TRACE_SAMPLE_RATIO", 1.0),
+        )
+        provider = TracerProvider(
+            resource=Resource.create({"service.name": SERVICE_NAME}),
+            sampler=sampler,
+        )
+        if exporter is None:
+            exporter = OTLPSpanExporter(
+                endpoint=get_setting(
+                    "OTEL_EXPORTER_ENDPOINT", "http://host.docker.internal:4317"
+                )
+            )
+        # Spans are queued and exported from a background thread instead of
+        # on the request thread.
+        provider.add_span_processor(BatchSpanProcessor(exporter))
+        trace.set_tracer_provider(provider)
+        _provider = provider
+        _enabled = sampler is not sampling.ALWAYS_OFF
+        _follow_parent = isinstance(sampler, sampling.ParentBased)
+        return True
+
+
+def shutdown_tracing():
+    """
+    Export the queued spans and stop the exporter.
+    """
+    global _enabled  # pylint: disable=global-statement
+    with _setup_lock:
+        if _provider is not None:
+            _enabled = False
+            _provider.shutdown()
 
 
 def span_decorator(func):
     """
-    Decorator to create a new span.
+    Decorator to create a new span. The span is a child of the current span
+    of the calling thread or task, if any.
+
+    Calls cost about 0.3 us more than undecorated ones while tracing is off,
+    and about 3 us more for the children of a dropped parent, which are not
+    created at all. A span that the sampler has to decide on costs what the
+    SDK needs to create and end it, 25 to 60 us on a development machine
+    (see benchmark_tracing.py), so keep decorated functions coarse.
 
     Parameters
     ----------
@@ -33,53 +156,28 @@ def span_decorator(func):
     _type_
         A new function that includes the wrapper.
     """
+    name = func.__name__
 
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        print(f"IN span_decorator. name={func.__name__}")
-        result = None
-        if not hasattr(span_decorator, "span_context"):
-            resource = Resource.create({"service.name": "stock-analyzer"})
-            provider = TracerProvider(resource=resource)
-            trace.set_tracer_provider(provider)
-
-            # otlp_exporter = ConsoleSpanExporter()
-            otlp_exporter = OTLPSpanExporter(
-                endpoint="http://host.docker.internal:4317"
-            )  # Adjust endpoint as needed
-            # otlp_exporter = OTLPSpanExporter(endpoint="http://localhost:4317")
-            span_processor = SimpleSpanProcessor(otlp_exporter)
-            provider.add_span_processor(span_processor)
-            # Set global propagators
-            propagator = TraceContextTextMapPropagator()
-            tracer = trace.get_tracer(__name__)
-            with tracer.start_as_current_span(func.__name__) as span:
-                context = {}
-                propagator.inject(context)
-                setattr(span_decorator, "span_context", context)
-                try:
-                    result = func(*args, **kwargs)
-                    span.set_status(Status(StatusCode.OK))
-                except Exception as e:
-                    print(f"Caught an error: {str(e)}")
-                    span.record_exception(e)
-                    # Set the span status to ERROR
-                    span.set_status(Status(StatusCode.ERROR, description=str(e)))
-                delattr(span_decorator, "span_context")
-        else:
-            tracer = trace.get_tracer(__name__)
-            context = getattr(span_decorator, "span_context")
-            propagator = TraceContextTextMapPropagator()
-            extracted_context = propagator.extract(
-                context
-            )  # Extract context from carrier
-            with trace.use_span(
-                trace.get_current_span(extracted_context), end_on_exit=True
-            ):
-                with tracer.start_as_current_span(func.__name__):
-                    # This span will be a child of the parent-span from the
-                    # sending service
-                    result = func(*args, **kwargs)
-        return result
+        if not _enabled:
+            return func(*args, **kwargs)
+        parent = trace.get_current_span().get_span_context()
+        if _follow_parent and parent.is_valid and not parent.trace_flags.sampled:
+            return func(*args, **kwargs)
+        # Equivalent to start_as_current_span without its nested context
+        # managers, which dominate the cost of a span.
+        span = tracer.start_span(name)
+        token = context.attach(trace.set_span_in_context(span))
+        try:
+            return func(*args, **kwargs)
+        except BaseException as e:
+            if span.is_recording():
+                span.record_exception(e)
+                span.set_status(Status(StatusCode.ERROR, description=str(e)))
+            raise
+        finally:
+            context.detach(token)
+            span.end()
 
     return wrapper
@@ -0,0 +1,323 @@
+"""
+Persistent store of company descriptions. A description is written by the
+OpenAI chat API once per company and then served from SQLite, with an
+in-memory copy for hot entries. Entries are keyed by the company's resolved
+ticker, so "coke", "Coca-Cola" and "KO" share one description. Entries older
+than the TTL are served as is while they are regenerated in the background.
+"""
+
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+
+from clients import get_openai_client  # pylint: disable=import-error
+from common import (  # pylint: disable=import-error
+    get_data_path,
+    get_setting,
+    normalize_target,
+)
+from metrics import upstream_call  # pylint: disable=import-error
+from model import Description  # pylint: disable=import-error
+from model import DescriptionStoreStats  # pylint: disable=import-error
+from tickers import TICKER_INDEX  # pylint: disable=import-error
+
+DAY = 24 * 60 * 60.0
+
+DESCRIPTION_MODEL = get_setting("DESCRIPTION_MODEL", "gpt-3.5-turbo")
+
+# Entries kept in memory in front of SQLite. The map is cleared when full.
+MEMORY_SIZE = 10000
+
+
+def company_identity(target: str) -> Tuple[str, str]:
+    """
+    The key under which a company's description is stored, and the name it
+    is described by.
+
+    Parameters
+    ----------
+    target : str
+        The common name of the company.
+
+    Returns
+    -------
+    Tuple[str, str]
+        ("ticker:<symbol>", "<listed name> (<symbol>)") when the target
+        resolves to a ticker, otherwise ("name:<normalized target>", target).
+    """
+    match = TICKER_INDEX.resolve(target)
+    if match is not None:
+        return f"ticker:{match.symbol}", f"{match.name} ({match.symbol})"
+    return f"name:{normalize_target(target)}", target
+
+
+def generate_description(name: str) -> str:
+    """
+    Use chat gpt to write a simple description of a company.
+
+    Parameters
+    ----------
+    name : str
+        The name of the company.
+
+    Returns
+    -------
+    str
+        A paragraph describing the company.
+    """
+    client = get_openai_client()
+    with upstream_call("openai", "chat_completion"):
+        response = client.chat.completions.create(
+            model=DESCRIPTION_MODEL,
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant."},
+                {
+                    "role": "user",
+                    "content": f"Briefly describe the company {name} "
+                    + "in a paragraph",
+                },
+            ],
+        )
+    return response.choices[0].message.content
+
+
+class DescriptionStore:
+    """
+    A persistent map from company identity to its description.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl: float,
+        generate: Callable[[str], str],
+        refresh_workers: int = 2,
+        enabled: bool = True,
+    ):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        path : str
+            Path of the SQLite database file.
+        ttl : float
+            Seconds after which a description is regenerated in the
+            background.
+        generate : Callable[[str], str]
+            Writes the description of a company name.
+        refresh_workers : int, optional
+            Threads used for background refreshes, by default 2
+        enabled : bool, optional
+            When False every description is generated, by default True
+        """
+        self.path = path
+        self.ttl = ttl
+        self.generate = generate
+        self.enabled = enabled
+        self._connection = None
+        self._memory: Dict[str, Tuple[str, float]] = {}
+        self._refreshing: Set[str] = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=refresh_workers, thread_name_prefix="description-refresh"
+        )
+        self._hits = 0
+        self._stale_hits = 0
+        self._misses = 0
+        self._refreshes = 0
+        self._refresh_errors = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # Called with the lock held. The connection is opened on first use
+        # and shared by all threads.
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS descriptions ("
+                "company TEXT PRIMARY KEY, "
+                "name TEXT NOT NULL, "
+                "text TEXT NOT NULL, "
+                "generated_at REAL NOT NULL)"
+            )
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def _lookup(self, key: str) -> Optional[Tuple[str, float]]:
+        # Called with the lock held.
+        entry = self._memory.get(key)
+        if entry is None:
+            entry = (
+                self._connect()
+                .execute(
+                    "SELECT text, generated_at FROM descriptions "
+                    "WHERE company = ?",
+                    (key,),
+                )
+                .fetchone()
+            )
+            if entry is not None:
+                self._remember(key, entry)
+        return entry
+
+    def _remember(self, key: str, entry: Tuple[str, float]):
+        # Called with the lock held.
+        if len(self._memory) >= MEMORY_SIZE:
+            self._memory.clear()
+        self._memory[key] = entry
+
+    def _save(self, key: str, name: str, text: str, generated_at: float):
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO descriptions "
+                "(company, name, text, generated_at) VALUES (?, ?, ?, ?)",
+                (key, name, text, generated_at),
+            )
+            connection.commit()
+            self._remember(key, (text, generated_at))
+
+    def describe(self, target: str) -> Description:
+        """
+        Get the description of a company, generating it on a miss. A
+        description older than the TTL is returned immediately and
+        regenerated in the background.
+
+        Parameters
+        ----------
+        target : str
+            The common name of the company.
+
+        Returns
+        -------
+        Description
+            A simple description of the company.
+        """
+        key, name = company_identity(target)
+        if not self.enabled:
+            return Description(text=self.generate(name))
+        now = time.time()
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                text, generated_at = entry
+                if now - generated_at < self.ttl:
+                    self._hits += 1
+                else:
+                    self._stale_hits += 1
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        self._executor.submit(self._refresh, key, name)
+                return Description(text=text)
+            self._misses += 1
+        text = self.generate(name)
+        self._save(key, name, text, now)
+        return Description(text=text)
+
+    def prewarm(
+        self, targets: Iterable[str], workers: int = 4, force: bool = False
+    ) -> Dict[str, str]:
+        """
+        Generate the descriptions of several companies ahead of requests.
+        Companies with a fresh description are skipped.
+
+        Parameters
+        ----------
+        targets : Iterable[str]
+            Common names of the companies. Names of the same company are
+            generated once.
+        workers : int, optional
+            Number of descriptions generated concurrently, by default 4
+        force : bool, optional
+            Regenerate fresh descriptions too, by default False
+
+        Returns
+        -------
+        Dict[str, str]
+            The outcome of every company key: "fresh", "generated" or the
+            error message.
+        """
+        companies: Dict[str, str] = {}
+        for target in targets:
+            key, name = company_identity(target)
+            companies.setdefault(key, name)
+
+        now = time.time()
+        outcomes: Dict[str, str] = {}
+        pending = []
+        for key, name in companies.items():
+            with self._lock:
+                entry = self._lookup(key)
+            if not force and entry is not None and now - entry[1] < self.ttl:
+                outcomes[key] = "fresh"
+            else:
+                pending.append((key, name))
+
+        def generate(key: str, name: str) -> str:
+            try:
+                self._save(key, name, self.generate(name), time.time())
+                return "generated"
+            except Exception as e:  # pylint: disable=broad-except
+                return f"error: {e}"
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                key: executor.submit(generate, key, name) for key, name in pending
+            }
+        for key, future in futures.items():
+            outcomes[key] = future.result()
+        return outcomes
+
+    def stats(self) -> DescriptionStoreStats:
+        """
+        Counters of the description store.
+
+        Returns
+        -------
+        DescriptionStoreStats
+            The current statistics.
+        """
+        with self._lock:
+            entries = 0
+            if self.enabled:
+                entries = (
+                    self._connect()
+                    .execute("SELECT COUNT(*) FROM descriptions")
+                    .fetchone()[0]
+                )
+            return DescriptionStoreStats(
+                entries=entries,
+                hits=self._hits,
+                stale_hits=self._stale_hits,
+                misses=self._misses,
+                refreshes=self._refreshes,
+                refresh_errors=self._refresh_errors,
+            )
+
+    def _refresh(self, key: str, name: str):
+        try:
+            self._save(key, name, self.generate(name), time.time())
+            with self._lock:
+                self._refreshes += 1
+        except Exception as e:  # pylint: disable=broad-except
+            # Keep serving the old description.
+            print(f"Error: description refresh failed company={key} e={e}")
+            with self._lock:
+                self._refresh_errors += 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+
+DESCRIPTION_STORE = DescriptionStore(
+    path=get_setting("DESCRIPTION_STORE_PATH", "")
+    or get_data_path("descriptions.sqlite3"),
+    ttl=get_setting("DESCRIPTION_STORE_TTL", 90 * DAY),
+    generate=generate_description,
+    refresh_workers=get_setting("DESCRIPTION_STORE_WORKERS", 2),
+    enabled=get_setting("DESCRIPTION_STORE_ENABLED", True),
+)
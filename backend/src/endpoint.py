@@ -3,47 +3,246 @@ Playwright driver that executes operations based on a profile.
 """
 
 import argparse
-from datetime import date, datetime
-from typing import Any, Dict, Generator, List, Tuple
+import functools
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import Any, AsyncIterator, Dict, Generator, List, Optional, Set, Tuple
 
 import bonobo
 import Levenshtein
-import openai
 import requests
-from bs4 import BeautifulSoup
-from common import SERVICES, get_secret  # pylint: disable=import-error
-from dateutil.relativedelta import relativedelta
-from decorators import span_decorator  # pylint: disable=import-error
-from fastapi import FastAPI
+from bonobo.config import use
+from browser_pool import BROWSER_POOL  # pylint: disable=import-error
+from cache import RESULT_CACHE  # pylint: disable=import-error
+from clients import (  # pylint: disable=import-error
+    HTTP_TIMEOUT,
+    close_clients,
+    get_http_session,
+    get_polygon_client,
+)
+from comment_archive import COMMENT_ARCHIVE  # pylint: disable=import-error
+from common import (  # pylint: disable=import-error
+    PipelineContext,
+    get_setting,
+    normalize_target,
+)
+from decorators import (  # pylint: disable=import-error
+    setup_tracing,
+    shutdown_tracing,
+    span_decorator,
+)
+from description_store import DESCRIPTION_STORE  # pylint: disable=import-error
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from html_parsing import find_element  # pylint: disable=import-error
+from logo_store import LOGO_STORE  # pylint: disable=import-error
+from metrics import (  # pylint: disable=import-error
+    CONTENT_TYPE,
+    HTTP_REQUEST_DURATION,
+    HTTP_REQUESTS,
+    HTTP_REQUESTS_IN_FLIGHT,
+    render_metrics,
+    upstream_call,
+)
 from model import (  # pylint: disable=import-error
+    BatchResult,
+    BrowserPoolStats,
+    CacheStats,
     ChainType,
     CombinedData,
+    CommentArchiveStats,
     Description,
+    DescriptionStoreStats,
     Logo,
+    LogoStoreStats,
+    PriceStoreStats,
+    ScoringPoolStats,
     Sentiment,
+    SingleFlightStats,
+    SourceFrame,
+    StageError,
     StockData,
     StockInfo,
+    SummaryFrame,
     TargetQuery,
+    TickerIndexStats,
 )
 from opentelemetry import trace  # pylint: disable=import-error
-from playwright.sync_api import sync_playwright
-from polygon import RESTClient
+from orchestrator import (  # pylint: disable=import-error
+    PipelineError,
+    Stages,
+    iter_sources,
+    run_batch,
+    run_sources,
+)
+from playwright.async_api import Page
+from price_store import (  # pylint: disable=import-error
+    MONTH_NAMES,
+    PRICE_STORE,
+    polygon_fetcher,
+    shift_month,
+    to_month,
+)
 from pydantic import BaseModel
 from reddit import (  # pylint: disable=import-error
+    perform_reddit_extract_comment_thread_data,
+    perform_reddit_extract_search_data,
+    perform_reddit_transform_comment_thread_data,
     reddit_extract_comment_thread_data,
     reddit_extract_search_data,
     reddit_transform_comment_thread_data,
 )
+from scoring_pool import SCORING_POOL  # pylint: disable=import-error
+from singleflight import SINGLE_FLIGHT  # pylint: disable=import-error
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from tickers import TICKER_INDEX  # pylint: disable=import-error
 from youtube import (  # pylint: disable=import-error
     extract_comment_thread_data,
     extract_search_data,
+    perform_extract_comment_thread_data,
+    perform_extract_search_data,
+    perform_transform_comment_thread_data,
     transform_comment_thread_data,
 )
 
 origins = ["*"]
 
-app = FastAPI()
+# The CombinedData field that holds the result of each chain type.
+COMBINED_FIELDS: Dict[ChainType, str] = {
+    ChainType.LOGO_DATA: "logo",
+    ChainType.DESCRPTION_DATA: "description",
+    ChainType.STOCK_INFO_DATA: "stock_info",
+    ChainType.STOCK_PRICE_DATA: "stock_data",
+    ChainType.YOUTUBE_SENTIMENT_DATA: "youtube_sentiment",
+    ChainType.REDDIT_SENTIMENT_DATA: "reddit_sentiment",
+}
+
+STREAM_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+}
+
+# Logo search results page fetched directly before falling back to the
+# browser, and whether that fast path is used.
+LOGO_SEARCH_URL = get_setting(
+    "LOGO_SEARCH_URL", "https://www.brandsoftheworld.com/search/logo"
+)
+LOGO_HTTP_SEARCH = get_setting("LOGO_HTTP_SEARCH", True)
+# Symbol lookup page the stock info is read from.
+STOCK_INFO_URL = get_setting(
+    "STOCK_INFO_URL", "https://stockanalysis.com/symbol-lookup"
+)
+# Number of top logos copied to the logo store, and the base url under
+# which clients reach this backend, e.g. "https://api.example.com". Empty
+# gives root-relative urls, for a frontend served from the same origin.
+LOGO_STORE_TOP = get_setting("LOGO_STORE_TOP", 3)
+LOGO_PUBLIC_BASE_URL = get_setting("LOGO_PUBLIC_BASE_URL", "").rstrip("/")
+
+# Months of price history returned by /get-stock-data/ before the current one.
+STOCK_DATA_MONTHS = get_setting("STOCK_DATA_MONTHS", 12)
+
+# bonobo.run is not safe to call from several threads at once; its node
+# contexts are torn down by whichever run finishes first. Graphs are run one
+# at a time.
+BONOBO_LOCK = threading.Lock()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """
+    Create long-lived resources at startup and release them at shutdown.
+
+    Parameters
+    ----------
+    app : FastAPI
+        The application.
+
+    Yields
+    ------
+    AsyncIterator[None]
+        Control while the application is serving.
+    """
+    setup_tracing()
+    try:
+        await run_in_threadpool(BROWSER_POOL.start)
+    except Exception as e:  # pylint: disable=broad-except
+        # The pool retries on first use, so a failed warm-up is not fatal.
+        print(f"Error: browser pool warm-up failed e={e}")
+    try:
+        await run_in_threadpool(TICKER_INDEX.load)
+    except Exception as e:  # pylint: disable=broad-except
+        # Lookups fall back to the remote symbol searches until it loads.
+        print(f"Error: ticker index load failed e={e}")
+    try:
+        await run_in_threadpool(SCORING_POOL.start)
+    except Exception as e:  # pylint: disable=broad-except
+        # The workers are started again on the first large batch.
+        print(f"Error: scoring pool start failed e={e}")
+    yield
+    await run_in_threadpool(BROWSER_POOL.stop)
+    await run_in_threadpool(SCORING_POOL.stop)
+    await run_in_threadpool(close_clients)
+    await run_in_threadpool(shutdown_tracing)
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that records the latency, status and concurrency of every
+    request. Paths that are not routes of the app share the "other" label so
+    the number of series stays bounded. Latency is measured to the end of the
+    response body, so it covers the whole of a streamed response.
+    """
+
+    def __init__(self, app: ASGIApp):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        app : ASGIApp
+            The wrapped application.
+        """
+        self.app = app
+        self.routes: Optional[Set[str]] = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if self.routes is None:
+            self.routes = {getattr(route, "path", "") for route in app.routes}
+        route = scope["path"] if scope["path"] in self.routes else "other"
+        method = scope["method"]
+        status = "500"
+
+        async def send_with_status(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        in_flight = HTTP_REQUESTS_IN_FLIGHT.labels(route)
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            in_flight.dec()
+            HTTP_REQUEST_DURATION.labels(route, method).observe(
+                time.perf_counter() - start
+            )
+            HTTP_REQUESTS.labels(route, method, status).inc()
+
+
+app.add_middleware(MetricsMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -53,15 +252,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global data
-KV_STORE: Dict[ChainType, Any] = {}  # Key-Value storage for the transform results
-
 
 @app.post("/get-logo/")
 @span_decorator
 def get_logo(query: TargetQuery) -> List[Logo]:
     """
-    API call to get a company's logo based on it's common name.
+    API call to get a company's logo based on it's common name. The result is
+    served from the result cache when possible.
 
     Parameters
     ----------
@@ -74,51 +271,331 @@ def get_logo(query: TargetQuery) -> List[Logo]:
         A list of urls ranked by Levenshtein distance. This ensures we get a logo
         that is close to what we queried and not just the most popular one.
     """
-    url = "https://www.brandsoftheworld.com"
+    current_span = trace.get_current_span()
+    current_span.set_attribute("target_query", query.target)
+
+    context = PipelineContext(query)
+    run_pipeline(context, [ChainType.LOGO_DATA])
+    return context.get(ChainType.LOGO_DATA)
+
+
+@span_decorator
+def fetch_logo(query: TargetQuery) -> List[Logo]:
+    """
+    Search brandsoftheworld for a company's logo based on it's common name.
 
+    Parameters
+    ----------
+    query : TargetQuery
+        The common name of the company.
+
+    Returns
+    -------
+    List[Logo]
+        A list of urls ranked by Levenshtein distance. This ensures we get a logo
+        that is close to what we queried and not just the most popular one.
+    """
     results = []
     target = query.target
     current_span = trace.get_current_span()
     current_span.set_attribute("target_query", target)
-    # Open playwright and goto url
-    with sync_playwright() as p:
-        browser = p.chromium.launch()
-        page = browser.new_page()
-        page.goto(url)
-        # You can use various locators like get_by_label, get_by_placeholder,
-        # or css selectors
-        page.locator("#edit-search-api-views-fulltext").fill(target)
-        submit_button = page.locator('input[type="submit"][value="Search"]')
-        submit_button.click()
-        html_content = page.content()
-        browser.close()
-
-        soup = BeautifulSoup(html_content, "html.parser")
-        elements_with_class = soup.find("div", class_="view-content")
-        list_items = elements_with_class.find_all("li")
-        for index, element in enumerate(list_items):
-            result_element: Dict[str, Any] = {}
-            result_element["index"] = index
-            for a in element.find_all("img"):
-                full_url = a["src"]
-                url = full_url.split("?")[0]
-                result_element["url"] = url
-            for a in element.find_all("span"):
-                result_element["title"] = a.text
-                result_element["distance"] = Levenshtein.distance(target, a.text)
-            results.append(result_element)
-
-        sorted_by_index = sorted(results, key=lambda x: x["index"])
-        sorted_by_distance = sorted(sorted_by_index, key=lambda x: x["distance"])
-
-    return [Logo(**logo_dict) for logo_dict in sorted_by_distance]
+    # Try a plain GET of the results page first. The browser is only needed
+    # when the page cannot be read without running its scripts.
+    html_content = search_logo_http(target)
+    search_path = "http"
+    if html_content is None:
+        search_path = "browser"
+        # Run the search on a warm browser context leased from the pool
+        with upstream_call("brandsoftheworld", "search"):
+            html_content = BROWSER_POOL.run(
+                functools.partial(search_logo_page, target=target),
+                timeout=get_setting("LOGO_BROWSER_TIMEOUT", 30.0),
+            )
+    current_span.set_attribute("logo_search_path", search_path)
+
+    elements_with_class = find_element(html_content, "div", "view-content")
+    list_items = elements_with_class.find_all("li")
+    for index, element in enumerate(list_items):
+        result_element: Dict[str, Any] = {}
+        result_element["index"] = index
+        for a in element.find_all("img"):
+            full_url = a["src"]
+            url = full_url.split("?")[0]
+            result_element["url"] = url
+        for a in element.find_all("span"):
+            result_element["title"] = a.text
+            result_element["distance"] = Levenshtein.distance(target, a.text)
+        results.append(result_element)
+
+    # Results are collected in index order, so one stable sort by distance
+    # ranks them by (distance, index).
+    results.sort(key=lambda x: x["distance"])
+    logos = [Logo(**logo_dict) for logo_dict in results]
+
+    # Keep local copies of the top logos so the frontend loads them from us.
+    top = logos[:LOGO_STORE_TOP]
+    for logo, name in zip(top, LOGO_STORE.store_all([logo.url for logo in top])):
+        if name is not None:
+            logo.local_url = f"{LOGO_PUBLIC_BASE_URL}/logos/{name}"
+    return logos
+
+
+def search_logo_http(target: str) -> Optional[str]:
+    """
+    Fetch the brandsoftheworld search results page with a plain GET.
+
+    Parameters
+    ----------
+    target : str
+        The common name of the company.
+
+    Returns
+    -------
+    Optional[str]
+        The HTML of the search results page, or None if the fast path is
+        disabled, failed, or returned a page without results markup.
+    """
+    if not LOGO_HTTP_SEARCH:
+        return None
+    try:
+        with upstream_call("brandsoftheworld", "search_http"):
+            response = get_http_session().get(
+                LOGO_SEARCH_URL,
+                params={"search_api_views_fulltext": target},
+                timeout=HTTP_TIMEOUT,
+            )
+            response.raise_for_status()
+    except requests.RequestException as e:
+        print(f"Error: logo search over HTTP failed e={e}")
+        return None
+    if 'class="view-content"' not in response.text:
+        return None
+    return response.text
+
+
+async def search_logo_page(page: Page, target: str) -> str:
+    """
+    Submit the brandsoftheworld search form on a leased page.
+
+    Parameters
+    ----------
+    page : Page
+        A page opened in a pooled browser context.
+    target : str
+        The common name of the company.
+
+    Returns
+    -------
+    str
+        The HTML of the search results page.
+    """
+    url = "https://www.brandsoftheworld.com"
+    await page.goto(url)
+    # You can use various locators like get_by_label, get_by_placeholder,
+    # or css selectors
+    await page.locator("#edit-search-api-views-fulltext").fill(target)
+    submit_button = page.locator('input[type="submit"][value="Search"]')
+    await submit_button.click()
+    return await page.content()
+
+
+@app.get("/metrics")
+def get_metrics() -> Response:
+    """
+    Prometheus metrics of the process.
+
+    Returns
+    -------
+    Response
+        The metrics in the Prometheus text exposition format.
+    """
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE)
+
+
+@app.get("/browser-pool-stats/")
+def get_browser_pool_stats() -> BrowserPoolStats:
+    """
+    Health and utilization of the logo browser pool.
+
+    Returns
+    -------
+    BrowserPoolStats
+        The current pool statistics.
+    """
+    return BROWSER_POOL.stats()
+
+
+@app.get("/cache-stats/")
+def get_cache_stats() -> CacheStats:
+    """
+    Hit, miss and eviction counters of the result cache.
+
+    Returns
+    -------
+    CacheStats
+        The current cache statistics.
+    """
+    return RESULT_CACHE.stats()
+
+
+@app.get("/comment-archive-stats/")
+def get_comment_archive_stats() -> CommentArchiveStats:
+    """
+    How many comment scores were reused from the archive versus computed.
+
+    Returns
+    -------
+    CommentArchiveStats
+        The current archive statistics.
+    """
+    return COMMENT_ARCHIVE.stats()
+
+
+@app.get("/scoring-pool-stats/")
+def get_scoring_pool_stats() -> ScoringPoolStats:
+    """
+    How many comments were scored by the scoring pool workers versus
+    in-process.
+
+    Returns
+    -------
+    ScoringPoolStats
+        The current scoring pool statistics.
+    """
+    return SCORING_POOL.stats()
+
+
+@app.get("/singleflight-stats/")
+def get_singleflight_stats() -> SingleFlightStats:
+    """
+    How many source runs were executed versus coalesced onto a run that was
+    already in flight.
+
+    Returns
+    -------
+    SingleFlightStats
+        The current coalescing statistics.
+    """
+    return SINGLE_FLIGHT.stats()
+
+
+@app.get("/logos/{name}")
+def get_stored_logo(name: str) -> FileResponse:
+    """
+    Serve a logo image from the logo store. Names are content hashes, so
+    responses can be cached forever.
+
+    Parameters
+    ----------
+    name : str
+        The stored name, "<sha256>.<extension>".
+
+    Returns
+    -------
+    FileResponse
+        The image.
+
+    Raises
+    ------
+    HTTPException
+        Will raise a 404 if there is no such image.
+    """
+    try:
+        path = LOGO_STORE.path(name)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="logo not found") from None
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="logo not found")
+    return FileResponse(
+        path, headers={"Cache-Control": "public, max-age=31536000, immutable"}
+    )
+
+
+@app.get("/logo-store-stats/")
+def get_logo_store_stats() -> LogoStoreStats:
+    """
+    How many logo images are stored locally and how many were downloaded.
+
+    Returns
+    -------
+    LogoStoreStats
+        The current logo store statistics.
+    """
+    return LOGO_STORE.stats()
+
+
+@app.get("/price-store-stats/")
+def get_price_store_stats() -> PriceStoreStats:
+    """
+    How many months of price data were served from the price store versus
+    fetched from polygon.
+
+    Returns
+    -------
+    PriceStoreStats
+        The current price store statistics.
+    """
+    return PRICE_STORE.stats()
+
+
+@app.get("/ticker-index-stats/")
+def get_ticker_index_stats() -> TickerIndexStats:
+    """
+    Size, age and hit counters of the local ticker index.
+
+    Returns
+    -------
+    TickerIndexStats
+        The current index statistics.
+    """
+    return TICKER_INDEX.stats()
+
+
+@app.get("/description-store-stats/")
+def get_description_store_stats() -> DescriptionStoreStats:
+    """
+    How many descriptions were served from the description store versus
+    generated.
+
+    Returns
+    -------
+    DescriptionStoreStats
+        The current description store statistics.
+    """
+    return DESCRIPTION_STORE.stats()
 
 
 @app.post("/get-description/")
 @span_decorator
 def get_description(query: TargetQuery) -> Description:
     """
-    Use chat gpt to write a simple description of the target company.
+    Use chat gpt to write a simple description of the target company. The
+    result is served from the result cache when possible.
+
+    Parameters
+    ----------
+    query : TargetQuery
+        The common name of the company.
+
+    Returns
+    -------
+    Description
+        A simple description of the company.
+    """
+    current_span = trace.get_current_span()
+    current_span.set_attribute("target_query", query.target)
+
+    context = PipelineContext(query)
+    run_pipeline(context, [ChainType.DESCRPTION_DATA])
+    return context.get(ChainType.DESCRPTION_DATA)
+
+
+@span_decorator
+def fetch_description(query: TargetQuery) -> Description:
+    """
+    Use chat gpt to write a simple description of the target company. The
+    description is generated once per company and then served from the
+    description store.
 
     Parameters
     ----------
@@ -133,28 +610,41 @@ def get_description(query: TargetQuery) -> Description:
     target = query.target
     current_span = trace.get_current_span()
     current_span.set_attribute("target_query", target)
-    api_key = get_secret("OPENAI_API_KEY")
-
-    client = openai.OpenAI(api_key=api_key)
-    response = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant."},
-            {
-                "role": "user",
-                "content": f"Briefly describe the company {target} "
-                + "in a pargraph",
-            },
-        ],
-    )
-    return Description(text=response.choices[0].message.content)
+    return DESCRIPTION_STORE.describe(target)
 
 
 @app.post("/get-stock-info/")
 @span_decorator
 def get_stock_info(query: TargetQuery) -> StockInfo:
     """
-    Get stock info such as ticker name and closing price.
+    Get stock info such as ticker name and closing price. The result is
+    served from the result cache when possible.
+
+    Parameters
+    ----------
+    query : TargetQuery
+        The common name of the company.
+
+    Returns
+    -------
+    StockInfo
+        An object containing the ticker symbol, company name, and closing price.
+    """
+    current_span = trace.get_current_span()
+    current_span.set_attribute("target_query", query.target)
+
+    context = PipelineContext(query)
+    run_pipeline(context, [ChainType.STOCK_INFO_DATA])
+    return context.get(ChainType.STOCK_INFO_DATA)
+
+
+@span_decorator
+def fetch_stock_info(query: TargetQuery) -> StockInfo:
+    """
+    Get stock info such as ticker name and closing price. The ticker is
+    resolved with the local ticker index and the quote is read from the
+    stockanalysis.com row of that ticker. Targets the index cannot resolve
+    are looked up by name as before.
 
     Parameters
     ----------
@@ -169,11 +659,14 @@ def get_stock_info(query: TargetQuery) -> StockInfo:
     target = query.target
     current_span = trace.get_current_span()
     current_span.set_attribute("target_query", target)
-    base_url = "https://stockanalysis.com/symbol-lookup"
+
+    match = TICKER_INDEX.resolve(target)
+    if match is not None:
+        current_span.set_attribute("ticker", match.symbol)
 
     # Define the query parameters with a space
     params = {
-        "q": target,
+        "q": match.symbol if match is not None else target,
     }
 
     header_mapping = {
@@ -184,20 +677,28 @@ def get_stock_info(query: TargetQuery) -> StockInfo:
         4: None,
     }
 
-    response = requests.get(base_url, params=params)
-    response.raise_for_status()
+    with upstream_call("stockanalysis", "symbol_lookup"):
+        response = get_http_session().get(
+            STOCK_INFO_URL, params=params, timeout=HTTP_TIMEOUT
+        )
+        response.raise_for_status()
 
     result: Dict[Any, Any] = {}
     html_content = response.text
-    soup = BeautifulSoup(html_content, "html.parser")
-    table = soup.find("table", class_="svelte-1swpzu1")
+    table = find_element(html_content, "table", "svelte-1swpzu1")
     for row in table.find_all("tr"):
-        result = {}
+        row_result = {}
         cells = row.find_all(["td"])
         for index, cell in enumerate(cells):
             if header_mapping[index]:
-                result[header_mapping[index]] = cell.get_text()
-        if "ticker_symbol" in result:
+                row_result[header_mapping[index]] = cell.get_text()
+        if "ticker_symbol" not in row_result:
+            continue
+        # Take the first row, or the row of the resolved ticker.
+        if not result:
+            result = row_result
+        if match is None or row_result["ticker_symbol"] == match.symbol:
+            result = row_result
             break
     res = StockInfo(**result)
     return res
@@ -207,7 +708,8 @@ def get_stock_info(query: TargetQuery) -> StockInfo:
 @span_decorator
 def get_stock_data(query: TargetQuery) -> List[StockData]:
     """
-    Get historical stock price data from polygon.
+    Get historical stock price data from polygon. The result is
+    served from the result cache when possible.
 
     Parameters
     ----------
@@ -219,47 +721,60 @@ def get_stock_data(query: TargetQuery) -> List[StockData]:
     List[StockData]
         A list of ("month", "stock price") objects for the last 12 months.
     """
-    months = [
-        None,
-        "Jan",
-        "Feb",
-        "Mar",
-        "Apr",
-        "May",
-        "Jun",
-        "Jul",
-        "Aug",
-        "Sep",
-        "Oct",
-        "Nov",
-        "Dec",
-    ]
+    current_span = trace.get_current_span()
+    current_span.set_attribute("target_query", query.target)
+
+    context = PipelineContext(query)
+    run_pipeline(context, [ChainType.STOCK_PRICE_DATA])
+    return context.get(ChainType.STOCK_PRICE_DATA)
+
+
+@span_decorator
+def fetch_stock_data(query: TargetQuery) -> List[StockData]:
+    """
+    Get historical stock price data from polygon. The ticker is resolved
+    with the local ticker index, and only targets it cannot resolve are
+    searched on polygon.
+
+    Parameters
+    ----------
+    query : TargetQuery
+        The common name of the company.
+
+    Returns
+    -------
+    List[StockData]
+        A list of ("month", "stock price") objects for the last
+        STOCK_DATA_MONTHS months, 12 by default.
+    """
     target = query.target
     current_span = trace.get_current_span()
     current_span.set_attribute("target_query", target)
 
-    api_key = get_secret("POLYGON_API_KEY")
-    client = RESTClient(api_key=api_key)
-    res = client.list_tickers(search=target, market="stocks", limit=1)
-    item = next(res)
-    ticker = item.ticker
-    # Get the current date
-    current_date = date.today()
-    twelve_months_prior = current_date - relativedelta(months=12)
+    client = get_polygon_client()
+    match = TICKER_INDEX.resolve(target)
+    if match is not None:
+        ticker = match.symbol
+    else:
+        with upstream_call("polygon", "list_tickers"):
+            res = client.list_tickers(search=target, market="stocks", limit=1)
+            item = next(res)
+        ticker = item.ticker
+    current_span.set_attribute("ticker", ticker)
+
+    # Closed months come from the price store, so only missing and open
+    # months are requested from polygon.
+    current_month = to_month(date.today())
+    closes = PRICE_STORE.monthly_closes(
+        ticker,
+        shift_month(current_month, -STOCK_DATA_MONTHS),
+        current_month,
+        polygon_fetcher(client, ticker),
+    )
 
     stock_data = []
-    for a in client.list_aggs(
-        ticker=ticker,
-        multiplier=1,
-        timespan="month",
-        from_=f"{twelve_months_prior.strftime('%Y-%m-%d')}",
-        to=f"{current_date.strftime('%Y-%m-%d')}",
-        limit=50000,
-    ):
-        price = a.close
-        ts = a.timestamp // 1000
-        month = datetime.fromtimestamp(ts).month
-        stock_data.append({"month": months[month], "price": price})
+    for month, price in closes:
+        stock_data.append({"month": MONTH_NAMES[int(month[5:])], "price": price})
     return [StockData(**stock_dict) for stock_dict in stock_data]
 
 
@@ -267,8 +782,8 @@ def get_stock_data(query: TargetQuery) -> List[StockData]:
 @span_decorator
 def get_all_data(query: TargetQuery) -> CombinedData:
     """
-    This is a method that collects all data in a single call using a
-    multi-threaded pipeline.
+    This is a method that collects all data in a single call by running
+    every source concurrently.
 
     Parameters
     ----------
@@ -282,75 +797,192 @@ def get_all_data(query: TargetQuery) -> CombinedData:
 
     Raises
     ------
-    Exception
-        Will raise an exception if a pipeline error occurs.
+    PipelineError
+        Will raise an exception listing the failed stages if a pipeline error
+        occurs.
     """
     current_span = trace.get_current_span()
     current_span.set_attribute("target_query", query.target)
 
     print(f"IN get_all_data. query={query.target}")
-    # Create the Bonobo graph
-    SERVICES["query"] = query
-    graph = bonobo.Graph()
-    graph.add_chain(store_results, _input=None)
-    graph.add_chain(
-        extract_logo_data,
-        store_results,
-    )
-    graph.add_chain(
-        extract_description,
-        store_results,
-    )
-    graph.add_chain(
-        extract_stock_info,
-        store_results,
-    )
-    graph.add_chain(
-        extract_stock_data,
-        store_results,
-    )
-    graph.add_chain(
-        extract_search_data,
-        extract_comment_thread_data,
-        transform_comment_thread_data,
-        store_results,
-    )
-    graph.add_chain(
-        reddit_extract_search_data,
-        reddit_extract_comment_thread_data,
-        reddit_transform_comment_thread_data,
-        store_results,
-    )
-    result = bonobo.run(graph)
+    context = PipelineContext(query)
+    run_pipeline(context, list(ChainType))
 
-    # Check for pipeline errors and raise an exception.
-    error_list = []
-    for node in result:
-        stat_string = node.get_statistics_as_string(prefix=" ")
-        print(f"stat_string={stat_string}")
-        stat_array = stat_string.split(" ")
-        if any([True if "err=" in stat else False for stat in stat_array]):
-            print(f"Errors: {str(node)}")
-            error_list.append(str(node))
-    if len(error_list) > 0:
-        raise Exception(
-            f"Errors occurred during pipeline execution: {','.join(error_list)}"
+    return combine(context)
+
+
+@app.post("/get-all-data-batch/")
+@span_decorator
+def get_all_data_batch(queries: List[TargetQuery]) -> BatchResult:
+    """
+    Collect all data for a list of companies in a single call. Repeated
+    targets are only fetched once, and the sources of all targets share the
+    pipeline executor.
+
+    Parameters
+    ----------
+    queries : List[TargetQuery]
+        The common names of the companies.
+
+    Returns
+    -------
+    BatchResult
+        The combined data of every target that succeeded and the errors of
+        every target that did not, keyed by the requested target.
+
+    Raises
+    ------
+    HTTPException
+        Will raise a 400 error if more than BATCH_MAX_TARGETS are requested.
+    """
+    max_targets = get_setting("BATCH_MAX_TARGETS", 100)
+    if len(queries) > max_targets:
+        raise HTTPException(
+            status_code=400, detail=f"at most {max_targets} targets per batch"
         )
+    current_span = trace.get_current_span()
+    current_span.set_attribute("target_count", len(queries))
+
+    contexts: Dict[str, PipelineContext] = {}
+    for query in queries:
+        key = normalize_target(query.target)
+        if key not in contexts:
+            contexts[key] = PipelineContext(query)
+    errors = run_batch(list(contexts.values()), pipeline_sources())
+    errors_by_key = dict(zip(contexts, errors))
+
+    batch = BatchResult(results={}, errors={})
+    for query in queries:
+        key = normalize_target(query.target)
+        if errors_by_key[key]:
+            batch.errors[query.target] = errors_by_key[key]
+        else:
+            batch.results[query.target] = combine(contexts[key])
+    return batch
+
+
+def combine(context: PipelineContext) -> CombinedData:
+    """
+    Build the /get-all-data/ response from a context in which every source
+    has stored its result.
 
-    logo = KV_STORE[ChainType.LOGO_DATA]
-    description = KV_STORE[ChainType.DESCRPTION_DATA]
-    stock_info = KV_STORE[ChainType.STOCK_INFO_DATA]
-    stock_data = KV_STORE[ChainType.STOCK_PRICE_DATA]
-    youtube_sentiment = KV_STORE[ChainType.YOUTUBE_SENTIMENT_DATA]
-    reddit_sentiment = KV_STORE[ChainType.REDDIT_SENTIMENT_DATA]
+    Parameters
+    ----------
+    context : PipelineContext
+        The per-request pipeline context.
+
+    Returns
+    -------
+    CombinedData
+        All of the collected data in a single object.
+    """
     return CombinedData(
-        logo=logo,
-        description=description,
-        stock_info=stock_info,
-        stock_data=stock_data,
-        youtube_sentiment=youtube_sentiment,
-        reddit_sentiment=reddit_sentiment,
+        **{field: context.get(chain) for chain, field in COMBINED_FIELDS.items()}
+    )
+
+
+@app.post("/get-all-data-stream/")
+async def get_all_data_stream(
+    query: TargetQuery,
+    stream_format: str = Query("ndjson", alias="format"),
+) -> StreamingResponse:
+    """
+    Streaming variant of /get-all-data/. Every source runs concurrently and
+    its result is sent as soon as it is ready, followed by a summary frame.
+    Failed sources are reported in their frame instead of failing the
+    request.
+
+    Parameters
+    ----------
+    query : TargetQuery
+        The common name of the company.
+    stream_format : str, optional
+        "ndjson" for one JSON object per line or "sse" for server-sent
+        events, by default "ndjson"
+
+    Returns
+    -------
+    StreamingResponse
+        A stream of SourceFrame objects ending with a SummaryFrame.
+    """
+    if stream_format not in STREAM_MEDIA_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"format must be one of {', '.join(STREAM_MEDIA_TYPES)}",
+        )
+    trace.get_current_span().set_attribute("target_query", query.target)
+    return StreamingResponse(
+        stream_all_data(query, stream_format),
+        media_type=STREAM_MEDIA_TYPES[stream_format],
+        # Stop proxies from buffering the frames.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def stream_all_data(
+    query: TargetQuery, stream_format: str
+) -> AsyncIterator[str]:
+    """
+    Run every source and encode a frame as each one finishes.
+
+    Parameters
+    ----------
+    query : TargetQuery
+        The common name of the company.
+    stream_format : str
+        "ndjson" or "sse".
+
+    Yields
+    ------
+    AsyncIterator[str]
+        The encoded frames.
+    """
+    context = PipelineContext(query)
+    start = time.perf_counter()
+    completed: List[str] = []
+    errors: List[StageError] = []
+    async for chain, error in iter_sources(context, pipeline_sources()):
+        frame = SourceFrame(
+            chain=chain.name,
+            field=COMBINED_FIELDS[chain],
+            elapsed=time.perf_counter() - start,
+        )
+        if error is None:
+            frame.data = context.get(chain)
+            completed.append(frame.field)
+        else:
+            frame.error = error
+            errors.append(error)
+        yield encode_frame(frame, stream_format)
+    summary = SummaryFrame(
+        target=query.target,
+        completed=completed,
+        errors=errors,
+        elapsed=time.perf_counter() - start,
     )
+    yield encode_frame(summary, stream_format)
+
+
+def encode_frame(frame: BaseModel, stream_format: str) -> str:
+    """
+    Encode a frame for the wire.
+
+    Parameters
+    ----------
+    frame : BaseModel
+        A SourceFrame or SummaryFrame.
+    stream_format : str
+        "ndjson" or "sse".
+
+    Returns
+    -------
+    str
+        The encoded frame.
+    """
+    data = frame.model_dump_json()
+    if stream_format == "sse":
+        return f"event: {getattr(frame, 'type')}\ndata: {data}\n\n"
+    return data + "\n"
 
 
 @app.post("/get-youtube-sentiment/")
@@ -372,18 +1004,9 @@ def get_youtube_sentiment(query: TargetQuery) -> Sentiment:
     current_span = trace.get_current_span()
     current_span.set_attribute("target_query", query.target)
 
-    # Create the Bonobo graph
-    SERVICES["query"] = query
-    graph = bonobo.Graph()
-    graph.add_chain(store_results, _input=None)
-    graph.add_chain(
-        extract_search_data,
-        extract_comment_thread_data,
-        transform_comment_thread_data,
-        store_results,
-    )
-    bonobo.run(graph)
-    return KV_STORE[ChainType.YOUTUBE_SENTIMENT_DATA]
+    context = PipelineContext(query)
+    run_pipeline(context, [ChainType.YOUTUBE_SENTIMENT_DATA])
+    return context.get(ChainType.YOUTUBE_SENTIMENT_DATA)
 
 
 @app.post("/get-reddit-sentiment/")
@@ -405,89 +1028,250 @@ def get_reddit_sentiment(query: TargetQuery) -> Sentiment:
     current_span = trace.get_current_span()
     current_span.set_attribute("target_query", query.target)
 
+    context = PipelineContext(query)
+    run_pipeline(context, [ChainType.REDDIT_SENTIMENT_DATA])
+    return context.get(ChainType.REDDIT_SENTIMENT_DATA)
+
+
+@app.exception_handler(PipelineError)
+def pipeline_error_handler(request: Request, exc: PipelineError) -> JSONResponse:
+    """
+    Report the per-stage errors of a failed pipeline to the client.
+
+    Parameters
+    ----------
+    request : Request
+        The request that failed.
+    exc : PipelineError
+        The pipeline error.
+
+    Returns
+    -------
+    JSONResponse
+        A 502 response listing the failed stages.
+    """
+    return JSONResponse(
+        status_code=502,
+        content={
+            "detail": "Errors occurred during pipeline execution",
+            "errors": [error.model_dump() for error in exc.errors],
+        },
+    )
+
+
+def run_pipeline(context: PipelineContext, chains: List[ChainType]):
+    """
+    Run the sources of the given chain types and store their results in the
+    context. The asyncio orchestrator is used unless PIPELINE_BACKEND is set
+    to "bonobo". Only the asyncio orchestrator goes through RESULT_CACHE and
+    SINGLE_FLIGHT, so compare the two backends with the cache disabled.
+
+    Parameters
+    ----------
+    context : PipelineContext
+        The per-request pipeline context.
+    chains : List[ChainType]
+        The chain types to produce.
+
+    Raises
+    ------
+    Exception
+        Will raise an exception if a pipeline error occurs.
+    """
+    if get_setting("PIPELINE_BACKEND", "asyncio") == "bonobo":
+        run_bonobo_graph(context, chains)
+    else:
+        sources = pipeline_sources()
+        run_sources(context, {chain: sources[chain] for chain in chains})
+
+
+def pipeline_sources() -> Dict[ChainType, Stages]:
+    """
+    The blocking stages of each source used by the asyncio orchestrator.
+
+    Returns
+    -------
+    Dict[ChainType, Stages]
+        The stages of each chain type.
+    """
+    return {
+        ChainType.LOGO_DATA: [fetch_logo],
+        ChainType.DESCRPTION_DATA: [fetch_description],
+        ChainType.STOCK_INFO_DATA: [fetch_stock_info],
+        ChainType.STOCK_PRICE_DATA: [fetch_stock_data],
+        ChainType.YOUTUBE_SENTIMENT_DATA: [
+            perform_extract_search_data,
+            perform_extract_comment_thread_data,
+            perform_transform_comment_thread_data,
+        ],
+        ChainType.REDDIT_SENTIMENT_DATA: [
+            perform_reddit_extract_search_data,
+            perform_reddit_extract_comment_thread_data,
+            perform_reddit_transform_comment_thread_data,
+        ],
+    }
+
+
+def run_bonobo_graph(context: PipelineContext, chains: List[ChainType]):
+    """
+    Legacy bonobo implementation of run_pipeline, kept so both can be
+    benchmarked against each other. Graphs are run one at a time under
+    BONOBO_LOCK, so concurrent requests are correct but wait for each other.
+    Results are neither cached nor coalesced with identical requests in
+    flight.
+
+    Parameters
+    ----------
+    context : PipelineContext
+        The per-request pipeline context.
+    chains : List[ChainType]
+        The chain types to produce.
+
+    Raises
+    ------
+    Exception
+        Will raise an exception if a pipeline error occurs.
+    """
+    bonobo_chains = {
+        ChainType.LOGO_DATA: [extract_logo_data],
+        ChainType.DESCRPTION_DATA: [extract_description],
+        ChainType.STOCK_INFO_DATA: [extract_stock_info],
+        ChainType.STOCK_PRICE_DATA: [extract_stock_data],
+        ChainType.YOUTUBE_SENTIMENT_DATA: [
+            extract_search_data,
+            extract_comment_thread_data,
+            transform_comment_thread_data,
+        ],
+        ChainType.REDDIT_SENTIMENT_DATA: [
+            reddit_extract_search_data,
+            reddit_extract_comment_thread_data,
+            reddit_transform_comment_thread_data,
+        ],
+    }
+
     # Create the Bonobo graph
-    SERVICES["query"] = query
     graph = bonobo.Graph()
     graph.add_chain(store_results, _input=None)
-    graph.add_chain(
-        reddit_extract_search_data,
-        reddit_extract_comment_thread_data,
-        reddit_transform_comment_thread_data,
-        store_results,
-    )
-    bonobo.run(graph)
-    return KV_STORE[ChainType.REDDIT_SENTIMENT_DATA]
+    for chain in chains:
+        graph.add_chain(*bonobo_chains[chain], store_results)
+    with BONOBO_LOCK:
+        result = bonobo.run(graph, services={"context": context})
+
+    # Check for pipeline errors and raise an exception.
+    error_list = []
+    for node in result:
+        stat_string = node.get_statistics_as_string(prefix=" ")
+        print(f"stat_string={stat_string}")
+        stat_array = stat_string.split(" ")
+        if any([True if "err=" in stat else False for stat in stat_array]):
+            print(f"Errors: {str(node)}")
+            error_list.append(str(node))
+    if len(error_list) > 0:
+        raise Exception(
+            f"Errors occurred during pipeline execution: {','.join(error_list)}"
+        )
 
 
-def extract_logo_data() -> Generator[Tuple[ChainType, List[Logo]], None, None]:
+@use("context")
+def extract_logo_data(
+    context: PipelineContext,
+) -> Generator[Tuple[ChainType, List[Logo]], None, None]:
     """
     Wrapper function to get the logo suitable for a pipeline.
 
+    Parameters
+    ----------
+    context : PipelineContext
+        The per-request pipeline context.
+
     Yields
     ------
     Generator[Tuple[ChainType, List[Logo]], None, None]
         A generator for pipeline usage.
     """
-    query = SERVICES["query"]
-    data = get_logo(query)
+    data = fetch_logo(context.query)
     yield (ChainType.LOGO_DATA, data)
 
 
-def extract_description() -> Generator[Tuple[ChainType, Description], None, None]:
+@use("context")
+def extract_description(
+    context: PipelineContext,
+) -> Generator[Tuple[ChainType, Description], None, None]:
     """
     Wrapper function to get a company description suitable for a pipeline.
 
+    Parameters
+    ----------
+    context : PipelineContext
+        The per-request pipeline context.
+
     Yields
     ------
     Generator[Tuple[ChainType, Description], None, None]
         A generator containing the type and object
     """
-    query = SERVICES["query"]
-    data = get_description(query)
+    data = fetch_description(context.query)
     yield (ChainType.DESCRPTION_DATA, data)
 
 
-def extract_stock_info() -> Generator[Tuple[ChainType, StockInfo], None, None]:
+@use("context")
+def extract_stock_info(
+    context: PipelineContext,
+) -> Generator[Tuple[ChainType, StockInfo], None, None]:
     """
     Wrapper function to get a company stock information suitable for a pipeline.
 
+    Parameters
+    ----------
+    context : PipelineContext
+        The per-request pipeline context.
+
     Yields
     ------
     Generator[Tuple[ChainType, StockInfo], None, None]
          A generator containing the type and object
     """
-    query = SERVICES["query"]
-    data = get_stock_info(query)
+    data = fetch_stock_info(context.query)
     yield (ChainType.STOCK_INFO_DATA, data)
 
 
-def extract_stock_data() -> Generator[Tuple[ChainType, StockInfo], None, None]:
+@use("context")
+def extract_stock_data(
+    context: PipelineContext,
+) -> Generator[Tuple[ChainType, StockInfo], None, None]:
     """
     Wrapper function to get a company's historical stock data suitable for
     a pipeline.
 
+    Parameters
+    ----------
+    context : PipelineContext
+        The per-request pipeline context.
+
     Yields
     ------
     Generator[Tuple[ChainType, StockInfo], None, None]
         A generator containing the type and object
     """
-    query = SERVICES["query"]
-    data = get_stock_data(query)
+    data = fetch_stock_data(context.query)
     yield (ChainType.STOCK_PRICE_DATA, data)
 
 
-def store_results(key: ChainType, data: BaseModel):
+@use("context")
+def store_results(key: ChainType, data: BaseModel, context: PipelineContext):
     """
     Store transform results for final processing.
 
     Parameters
     ----------
-    key : str
-        The type of data (channel_data or comment_thread_data)
-    df : pd.DataFrame
-        The dataframe output by the transform function.
+    key : ChainType
+        The type of data.
+    data : BaseModel
+        The model output by the transform function.
+    context : PipelineContext
+        The per-request pipeline context the results are stored in.
     """
-    KV_STORE[key] = data
+    context.store(key, data)
 
 
 if __name__ == "__main__":
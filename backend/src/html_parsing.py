@@ -0,0 +1,87 @@
+"""
+HTML parsing backend shared by the scrapers. The scrapers only need one
+element of each page, so by default only that element's subtree is built
+(a SoupStrainer) instead of the whole document. The underlying parser is
+pluggable: the C-backed lxml parser is used when it is installed, and the
+stdlib html.parser otherwise.
+"""
+
+import importlib.util
+from typing import Optional
+
+from bs4 import BeautifulSoup, SoupStrainer
+from bs4.element import Tag
+from common import get_setting  # pylint: disable=import-error
+
+# lxml is optional. BeautifulSoup imports it itself when it is selected.
+HAVE_LXML = importlib.util.find_spec("lxml") is not None
+
+PARSERS = ("html.parser", "lxml")
+
+
+def default_parser() -> str:
+    """
+    The parser selected with HTML_PARSER. "auto" (the default) picks lxml
+    when it is installed.
+
+    Returns
+    -------
+    str
+        A BeautifulSoup parser name.
+
+    Raises
+    ------
+    ValueError
+        Will raise an exception if the parser is unknown or not installed.
+    """
+    name = get_setting("HTML_PARSER", "auto")
+    if name == "auto":
+        return "lxml" if HAVE_LXML else "html.parser"
+    if name not in PARSERS:
+        raise ValueError(f"unknown HTML parser {name}")
+    if name == "lxml" and not HAVE_LXML:
+        raise ValueError("HTML_PARSER is lxml but lxml is not installed")
+    return name
+
+
+PARSER = default_parser()
+# When False the whole document is parsed, as the scrapers originally did.
+PARSE_ONLY_TARGET = get_setting("HTML_PARSE_ONLY_TARGET", True)
+
+
+def find_element(
+    html: str,
+    name: str,
+    class_: str,
+    parser: Optional[str] = None,
+    parse_only_target: Optional[bool] = None,
+) -> Optional[Tag]:
+    """
+    Find the first element with the given tag name and CSS class.
+
+    Parameters
+    ----------
+    html : str
+        The page.
+    name : str
+        The tag name, e.g. "div".
+    class_ : str
+        One of the element's CSS classes.
+    parser : Optional[str], optional
+        The BeautifulSoup parser, by default PARSER
+    parse_only_target : Optional[bool], optional
+        Build only the subtrees of matching elements, by default
+        PARSE_ONLY_TARGET
+
+    Returns
+    -------
+    Optional[Tag]
+        The element, or None if the page has none.
+    """
+    if parser is None:
+        parser = PARSER
+    if parse_only_target is None:
+        parse_only_target = PARSE_ONLY_TARGET
+    parse_only = SoupStrainer(name, class_=class_) if parse_only_target else None
+    soup = BeautifulSoup(html, parser, parse_only=parse_only)
+    return soup.find(name, class_=class_)
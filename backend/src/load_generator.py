@@ -0,0 +1,696 @@
+"""
+Headless load generator for the backend. Requests go straight to the API
+endpoints instead of through the frontend like automate.py, so the tool can
+hold a fixed arrival rate (open loop) or a fixed number of concurrent clients
+(closed loop). Endpoints and targets are drawn from a weighted traffic mix
+read from profile.txt or from a requests.jsonl log. Latency percentiles,
+throughput and error rates are reported per endpoint. With --stand-ins a
+replay_server.py and a backend wired to it are started for the run, so the
+load needs no network.
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import requests
+from benchmark_replay import start_server  # pylint: disable=import-error
+from replay_server import upstream_settings  # pylint: disable=import-error
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+# Endpoints that take a single TargetQuery.
+ENDPOINTS = [
+    "/get-all-data/",
+    "/get-all-data-stream/",
+    "/get-logo/",
+    "/get-description/",
+    "/get-stock-info/",
+    "/get-stock-data/",
+    "/get-youtube-sentiment/",
+    "/get-reddit-sentiment/",
+]
+
+# A request of the mix as (endpoint, target).
+Request = Tuple[str, str]
+
+
+class Result(NamedTuple):
+    """
+    The outcome of one request.
+    """
+
+    endpoint: str
+    # Seconds from the start of the run at which the request was due.
+    scheduled: float
+    # Seconds from when the request was due until its response was read.
+    latency: float
+    # The HTTP status, or 0 if no response was received.
+    status: int
+    # Empty for a successful request, otherwise the status or exception.
+    error: str
+
+
+class TrafficMix:
+    """
+    A weighted distribution of requests.
+    """
+
+    def __init__(self, entries: List[Request], weights: List[float]):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        entries : List[Request]
+            The distinct requests.
+        weights : List[float]
+            The relative frequency of every request.
+        """
+        if not entries:
+            raise ValueError("the traffic mix is empty")
+        self.entries = entries
+        self.weights = weights
+
+    def sample(self, rng: random.Random) -> Request:
+        """
+        Draw a request.
+
+        Parameters
+        ----------
+        rng : random.Random
+            The random number generator of the calling thread.
+
+        Returns
+        -------
+        Request
+            The (endpoint, target) pair.
+        """
+        return rng.choices(self.entries, self.weights)[0]
+
+
+def parse_endpoint(value: str) -> Tuple[str, float]:
+    """
+    Parse an --endpoint argument of the form PATH or PATH=WEIGHT.
+
+    Parameters
+    ----------
+    value : str
+        The argument.
+
+    Returns
+    -------
+    Tuple[str, float]
+        The endpoint and its weight, 1 by default.
+    """
+    path, _, weight = value.partition("=")
+    if path not in ENDPOINTS:
+        raise argparse.ArgumentTypeError(f"unknown endpoint {path}")
+    return path, float(weight) if weight else 1.0
+
+
+def read_mix(path: str, endpoints: List[Tuple[str, float]]) -> TrafficMix:
+    """
+    Read a traffic mix. In a profile file every line is a target, and a
+    target listed several times is requested that much more often. Every
+    target is sent to the given endpoints in proportion to their weights.
+    In a .jsonl file every line is a request such as
+    {"endpoint": "/get-logo/", "target": "apple", "weight": 2}; "endpoint"
+    defaults to the given endpoints and "weight" to 1, and repeated lines
+    add up.
+
+    Parameters
+    ----------
+    path : str
+        Path of the profile or .jsonl file.
+    endpoints : List[Tuple[str, float]]
+        Endpoints and their weights for lines without an endpoint.
+
+    Returns
+    -------
+    TrafficMix
+        The traffic mix.
+    """
+    weights: Dict[Request, float] = defaultdict(float)
+    with open(path, "r") as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                entry = json.loads(line)
+                target = entry["target"]
+                weight = float(entry.get("weight", 1.0))
+                if "endpoint" in entry:
+                    parse_endpoint(entry["endpoint"])
+                    weights[(entry["endpoint"], target)] += weight
+                    continue
+            else:
+                target, weight = line, 1.0
+            for endpoint, endpoint_weight in endpoints:
+                weights[(endpoint, target)] += weight * endpoint_weight
+    return TrafficMix(list(weights), list(weights.values()))
+
+
+_thread_local = threading.local()
+
+
+def get_session() -> requests.Session:
+    """
+    Get the requests session of the calling thread, so that every client
+    keeps its own connection.
+
+    Returns
+    -------
+    requests.Session
+        The session.
+    """
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        _thread_local.session = session
+    return session
+
+
+def send(
+    base_url: str,
+    request: Request,
+    scheduled: float,
+    start: float,
+    timeout: float,
+) -> Result:
+    """
+    Send a request and read the whole response.
+
+    Parameters
+    ----------
+    base_url : str
+        Base url of the backend.
+    request : Request
+        The (endpoint, target) pair.
+    scheduled : float
+        Seconds from the start of the run at which the request was due.
+    start : float
+        perf_counter value at the start of the run.
+    timeout : float
+        Seconds to wait for the response.
+
+    Returns
+    -------
+    Result
+        The outcome.
+    """
+    endpoint, target = request
+    try:
+        response = get_session().post(
+            base_url + endpoint, json={"target": target}, timeout=timeout
+        )
+        status = response.status_code
+        error = "" if response.ok else str(status)
+    except requests.RequestException as e:
+        status, error = 0, type(e).__name__
+    latency = time.perf_counter() - start - scheduled
+    return Result(endpoint, scheduled, latency, status, error)
+
+
+def run_open_loop(
+    base_url: str,
+    mix: TrafficMix,
+    rate: float,
+    duration: float,
+    max_in_flight: int,
+    poisson: bool,
+    timeout: float,
+    seed: int,
+) -> List[Result]:
+    """
+    Send requests at a fixed rate, whether or not earlier ones have been
+    answered. Latency is measured from when a request was due, so time spent
+    waiting for a free connection counts when the backend falls behind.
+
+    Parameters
+    ----------
+    base_url : str
+        Base url of the backend.
+    mix : TrafficMix
+        The traffic mix.
+    rate : float
+        Requests per second.
+    duration : float
+        Seconds during which requests are sent.
+    max_in_flight : int
+        Most requests sent concurrently.
+    poisson : bool
+        Space requests by exponential gaps rather than evenly.
+    timeout : float
+        Seconds to wait for a response.
+    seed : int
+        Seed of the arrivals and the drawn requests.
+
+    Returns
+    -------
+    List[Result]
+        The outcome of every request.
+    """
+    rng = random.Random(seed)
+    futures = []
+    with ThreadPoolExecutor(
+        max_workers=max_in_flight, thread_name_prefix="load"
+    ) as executor:
+        start = time.perf_counter()
+        scheduled = 0.0
+        while scheduled < duration:
+            delay = scheduled - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(
+                executor.submit(
+                    send, base_url, mix.sample(rng), scheduled, start, timeout
+                )
+            )
+            scheduled += rng.expovariate(rate) if poisson else 1.0 / rate
+    return [future.result() for future in futures]
+
+
+def run_closed_loop(
+    base_url: str,
+    mix: TrafficMix,
+    concurrency: int,
+    duration: float,
+    think_time: float,
+    timeout: float,
+    seed: int,
+) -> List[Result]:
+    """
+    Run a fixed number of clients that each send a request as soon as their
+    previous one has been answered, after an optional pause.
+
+    Parameters
+    ----------
+    base_url : str
+        Base url of the backend.
+    mix : TrafficMix
+        The traffic mix.
+    concurrency : int
+        Number of clients.
+    duration : float
+        Seconds during which requests are sent.
+    think_time : float
+        Seconds a client pauses between requests.
+    timeout : float
+        Seconds to wait for a response.
+    seed : int
+        Seed of the drawn requests.
+
+    Returns
+    -------
+    List[Result]
+        The outcome of every request.
+    """
+    start = time.perf_counter()
+
+    def client(index: int) -> List[Result]:
+        rng = random.Random(seed + index)
+        results = []
+        while True:
+            scheduled = time.perf_counter() - start
+            if scheduled >= duration:
+                return results
+            results.append(
+                send(base_url, mix.sample(rng), scheduled, start, timeout)
+            )
+            if think_time > 0:
+                time.sleep(think_time)
+
+    with ThreadPoolExecutor(
+        max_workers=concurrency, thread_name_prefix="load"
+    ) as executor:
+        futures = [executor.submit(client, index) for index in range(concurrency)]
+    return [result for future in futures for result in future.result()]
+
+
+def summarize(results: List[Result], elapsed: float) -> Dict[str, Any]:
+    """
+    Latency percentiles, throughput and errors of a group of requests.
+
+    Parameters
+    ----------
+    results : List[Result]
+        The outcomes.
+    elapsed : float
+        Seconds the run lasted.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The statistics. Latencies are in milliseconds.
+    """
+    latencies = np.array([result.latency for result in results]) * 1e3
+    errors = Counter(result.error for result in results if result.error)
+    failed = sum(errors.values())
+    return {
+        "requests": len(results),
+        "errors": failed,
+        "error_rate": failed / len(results),
+        "error_kinds": dict(errors),
+        "throughput": (len(results) - failed) / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "max_ms": float(np.max(latencies)),
+    }
+
+
+def report(results: List[Result], elapsed: float) -> Dict[str, Dict[str, Any]]:
+    """
+    Print and return the statistics of every endpoint and of all requests.
+
+    Parameters
+    ----------
+    results : List[Result]
+        The outcomes.
+    elapsed : float
+        Seconds the run lasted.
+
+    Returns
+    -------
+    Dict[str, Dict[str, Any]]
+        The statistics per endpoint, and under "all" for all requests.
+    """
+    groups: Dict[str, List[Result]] = defaultdict(list)
+    for result in results:
+        groups[result.endpoint].append(result)
+    groups["all"] = results
+    print(
+        f"{'endpoint':26s}{'requests':>9s}{'errors':>8s}{'req/s':>8s}"
+        f"{'p50 ms':>9s}{'p95 ms':>9s}{'p99 ms':>9s}"
+    )
+    statistics = {}
+    for name, group in sorted(groups.items(), key=lambda item: item[0] == "all"):
+        stats = summarize(group, elapsed)
+        statistics[name] = stats
+        print(
+            f"{name:26s}{stats['requests']:9d}{stats['error_rate']:8.1%}"
+            f"{stats['throughput']:8.2f}{stats['p50_ms']:9.1f}"
+            f"{stats['p95_ms']:9.1f}{stats['p99_ms']:9.1f}"
+        )
+    return statistics
+
+
+def wait_until_up(url: str, process: subprocess.Popen, timeout: float):
+    """
+    Wait until a url answers with a success status.
+
+    Parameters
+    ----------
+    url : str
+        The url to poll.
+    process : subprocess.Popen
+        The process serving the url. It is killed on timeout.
+    timeout : float
+        Seconds to wait.
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(url, timeout=1).ok:
+                return
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.5)
+    process.kill()
+    raise RuntimeError(f"{url} did not come up within {timeout} s")
+
+
+def start_stand_ins(
+    port: int, replay_port: int, latency: float
+) -> List[subprocess.Popen]:
+    """
+    Start a replay server and a backend whose upstream calls go to it.
+
+    Parameters
+    ----------
+    port : int
+        Port of the backend.
+    replay_port : int
+        Port of the replay server.
+    latency : float
+        Seconds every upstream response is delayed by.
+
+    Returns
+    -------
+    List[subprocess.Popen]
+        The replay server and backend processes.
+    """
+    replay = start_server(replay_port, latency)
+    env = dict(os.environ)
+    env.update(upstream_settings(f"http://127.0.0.1:{replay_port}"))
+    env.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="load-generator-"))
+    env.setdefault("TRACING_ENABLED", "0")
+    backend = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "endpoint:app",
+            f"--port={port}",
+            "--log-level=warning",
+        ],
+        cwd=SRC_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_up(f"http://127.0.0.1:{port}/cache-stats/", backend, 120)
+    except RuntimeError:
+        replay.terminate()
+        raise
+    return [replay, backend]
+
+
+def main(
+    base_url: str,
+    mix_path: str,
+    endpoints: List[Tuple[str, float]],
+    mode: str,
+    rate: float,
+    poisson: bool,
+    max_in_flight: int,
+    concurrency: int,
+    think_time: float,
+    duration: float,
+    timeout: float,
+    seed: int,
+    output: Optional[str],
+    stand_ins: bool,
+    replay_port: int,
+    latency: float,
+):
+    """
+    Main processing method.
+
+    Parameters
+    ----------
+    base_url : str
+        Base url of the backend.
+    mix_path : str
+        Path of the profile or .jsonl file.
+    endpoints : List[Tuple[str, float]]
+        Endpoints and their weights for targets without an endpoint.
+    mode : str
+        "open" for a fixed arrival rate, "closed" for fixed concurrency.
+    rate : float
+        Requests per second in open loop.
+    poisson : bool
+        Space open loop requests by exponential gaps rather than evenly.
+    max_in_flight : int
+        Most concurrent requests in open loop.
+    concurrency : int
+        Number of clients in closed loop.
+    think_time : float
+        Seconds a closed loop client pauses between requests.
+    duration : float
+        Seconds during which requests are sent.
+    timeout : float
+        Seconds to wait for a response.
+    seed : int
+        Seed of the traffic.
+    output : Optional[str]
+        Path the JSON report is written to.
+    stand_ins : bool
+        Start a replay server and a backend on the port of base_url.
+    replay_port : int
+        Port of the replay server.
+    latency : float
+        Seconds every upstream response of the replay server is delayed by.
+    """
+    mix = read_mix(mix_path, endpoints)
+    processes = []
+    if stand_ins:
+        processes = start_stand_ins(
+            int(base_url.rsplit(":", 1)[-1].rstrip("/")), replay_port, latency
+        )
+    try:
+        start = time.perf_counter()
+        if mode == "open":
+            results = run_open_loop(
+                base_url,
+                mix,
+                rate,
+                duration,
+                max_in_flight,
+                poisson,
+                timeout,
+                seed,
+            )
+        else:
+            results = run_closed_loop(
+                base_url, mix, concurrency, duration, think_time, timeout, seed
+            )
+        elapsed = time.perf_counter() - start
+    finally:
+        for process in processes[::-1]:
+            process.terminate()
+            process.wait()
+
+    if not results:
+        print("No requests were sent")
+        return
+    print(f"mode={mode} duration={elapsed:.1f}s mix={len(mix.entries)} requests")
+    statistics = report(results, elapsed)
+    if output:
+        document = {
+            "meta": {
+                "created": datetime.now(timezone.utc).isoformat(
+                    timespec="seconds"
+                ),
+                "base_url": base_url,
+                "mix": mix_path,
+                "mode": mode,
+                "rate": rate if mode == "open" else None,
+                "concurrency": concurrency if mode == "closed" else None,
+                "duration": elapsed,
+                "stand_ins": stand_ins,
+            },
+            "endpoints": statistics,
+        }
+        with open(output, "w") as f:
+            json.dump(document, f, indent=2)
+
+
+if __name__ == "__main__":
+
+    # 1. Create an ArgumentParser object
+    parser = argparse.ArgumentParser(
+        description="Send weighted traffic straight to the backend endpoints"
+    )
+
+    # 2. Add arguments
+    parser.add_argument(
+        "--url",
+        type=str,
+        default="http://127.0.0.1:8005",
+        help="base url of the backend",
+    )
+    parser.add_argument(
+        "--mix",
+        type=str,
+        default="profile.txt",
+        help="profile with one target per line, or a .jsonl request log",
+    )
+    parser.add_argument(
+        "--endpoint",
+        type=parse_endpoint,
+        action="append",
+        help="endpoint targets are sent to, as PATH or PATH=WEIGHT; may be "
+        + "repeated, /get-all-data/ by default",
+    )
+    parser.add_argument(
+        "--mode",
+        choices=["open", "closed"],
+        default="closed",
+        help="fixed arrival rate (open) or fixed concurrency (closed)",
+    )
+    parser.add_argument(
+        "--rate", type=float, default=2.0, help="requests per second in open loop"
+    )
+    parser.add_argument(
+        "--uniform",
+        action="store_true",
+        help="space open loop requests evenly instead of by a Poisson process",
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=64,
+        help="most concurrent requests in open loop",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=4, help="clients in closed loop"
+    )
+    parser.add_argument(
+        "--think-time",
+        type=float,
+        default=0.0,
+        help="seconds a closed loop client pauses between requests",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=60.0, help="seconds of traffic"
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=120.0,
+        help="seconds to wait for a response",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="seed of the traffic")
+    parser.add_argument(
+        "--output", type=str, default=None, help="file the JSON report goes to"
+    )
+    parser.add_argument(
+        "--stand-ins",
+        action="store_true",
+        help="start a replay server and a backend wired to it for the run",
+    )
+    parser.add_argument(
+        "--replay-port", type=int, default=8020, help="port of the replay server"
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.02,
+        help="seconds every upstream response of the replay server is delayed by",
+    )
+
+    # 3. Parse the arguments
+    args = parser.parse_args()
+
+    # 4. Invoke main method
+    main(
+        args.url,
+        args.mix,
+        args.endpoint or [("/get-all-data/", 1.0)],
+        args.mode,
+        args.rate,
+        not args.uniform,
+        args.max_in_flight,
+        args.concurrency,
+        args.think_time,
+        args.duration,
+        args.timeout,
+        args.seed,
+        args.output,
+        args.stand_ins,
+        args.replay_port,
+        args.latency,
+    )
@@ -0,0 +1,234 @@
+"""
+Content-addressed store of logo images. The top logos of a search are
+downloaded once, saved under the SHA-256 of their bytes and served by the
+backend, so the frontend no longer loads them from brandsoftheworld.com. A
+SQLite index maps each source url to its stored file.
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import requests
+from clients import HTTP_TIMEOUT, get_http_session  # pylint: disable=import-error
+from common import get_data_path, get_setting  # pylint: disable=import-error
+from metrics import upstream_call  # pylint: disable=import-error
+from model import LogoStoreStats  # pylint: disable=import-error
+
+# Image types that are stored, by content type.
+EXTENSIONS: Dict[str, str] = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/gif": "gif",
+    "image/webp": "webp",
+    "image/svg+xml": "svg",
+}
+
+# Largest image that is stored.
+MAX_IMAGE_BYTES = get_setting("LOGO_STORE_MAX_IMAGE_BYTES", 2 * 1024 * 1024)
+
+NAME_PATTERN = re.compile(r"^[0-9a-f]{64}\.(png|jpg|gif|webp|svg)$")
+
+
+class LogoStore:
+    """
+    A directory of logo images named by content hash.
+    """
+
+    def __init__(
+        self, directory: str, download_workers: int, enabled: bool = True
+    ):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        directory : str
+            Directory holding the images and the index database.
+        download_workers : int
+            Number of images downloaded concurrently.
+        enabled : bool, optional
+            When False nothing is downloaded, by default True
+        """
+        self.directory = directory
+        self.enabled = enabled
+        self._connection = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=download_workers, thread_name_prefix="logo-store"
+        )
+        self._reused = 0
+        self._downloads = 0
+        self._download_errors = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # Called with the lock held. The connection is opened on first use
+        # and shared by all threads.
+        if self._connection is None:
+            os.makedirs(self.directory, exist_ok=True)
+            connection = sqlite3.connect(
+                os.path.join(self.directory, "index.sqlite3"),
+                check_same_thread=False,
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS logos ("
+                "url TEXT PRIMARY KEY, "
+                "name TEXT NOT NULL, "
+                "size INTEGER NOT NULL, "
+                "stored_at REAL NOT NULL)"
+            )
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def _lookup(self, url: str) -> Optional[str]:
+        with self._lock:
+            row = (
+                self._connect()
+                .execute("SELECT name FROM logos WHERE url = ?", (url,))
+                .fetchone()
+            )
+        if row is None or not os.path.exists(self.path(row[0])):
+            return None
+        return row[0]
+
+    def path(self, name: str) -> str:
+        """
+        Path of a stored image.
+
+        Parameters
+        ----------
+        name : str
+            The stored name, "<sha256>.<extension>".
+
+        Returns
+        -------
+        str
+            The file path.
+
+        Raises
+        ------
+        ValueError
+            Will raise an exception if the name is not a stored name.
+        """
+        if not NAME_PATTERN.match(name):
+            raise ValueError(f"invalid logo name {name}")
+        return os.path.join(self.directory, name)
+
+    def store(self, url: str) -> Optional[str]:
+        """
+        Store the image at url unless it is already stored.
+
+        Parameters
+        ----------
+        url : str
+            The source url of the image.
+
+        Returns
+        -------
+        Optional[str]
+            The stored name, or None if the image could not be stored.
+        """
+        name = self._lookup(url)
+        if name is not None:
+            with self._lock:
+                self._reused += 1
+            return name
+        try:
+            with upstream_call("brandsoftheworld", "logo_image"):
+                response = get_http_session().get(url, timeout=HTTP_TIMEOUT)
+                response.raise_for_status()
+            content_type = response.headers.get("Content-Type", "")
+            extension = EXTENSIONS.get(content_type.split(";")[0].strip())
+            if extension is None:
+                # Some servers send images as application/octet-stream.
+                suffix = os.path.splitext(url)[1].lower().lstrip(".")
+                extension = "jpg" if suffix == "jpeg" else suffix
+                if extension not in EXTENSIONS.values():
+                    extension = None
+            content = response.content
+            if extension is None or len(content) > MAX_IMAGE_BYTES:
+                raise ValueError(f"not a storable image: {content_type}")
+        except (requests.RequestException, ValueError) as e:
+            print(f"Error: logo download failed url={url} e={e}")
+            with self._lock:
+                self._download_errors += 1
+            return None
+
+        name = f"{hashlib.sha256(content).hexdigest()}.{extension}"
+        path = self.path(name)
+        if not os.path.exists(path):
+            temporary = f"{path}.{threading.get_ident()}.tmp"
+            with open(temporary, "wb") as f:
+                f.write(content)
+            os.replace(temporary, path)
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO logos (url, name, size, stored_at) "
+                "VALUES (?, ?, ?, ?)",
+                (url, name, len(content), time.time()),
+            )
+            connection.commit()
+            self._downloads += 1
+        return name
+
+    def store_all(self, urls: List[str]) -> List[Optional[str]]:
+        """
+        Store several images concurrently.
+
+        Parameters
+        ----------
+        urls : List[str]
+            The source urls.
+
+        Returns
+        -------
+        List[Optional[str]]
+            The stored name of each url, in order, or None where storing
+            failed or the store is disabled.
+        """
+        if not self.enabled:
+            return [None] * len(urls)
+        return list(self._executor.map(self.store, urls))
+
+    def stats(self) -> LogoStoreStats:
+        """
+        Counters of the logo store.
+
+        Returns
+        -------
+        LogoStoreStats
+            The current statistics.
+        """
+        with self._lock:
+            entries, size = 0, 0
+            if self.enabled:
+                entries, size = (
+                    self._connect()
+                    .execute(
+                        "SELECT COUNT(*), SUM(size) FROM (SELECT name, "
+                        "MAX(size) AS size FROM logos GROUP BY name)"
+                    )
+                    .fetchone()
+                )
+            return LogoStoreStats(
+                entries=entries,
+                size_bytes=size or 0,
+                reused=self._reused,
+                downloads=self._downloads,
+                download_errors=self._download_errors,
+            )
+
+
+LOGO_STORE = LogoStore(
+    directory=get_setting("LOGO_STORE_DIR", "") or get_data_path("logos"),
+    download_workers=get_setting("LOGO_STORE_WORKERS", 4),
+    enabled=get_setting("LOGO_STORE_ENABLED", True),
+)
@@ -0,0 +1,188 @@
+"""
+Prometheus metrics of the backend, rendered for the /metrics endpoint with
+prometheus_client. The metrics are kept in their own registry so that the
+endpoint only exposes what is defined here.
+"""
+
+import time
+from typing import Dict, Optional, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    disable_created_metrics,
+    generate_latest,
+)
+
+# Seconds. Covers cache hits (sub-millisecond) up to the YouTube crawl.
+LATENCY_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+)
+COUNT_BUCKETS = (0, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+LabelValues = Tuple[str, ...]
+
+# Leave out the *_created series, which nothing reads.
+disable_created_metrics()
+REGISTRY = CollectorRegistry()
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+
+def render_metrics() -> bytes:
+    """
+    Render every metric in the text exposition format.
+
+    Returns
+    -------
+    bytes
+        The /metrics response body.
+    """
+    return generate_latest(REGISTRY)
+
+
+def totals(histogram: Histogram) -> Dict[LabelValues, Tuple[int, float]]:
+    """
+    Observation count and sum of every child of a histogram, e.g. to diff
+    the histogram around a benchmark run.
+
+    Parameters
+    ----------
+    histogram : Histogram
+        The histogram.
+
+    Returns
+    -------
+    Dict[LabelValues, Tuple[int, float]]
+        (count, sum) per combination of label values.
+    """
+    counts: Dict[LabelValues, int] = {}
+    sums: Dict[LabelValues, float] = {}
+    for family in histogram.collect():
+        for sample in family.samples:
+            # Labels are in the order of the histogram's label names.
+            values = tuple(sample.labels.values())
+            if sample.name.endswith("_count"):
+                counts[values] = int(sample.value)
+            elif sample.name.endswith("_sum"):
+                sums[values] = sample.value
+    return {values: (count, sums[values]) for values, count in counts.items()}
+
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Latency of HTTP requests by route.",
+    ["route", "method"],
+    buckets=LATENCY_BUCKETS,
+    registry=REGISTRY,
+)
+HTTP_REQUESTS = Counter(
+    "http_requests_total",
+    "HTTP requests by route and status code.",
+    ["route", "method", "status"],
+    registry=REGISTRY,
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "HTTP requests currently being served, by route.",
+    ["route"],
+    registry=REGISTRY,
+)
+SOURCE_DURATION = Histogram(
+    "pipeline_source_duration_seconds",
+    "Latency of a pipeline source, including cache hits, by outcome.",
+    ["chain", "outcome"],
+    buckets=LATENCY_BUCKETS,
+    registry=REGISTRY,
+)
+SOURCES_IN_FLIGHT = Gauge(
+    "pipeline_sources_in_flight",
+    "Pipeline sources currently running, by chain.",
+    ["chain"],
+    registry=REGISTRY,
+)
+STAGE_DURATION = Histogram(
+    "pipeline_stage_duration_seconds",
+    "Latency of each pipeline stage that ran (cache misses only).",
+    ["chain", "stage"],
+    buckets=LATENCY_BUCKETS,
+    registry=REGISTRY,
+)
+UPSTREAM_CALL_DURATION = Histogram(
+    "upstream_call_duration_seconds",
+    "Latency of calls to upstream services.",
+    ["service", "operation"],
+    buckets=LATENCY_BUCKETS,
+    registry=REGISTRY,
+)
+UPSTREAM_CALLS = Counter(
+    "upstream_calls_total",
+    "Calls to upstream services by outcome (ok or error).",
+    ["service", "operation", "outcome"],
+    registry=REGISTRY,
+)
+COMMENTS_FETCHED = Histogram(
+    "sentiment_comments_fetched",
+    "Comments fetched per sentiment request.",
+    ["source"],
+    buckets=COUNT_BUCKETS,
+    registry=REGISTRY,
+)
+COMMENTS_SCORED = Histogram(
+    "sentiment_comments_scored",
+    "Comments scored per sentiment request (not reused from the archive).",
+    ["source"],
+    buckets=COUNT_BUCKETS,
+    registry=REGISTRY,
+)
+
+
+class upstream_call:  # pylint: disable=invalid-name
+    """
+    Context manager that times a call to an upstream service and counts it
+    as ok or error depending on whether its block raised.
+    """
+
+    __slots__ = ("_histogram", "_ok", "_error", "_start")
+
+    def __init__(self, service: str, operation: str):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        service : str
+            The upstream service, e.g. "youtube".
+        operation : str
+            The call made, e.g. "search".
+        """
+        self._histogram = UPSTREAM_CALL_DURATION.labels(service, operation)
+        self._ok = UPSTREAM_CALLS.labels(service, operation, "ok")
+        self._error = UPSTREAM_CALLS.labels(service, operation, "error")
+        self._start = 0.0
+
+    def __enter__(self) -> "upstream_call":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> Optional[bool]:
+        self._histogram.observe(time.perf_counter() - self._start)
+        (self._ok if exc_type is None else self._error).inc()
+        return None
@@ -3,7 +3,7 @@ Pydantic model for the Stock Analyzer API
 """
 
 from enum import Enum
-from typing import List
+from typing import Any, Dict, List, Optional
 
 from pydantic import BaseModel
 
@@ -30,6 +30,7 @@ class Logo(BaseModel):
     url: str
     title: str
     distance: int
+    local_url: Optional[str] = None
 
 
 class TargetQuery(BaseModel):
@@ -69,10 +70,17 @@ class StockData(BaseModel):
 
 class Sentiment(BaseModel):
     """
-    Model for sentiment analysis score
+    Model for sentiment analysis score. score is the percentage of positive
+    comments among the sample_size positive and negative ones, and
+    [ci_low, ci_high] its confidence interval. comments also counts neutral
+    comments.
     """
 
     score: float
+    sample_size: int = 0
+    comments: int = 0
+    ci_low: float = 0.0
+    ci_high: float = 100.0
 
 
 class CombinedData(BaseModel):
@@ -87,3 +95,173 @@ class CombinedData(BaseModel):
     stock_data: List[StockData]
     youtube_sentiment: Sentiment
     reddit_sentiment: Sentiment
+
+
+class StageError(BaseModel):
+    """
+    Model for an error raised by one stage of a pipeline chain
+    """
+
+    chain: str
+    stage: str
+    error_type: str
+    message: str
+    elapsed: float
+
+
+class BatchResult(BaseModel):
+    """
+    Model for a batch of /get-all-data/ calls. Both maps are keyed by the
+    target as it was requested.
+    """
+
+    results: Dict[str, CombinedData]
+    errors: Dict[str, List[StageError]]
+
+
+class SourceFrame(BaseModel):
+    """
+    Model for one frame of a streamed /get-all-data/ response. It carries the
+    result of a single source, or its error.
+    """
+
+    type: str = "source"
+    chain: str
+    field: str
+    elapsed: float
+    data: Optional[Any] = None
+    error: Optional[StageError] = None
+
+
+class SummaryFrame(BaseModel):
+    """
+    Model for the last frame of a streamed /get-all-data/ response
+    """
+
+    type: str = "summary"
+    target: str
+    completed: List[str]
+    errors: List[StageError]
+    elapsed: float
+
+
+class BrowserPoolStats(BaseModel):
+    """
+    Model for browser pool health and utilization
+    """
+
+    size: int
+    max_uses: int
+    healthy: bool
+    busy: int
+    idle: int
+    waiting: int
+    utilization: float
+    leases: int
+    recycles: int
+    crashes: int
+    browser_launches: int
+    context_uses: List[int]
+
+
+class CacheStats(BaseModel):
+    """
+    Model for result cache counters
+    """
+
+    hits: int
+    stale_hits: int
+    misses: int
+    evictions: int
+    refreshes: int
+    refresh_errors: int
+    entries: int
+    size_bytes: int
+    max_bytes: int
+
+
+class CommentArchiveStats(BaseModel):
+    """
+    Model for comment archive counters
+    """
+
+    reused: int
+    scored: int
+    entries: int
+
+
+class SingleFlightStats(BaseModel):
+    """
+    Model for request coalescing counters
+    """
+
+    executed: int
+    coalesced: int
+    in_flight: int
+    waiting: int
+
+
+class TickerIndexStats(BaseModel):
+    """
+    Model for ticker index size, age and counters
+    """
+
+    entries: int
+    aliases: int
+    age: float
+    hits: int
+    misses: int
+    refreshes: int
+    refresh_errors: int
+
+
+class PriceStoreStats(BaseModel):
+    """
+    Model for price store counters
+    """
+
+    months_served: int
+    months_fetched: int
+    fetches: int
+    skipped_fetches: int
+    entries: int
+    tickers: int
+
+
+class LogoStoreStats(BaseModel):
+    """
+    Model for logo store counters
+    """
+
+    entries: int
+    size_bytes: int
+    reused: int
+    downloads: int
+    download_errors: int
+
+
+class DescriptionStoreStats(BaseModel):
+    """
+    Model for description store counters
+    """
+
+    entries: int
+    hits: int
+    stale_hits: int
+    misses: int
+    refreshes: int
+    refresh_errors: int
+
+
+class ScoringPoolStats(BaseModel):
+    """
+    Model for sentiment scoring pool counters
+    """
+
+    enabled: bool
+    workers: int
+    pooled_batches: int
+    pooled_comments: int
+    in_process_batches: int
+    in_process_comments: int
+    failures: int
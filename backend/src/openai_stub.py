@@ -0,0 +1,132 @@
+"""
+Local stand-in for the OpenAI chat completions API, for tests and
+benchmarks that must not call the real service. Point the backend at it
+with OPENAI_BASE_URL=http://127.0.0.1:8010/v1 and any OPENAI_API_KEY.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import time
+from typing import Any, Dict, List
+
+import uvicorn
+from fastapi import FastAPI
+from pydantic import BaseModel
+
+app = FastAPI()
+
+# Seconds every completion is delayed by, to imitate the real service.
+LATENCY = 0.0
+
+
+class ChatMessage(BaseModel):
+    """
+    Model for a chat message
+    """
+
+    role: str
+    content: str
+
+
+class ChatCompletionRequest(BaseModel):
+    """
+    Model for the part of a chat completion request the stub reads
+    """
+
+    model: str
+    messages: List[ChatMessage]
+
+
+def completion_text(prompt: str) -> str:
+    """
+    The deterministic answer to a prompt.
+
+    Parameters
+    ----------
+    prompt : str
+        The last user message.
+
+    Returns
+    -------
+    str
+        A paragraph that quotes the prompt.
+    """
+    return (
+        f"This is a stub answer to: {prompt}. It is generated locally and "
+        "is the same for the same prompt."
+    )
+
+
+@app.post("/v1/chat/completions")
+async def create_chat_completion(
+    request: ChatCompletionRequest,
+) -> Dict[str, Any]:
+    """
+    Answer a chat completion request.
+
+    Parameters
+    ----------
+    request : ChatCompletionRequest
+        The request.
+
+    Returns
+    -------
+    Dict[str, Any]
+        A chat completion in the OpenAI response format.
+    """
+    if LATENCY > 0:
+        await asyncio.sleep(LATENCY)
+    prompt = next(
+        (m.content for m in reversed(request.messages) if m.role == "user"), ""
+    )
+    text = completion_text(prompt)
+    prompt_tokens = sum(len(m.content.split()) for m in request.messages)
+    completion_tokens = len(text.split())
+    return {
+        "id": "chatcmpl-" + hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:24],
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+if __name__ == "__main__":
+
+    # 1. Create an ArgumentParser object
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for the OpenAI chat completions API"
+    )
+
+    # 2. Add arguments
+    parser.add_argument(
+        "--host", type=str, default="127.0.0.1", help="bind address"
+    )
+    parser.add_argument(
+        "--port", type=int, default=8010, help="port to listen on"
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="seconds every completion is delayed by",
+    )
+
+    # 3. Parse the arguments
+    args = parser.parse_args()
+
+    # 4. Serve the stub
+    LATENCY = args.latency
+    uvicorn.run(app, host=args.host, port=args.port)
@@ -0,0 +1,486 @@
+"""
+Asyncio orchestrator that runs the data sources of a request as concurrent
+tasks. It replaces the per-request bonobo graph.
+"""
+
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from collections.abc import Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional, Tuple
+
+from cache import RESULT_CACHE  # pylint: disable=import-error
+from common import normalize_target  # pylint: disable=import-error
+from common import PipelineContext, get_setting  # pylint: disable=import-error
+from metrics import (  # pylint: disable=import-error
+    SOURCE_DURATION,
+    SOURCES_IN_FLIGHT,
+    STAGE_DURATION,
+)
+from model import TargetQuery  # pylint: disable=import-error
+from model import ChainType, StageError  # pylint: disable=import-error
+from singleflight import SINGLE_FLIGHT  # pylint: disable=import-error
+
+# A source is a sequence of blocking stages. The first stage receives the
+# query and each following stage receives the output of the previous one.
+Stages = List[Callable[[Any], Any]]
+
+# Shared by every request so that no threads are started per request.
+EXECUTOR = ThreadPoolExecutor(
+    max_workers=get_setting("PIPELINE_MAX_WORKERS", 64),
+    thread_name_prefix="pipeline",
+)
+
+# Upper bound on the sources of one batch request that run at the same time.
+# It keeps a large batch from queueing sources on the executor, where the
+# wait would count against their timeouts, and leaves room for other requests.
+BATCH_MAX_SOURCES = get_setting("BATCH_MAX_SOURCES", 32)
+
+DEFAULT_TIMEOUTS: Dict[ChainType, float] = {
+    ChainType.LOGO_DATA: 30.0,
+    ChainType.DESCRPTION_DATA: 30.0,
+    ChainType.STOCK_INFO_DATA: 15.0,
+    ChainType.STOCK_PRICE_DATA: 15.0,
+    ChainType.YOUTUBE_SENTIMENT_DATA: 120.0,
+    ChainType.REDDIT_SENTIMENT_DATA: 90.0,
+}
+
+
+class PipelineError(Exception):
+    """
+    Raised when one or more sources of a request failed.
+    """
+
+    def __init__(self, errors: List[StageError]):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        errors : List[StageError]
+            The per-stage errors.
+        """
+        self.errors = errors
+        super().__init__(
+            "Errors occurred during pipeline execution: "
+            + ",".join(f"{e.chain}.{e.stage}: {e.message}" for e in errors)
+        )
+
+
+def get_timeout(chain: ChainType) -> float:
+    """
+    Get the timeout for a source. It can be overridden with a
+    SOURCE_TIMEOUT_<CHAIN TYPE> environmental variable.
+
+    Parameters
+    ----------
+    chain : ChainType
+        The type of data produced by the source.
+
+    Returns
+    -------
+    float
+        The timeout in seconds.
+    """
+    return get_setting(f"SOURCE_TIMEOUT_{chain.name}", DEFAULT_TIMEOUTS[chain])
+
+
+class _StageTracker:
+    """
+    Shared between a source task and the worker thread running its stages so
+    that timeouts can be attributed to a stage and remaining stages skipped.
+    """
+
+    def __init__(self):
+        self.stage = "start"
+        self.cancelled = threading.Event()
+
+
+class _LazyStage:
+    """
+    The iterator returned by a lazy stage, e.g. comment waves that are only
+    fetched when the next stage asks for them. The time spent producing its
+    items is added to the lazy stage, which is observed once it is finished.
+    The consuming stage still includes the time it waited for the items.
+    """
+
+    def __init__(self, items: Iterator, histogram: Any, elapsed: float):
+        self.items = items
+        self.histogram = histogram
+        self.elapsed = elapsed
+        self.finished = False
+
+    def __iter__(self) -> "_LazyStage":
+        return self
+
+    def __next__(self) -> Any:
+        start = time.perf_counter()
+        try:
+            return next(self.items)
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+    def close(self):
+        """
+        Close the underlying iterator, if it can be closed.
+        """
+        close = getattr(self.items, "close", None)
+        if close is not None:
+            start = time.perf_counter()
+            close()
+            self.elapsed += time.perf_counter() - start
+
+    def finish(self):
+        """
+        Observe the stage duration. Later calls have no effect.
+        """
+        if not self.finished:
+            self.finished = True
+            self.histogram.observe(self.elapsed)
+
+
+class StageCancelled(Exception):
+    """
+    Raised in a worker thread when its source was cancelled before the next
+    stage started.
+    """
+
+
+def _run_stages(
+    query: TargetQuery,
+    chain: ChainType,
+    stages: Stages,
+    tracker: _StageTracker,
+) -> Any:
+    data: Any = query
+    lazy: List[_LazyStage] = []
+    try:
+        for stage in stages:
+            if tracker.cancelled.is_set():
+                raise StageCancelled(tracker.stage)
+            tracker.stage = stage.__name__
+            histogram = STAGE_DURATION.labels(chain.name, tracker.stage)
+            start = time.perf_counter()
+            try:
+                data = stage(data)
+            except BaseException:
+                histogram.observe(time.perf_counter() - start)
+                raise
+            elapsed = time.perf_counter() - start
+            if isinstance(data, Iterator):
+                # The work of a lazy stage happens while later stages pull
+                # from it, so it is timed as its items are produced.
+                data = _LazyStage(data, histogram, elapsed)
+                lazy.append(data)
+            else:
+                histogram.observe(elapsed)
+        tracker.stage = "done"
+        return data
+    finally:
+        for stage_items in lazy:
+            stage_items.finish()
+
+
+def _run_coalesced(
+    query: TargetQuery,
+    chain: ChainType,
+    stages: Stages,
+    tracker: _StageTracker,
+    deadline: float,
+) -> Any:
+    key = (chain, normalize_target(query.target))
+    while True:
+        # Reported as the stage if this caller times out while waiting for
+        # another request's run. The running caller overwrites it.
+        tracker.stage = "coalesced"
+        # Waiting is bounded by the source's timeout so that a hung run
+        # does not hold the executor threads of the callers that joined it.
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("timed out waiting for a coalesced run")
+        try:
+            return SINGLE_FLIGHT.do(
+                key,
+                lambda: _run_stages(query, chain, stages, tracker),
+                timeout=remaining,
+            )
+        except StageCancelled:
+            if tracker.cancelled.is_set():
+                raise
+            # The run that was joined belonged to a request that timed out
+            # or went away. Start or join another one.
+
+
+def _run_source(
+    context: PipelineContext,
+    chain: ChainType,
+    stages: Stages,
+    tracker: _StageTracker,
+    deadline: float,
+):
+    query = context.query
+    data = RESULT_CACHE.get_or_compute(
+        chain,
+        query.target,
+        lambda: _run_coalesced(query, chain, stages, tracker, deadline),
+        # A background refresh must not be tied to this request's timeout.
+        refresh=lambda: _run_stages(query, chain, stages, _StageTracker()),
+    )
+    if not tracker.cancelled.is_set():
+        context.store(chain, data)
+
+
+def _release_slot(
+    loop: asyncio.AbstractEventLoop, slot: asyncio.Semaphore, _: Future
+):
+    # Called in the worker thread, or in the caller if the work was
+    # cancelled before it started.
+    try:
+        loop.call_soon_threadsafe(slot.release)
+    except RuntimeError:
+        # The loop is closed; nobody is waiting for the slot any more.
+        pass
+
+
+async def run_source(
+    context: PipelineContext,
+    chain: ChainType,
+    stages: Stages,
+    timeout: Optional[float] = None,
+    slot: Optional[asyncio.Semaphore] = None,
+) -> Optional[StageError]:
+    """
+    Run the stages of one source on the shared executor with a timeout. The
+    result cache is consulted first, and on a miss the run is shared with
+    any identical run already in flight. A blocking stage cannot be
+    interrupted, so on timeout the error is returned while the worker thread
+    finishes the stage in the background.
+
+    Parameters
+    ----------
+    context : PipelineContext
+        The per-request pipeline context. The source output is stored in it.
+    chain : ChainType
+        The type of data produced by the source.
+    stages : Stages
+        The blocking stages of the source.
+    timeout : Optional[float], optional
+        Timeout in seconds, by default the configured timeout of the chain.
+    slot : Optional[asyncio.Semaphore], optional
+        A semaphore the caller acquired for this source. It is released when
+        the worker thread is done, not when the source times out, by default
+        None
+
+    Returns
+    -------
+    Optional[StageError]
+        None on success, otherwise the error of the failing stage.
+    """
+    if timeout is None:
+        timeout = get_timeout(chain)
+    tracker = _StageTracker()
+    loop = asyncio.get_running_loop()
+    in_flight = SOURCES_IN_FLIGHT.labels(chain.name)
+    in_flight.inc()
+    outcome = "ok"
+    start = time.perf_counter()
+    # Copy the context so the worker thread sees the caller's contextvars.
+    work = EXECUTOR.submit(
+        contextvars.copy_context().run,
+        _run_source,
+        context,
+        chain,
+        stages,
+        tracker,
+        time.monotonic() + timeout,
+    )
+    if slot is not None:
+        work.add_done_callback(functools.partial(_release_slot, loop, slot))
+    try:
+        await asyncio.wait_for(asyncio.wrap_future(work), timeout=timeout)
+    except asyncio.TimeoutError:
+        tracker.cancelled.set()
+        outcome = "timeout"
+        return StageError(
+            chain=chain.name,
+            stage=tracker.stage,
+            error_type="TimeoutError",
+            message=f"timed out after {timeout:.1f}s",
+            elapsed=time.perf_counter() - start,
+        )
+    except asyncio.CancelledError:
+        tracker.cancelled.set()
+        outcome = "cancelled"
+        raise
+    except Exception as e:  # pylint: disable=broad-except
+        outcome = "error"
+        return StageError(
+            chain=chain.name,
+            stage=tracker.stage,
+            error_type=type(e).__name__,
+            message=str(e),
+            elapsed=time.perf_counter() - start,
+        )
+    finally:
+        in_flight.dec()
+        SOURCE_DURATION.labels(chain.name, outcome).observe(
+            time.perf_counter() - start
+        )
+    return None
+
+
+async def iter_sources(
+    context: PipelineContext,
+    sources: Dict[ChainType, Stages],
+) -> AsyncGenerator[Tuple[ChainType, Optional[StageError]], None]:
+    """
+    Run all sources concurrently and yield each one as soon as it finishes.
+    Sources that are still running are cancelled if the consumer stops early.
+
+    Parameters
+    ----------
+    context : PipelineContext
+        The per-request pipeline context.
+    sources : Dict[ChainType, Stages]
+        The sources to run.
+
+    Yields
+    ------
+    AsyncGenerator[Tuple[ChainType, Optional[StageError]], None]
+        A (chain type, error) pair per finished source. The error is None on
+        success and the output can be read from the context.
+    """
+    tasks = {
+        asyncio.ensure_future(run_source(context, chain, stages)): chain
+        for chain, stages in sources.items()
+    }
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                yield tasks[task], task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def gather_sources(
+    context: PipelineContext,
+    sources: Dict[ChainType, Stages],
+) -> List[StageError]:
+    """
+    Run all sources concurrently and wait for all of them.
+
+    Parameters
+    ----------
+    context : PipelineContext
+        The per-request pipeline context.
+    sources : Dict[ChainType, Stages]
+        The sources to run.
+
+    Returns
+    -------
+    List[StageError]
+        The errors of the sources that failed.
+    """
+    results = await asyncio.gather(
+        *(run_source(context, chain, stages) for chain, stages in sources.items())
+    )
+    return [error for error in results if error is not None]
+
+
+def run_sources(
+    context: PipelineContext,
+    sources: Dict[ChainType, Stages],
+):
+    """
+    Blocking entry point for synchronous endpoints.
+
+    Parameters
+    ----------
+    context : PipelineContext
+        The per-request pipeline context.
+    sources : Dict[ChainType, Stages]
+        The sources to run.
+
+    Raises
+    ------
+    PipelineError
+        If any of the sources failed.
+    """
+    errors = asyncio.run(gather_sources(context, sources))
+    if errors:
+        raise PipelineError(errors)
+
+
+async def gather_batch(
+    contexts: List[PipelineContext],
+    sources: Dict[ChainType, Stages],
+    max_sources: int = BATCH_MAX_SOURCES,
+) -> List[List[StageError]]:
+    """
+    Run all sources for several requests on the shared executor, with at
+    most max_sources of them running at the same time. A source that timed
+    out keeps its slot until its worker thread is done.
+
+    Parameters
+    ----------
+    contexts : List[PipelineContext]
+        One pipeline context per target.
+    sources : Dict[ChainType, Stages]
+        The sources to run for every target.
+    max_sources : int, optional
+        Number of sources allowed to run at once, by default BATCH_MAX_SOURCES
+
+    Returns
+    -------
+    List[List[StageError]]
+        The errors of the failed sources of each context, in order.
+    """
+    semaphore = asyncio.Semaphore(max_sources)
+
+    async def bounded(
+        context: PipelineContext, chain: ChainType, stages: Stages
+    ) -> Optional[StageError]:
+        await semaphore.acquire()
+        return await run_source(context, chain, stages, slot=semaphore)
+
+    async def gather_one(context: PipelineContext) -> List[StageError]:
+        results = await asyncio.gather(
+            *(
+                bounded(context, chain, stages)
+                for chain, stages in sources.items()
+            )
+        )
+        return [error for error in results if error is not None]
+
+    return list(await asyncio.gather(*(gather_one(c) for c in contexts)))
+
+
+def run_batch(
+    contexts: List[PipelineContext],
+    sources: Dict[ChainType, Stages],
+) -> List[List[StageError]]:
+    """
+    Blocking entry point for batch endpoints. Unlike run_sources it does not
+    raise, so that every target can report its own errors.
+
+    Parameters
+    ----------
+    contexts : List[PipelineContext]
+        One pipeline context per target.
+    sources : Dict[ChainType, Stages]
+        The sources to run for every target.
+
+    Returns
+    -------
+    List[List[StageError]]
+        The errors of the failed sources of each context, in order.
+    """
+    return asyncio.run(gather_batch(contexts, sources))
@@ -0,0 +1,93 @@
+"""
+Fill the description store ahead of traffic from a list of targets, such as
+the traffic profile used by automate.py.
+"""
+
+import argparse
+import time
+from collections import Counter
+from typing import List
+
+from description_store import DESCRIPTION_STORE  # pylint: disable=import-error
+
+
+def read_targets(profile: str) -> List[str]:
+    """
+    Read the targets of a profile file, one per line. Blank lines are
+    skipped.
+
+    Parameters
+    ----------
+    profile : str
+        Path of the profile file.
+
+    Returns
+    -------
+    List[str]
+        The targets in file order.
+    """
+    with open(profile, "r") as file:
+        return [line.strip() for line in file if line.strip()]
+
+
+def main(profile: str, workers: int, force: bool):
+    """
+    Main processing method.
+
+    Parameters
+    ----------
+    profile : str
+        Path of the profile file.
+    workers : int
+        Number of descriptions generated concurrently.
+    force : bool
+        Regenerate descriptions that are still fresh.
+    """
+    targets = read_targets(profile)
+    start = time.perf_counter()
+    outcomes = DESCRIPTION_STORE.prewarm(targets, workers=workers, force=force)
+    elapsed = time.perf_counter() - start
+    for company, outcome in sorted(outcomes.items()):
+        print(f"{company}: {outcome}")
+    counts = Counter(
+        outcome if outcome in ("fresh", "generated") else "error"
+        for outcome in outcomes.values()
+    )
+    print(
+        f"targets={len(targets)} companies={len(outcomes)} "
+        f"generated={counts['generated']} fresh={counts['fresh']} "
+        f"errors={counts['error']} in {elapsed:.1f} s"
+    )
+
+
+if __name__ == "__main__":
+
+    # 1. Create an ArgumentParser object
+    parser = argparse.ArgumentParser(
+        description="Generate the company descriptions of a target list"
+    )
+
+    # 2. Add arguments
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default="profile.txt",
+        help="file with one target company per line",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="number of descriptions generated concurrently",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="regenerate descriptions that are still fresh",
+    )
+
+    # 3. Parse the arguments
+    args = parser.parse_args()
+
+    # 4. Invoke main method
+    main(args.profile, args.workers, args.force)
@@ -0,0 +1,403 @@
+"""
+SQLite store of monthly price aggregates. Months that had already closed
+when they were fetched never change and are served from disk, so a request
+only asks Polygon for the months that are missing or still open. The open
+current month is reused for a short TTL, so hot tickers need no upstream
+call at all.
+"""
+
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from common import get_data_path, get_setting  # pylint: disable=import-error
+from metrics import upstream_call  # pylint: disable=import-error
+from model import PriceStoreStats  # pylint: disable=import-error
+
+# A month as "YYYY-MM". Strings in this form sort chronologically.
+Month = str
+
+MONTH_NAMES = [
+    None,
+    "Jan",
+    "Feb",
+    "Mar",
+    "Apr",
+    "May",
+    "Jun",
+    "Jul",
+    "Aug",
+    "Sep",
+    "Oct",
+    "Nov",
+    "Dec",
+]
+
+# Fetches (first day, last day) of a month range and returns the
+# (month, close) pairs of the months that had trading.
+Fetcher = Callable[[date, date], Iterable[Tuple[Month, float]]]
+
+
+def to_month(day: date) -> Month:
+    """
+    Month of a date.
+
+    Parameters
+    ----------
+    day : date
+        The date.
+
+    Returns
+    -------
+    Month
+        The month as "YYYY-MM".
+    """
+    return f"{day.year:04d}-{day.month:02d}"
+
+
+def timestamp_month(timestamp_ms: int) -> Month:
+    """
+    Month of a Polygon aggregate timestamp.
+
+    Parameters
+    ----------
+    timestamp_ms : int
+        Start of the aggregate window in milliseconds since the epoch.
+
+    Returns
+    -------
+    Month
+        The month as "YYYY-MM".
+    """
+    return to_month(datetime.fromtimestamp(timestamp_ms // 1000, tz=timezone.utc))
+
+
+def shift_month(month: Month, months: int) -> Month:
+    """
+    Add a number of months to a month.
+
+    Parameters
+    ----------
+    month : Month
+        The month as "YYYY-MM".
+    months : int
+        Months to add, negative to go back.
+
+    Returns
+    -------
+    Month
+        The shifted month.
+    """
+    year, number = int(month[:4]), int(month[5:])
+    index = year * 12 + number - 1 + months
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def month_range(first: Month, last: Month) -> List[Month]:
+    """
+    All months from first to last, inclusive.
+
+    Parameters
+    ----------
+    first : Month
+        The first month.
+    last : Month
+        The last month.
+
+    Returns
+    -------
+    List[Month]
+        The months in order.
+    """
+    months = []
+    month = first
+    while month <= last:
+        months.append(month)
+        month = shift_month(month, 1)
+    return months
+
+
+def first_day(month: Month) -> date:
+    """
+    First day of a month.
+
+    Parameters
+    ----------
+    month : Month
+        The month as "YYYY-MM".
+
+    Returns
+    -------
+    date
+        The date.
+    """
+    return date(int(month[:4]), int(month[5:]), 1)
+
+
+class PriceStore:
+    """
+    A persistent map from (ticker, month) to the monthly close. For every
+    ticker it also records the span of months that is known to be complete,
+    so that months without trading (before a listing) are not fetched again.
+    """
+
+    def __init__(self, path: str, open_ttl: float, enabled: bool = True):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        path : str
+            Path of the SQLite database file.
+        open_ttl : float
+            Seconds for which a fetched close of the current, still open,
+            month is reused.
+        enabled : bool, optional
+            When False every window is fetched and nothing is stored, by
+            default True
+        """
+        self.path = path
+        self.open_ttl = open_ttl
+        self.enabled = enabled
+        self._connection = None
+        self._lock = threading.Lock()
+        self._served = 0
+        self._fetched = 0
+        self._fetches = 0
+        self._skipped_fetches = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # Called with the lock held. The connection is opened on first use
+        # and shared by all threads.
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS monthly_aggs ("
+                "ticker TEXT NOT NULL, "
+                "month TEXT NOT NULL, "
+                "close REAL NOT NULL, "
+                "fetched_at REAL NOT NULL, "
+                "PRIMARY KEY (ticker, month))"
+            )
+            # Every month from first_month to final_through was fetched
+            # after it closed, so it is complete even if it has no row.
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS coverage ("
+                "ticker TEXT PRIMARY KEY, "
+                "first_month TEXT NOT NULL, "
+                "final_through TEXT NOT NULL)"
+            )
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def _load(
+        self, ticker: str, first: Month, last: Month
+    ) -> Tuple[Dict[Month, Tuple[float, float]], Optional[Tuple[Month, Month]]]:
+        with self._lock:
+            connection = self._connect()
+            rows = connection.execute(
+                "SELECT month, close, fetched_at FROM monthly_aggs "
+                "WHERE ticker = ? AND month BETWEEN ? AND ?",
+                (ticker, first, last),
+            )
+            stored = {
+                month: (close, fetched_at) for month, close, fetched_at in rows
+            }
+            coverage = connection.execute(
+                "SELECT first_month, final_through FROM coverage "
+                "WHERE ticker = ?",
+                (ticker,),
+            ).fetchone()
+        return stored, coverage
+
+    def _save(
+        self,
+        ticker: str,
+        rows: List[Tuple[Month, float]],
+        fetched: Tuple[Month, Month],
+        today: Month,
+        fetched_at: float,
+    ):
+        with self._lock:
+            connection = self._connect()
+            connection.executemany(
+                "INSERT OR REPLACE INTO monthly_aggs "
+                "(ticker, month, close, fetched_at) VALUES (?, ?, ?, ?)",
+                [(ticker, month, close, fetched_at) for month, close in rows],
+            )
+            # Only closed months extend the complete span. A fetched range
+            # that is not adjacent to the recorded span replaces it.
+            first, last = fetched
+            final_through = min(last, shift_month(today, -1))
+            if first <= final_through:
+                coverage = connection.execute(
+                    "SELECT first_month, final_through FROM coverage "
+                    "WHERE ticker = ?",
+                    (ticker,),
+                ).fetchone()
+                if coverage is not None and not (
+                    first > shift_month(coverage[1], 1)
+                    or final_through < shift_month(coverage[0], -1)
+                ):
+                    first = min(first, coverage[0])
+                    final_through = max(final_through, coverage[1])
+                connection.execute(
+                    "INSERT OR REPLACE INTO coverage "
+                    "(ticker, first_month, final_through) VALUES (?, ?, ?)",
+                    (ticker, first, final_through),
+                )
+            connection.commit()
+
+    def monthly_closes(
+        self,
+        ticker: str,
+        first: Month,
+        last: Month,
+        fetch: Fetcher,
+        today: Optional[date] = None,
+    ) -> List[Tuple[Month, float]]:
+        """
+        Get the monthly closes of a ticker, fetching only the months that are
+        not complete on disk. At most one upstream call is made, covering
+        the span from the earliest to the latest missing month.
+
+        Parameters
+        ----------
+        ticker : str
+            The ticker symbol.
+        first : Month
+            The first month of the window.
+        last : Month
+            The last month of the window.
+        fetch : Fetcher
+            Fetches a range of months from upstream.
+        today : Optional[date], optional
+            The current date, by default date.today()
+
+        Returns
+        -------
+        List[Tuple[Month, float]]
+            (month, close) pairs in order, for the months that had trading.
+        """
+        if today is None:
+            today = date.today()
+        current = to_month(today)
+        last = min(last, current)
+        if not self.enabled:
+            return [
+                (month, close)
+                for month, close in fetch(first_day(first), today)
+                if first <= month <= last
+            ]
+
+        now = time.time()
+        stored, coverage = self._load(ticker, first, last)
+        months = month_range(first, last)
+        missing = []
+        for month in months:
+            if coverage is not None and coverage[0] <= month <= coverage[1]:
+                continue
+            entry = stored.get(month)
+            if (
+                month == current
+                and entry is not None
+                and now - entry[1] < self.open_ttl
+            ):
+                continue
+            missing.append(month)
+
+        if missing:
+            fetch_first, fetch_last = missing[0], missing[-1]
+            end = min(first_day(shift_month(fetch_last, 1)), today)
+            rows = [
+                (month, close)
+                for month, close in fetch(first_day(fetch_first), end)
+                if fetch_first <= month <= fetch_last
+            ]
+            self._save(ticker, rows, (fetch_first, fetch_last), current, now)
+            for month, close in rows:
+                stored[month] = (close, now)
+        with self._lock:
+            self._served += len(months) - len(missing)
+            self._fetched += len(missing)
+            if missing:
+                self._fetches += 1
+            else:
+                self._skipped_fetches += 1
+        return [(month, stored[month][0]) for month in months if month in stored]
+
+    def stats(self) -> PriceStoreStats:
+        """
+        Counters showing how many months were served from disk versus
+        fetched.
+
+        Returns
+        -------
+        PriceStoreStats
+            The current statistics.
+        """
+        with self._lock:
+            entries = 0
+            tickers = 0
+            if self.enabled:
+                connection = self._connect()
+                entries = connection.execute(
+                    "SELECT COUNT(*) FROM monthly_aggs"
+                ).fetchone()[0]
+                tickers = connection.execute(
+                    "SELECT COUNT(*) FROM coverage"
+                ).fetchone()[0]
+            return PriceStoreStats(
+                months_served=self._served,
+                months_fetched=self._fetched,
+                fetches=self._fetches,
+                skipped_fetches=self._skipped_fetches,
+                entries=entries,
+                tickers=tickers,
+            )
+
+
+def polygon_fetcher(client: Any, ticker: str) -> Fetcher:
+    """
+    Build a fetcher that reads monthly aggregates from Polygon.
+
+    Parameters
+    ----------
+    client : Any
+        The Polygon RESTClient.
+    ticker : str
+        The ticker symbol.
+
+    Returns
+    -------
+    Fetcher
+        The fetcher.
+    """
+
+    def fetch(start: date, end: date) -> List[Tuple[Month, float]]:
+        with upstream_call("polygon", "list_aggs"):
+            aggs = list(
+                client.list_aggs(
+                    ticker=ticker,
+                    multiplier=1,
+                    timespan="month",
+                    from_=start.strftime("%Y-%m-%d"),
+                    to=end.strftime("%Y-%m-%d"),
+                    limit=50000,
+                )
+            )
+        return [(timestamp_month(a.timestamp), a.close) for a in aggs]
+
+    return fetch
+
+
+PRICE_STORE = PriceStore(
+    path=get_setting("PRICE_STORE_PATH", "") or get_data_path("prices.sqlite3"),
+    open_ttl=get_setting("PRICE_STORE_OPEN_TTL", 15 * 60.0),
+    enabled=get_setting("PRICE_STORE_ENABLED", True),
+)
@@ -2,40 +2,162 @@
 This module implements reddit sentiment analysis functions.
 """
 
+import heapq
 import random
-from typing import Any, Generator, List, Tuple  # pylint: disable=import-error
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Generator, Iterable, Iterator, List, Tuple
 
 import praw
-from common import (  # pylint: disable=import-error
-    SERVICES,
-    get_secret,
-    perform_sentiment_analysis,
-)
+import prawcore
+from bonobo.config import use
+from clients import get_reddit_client  # pylint: disable=import-error
+from comment_archive import Comment  # pylint: disable=import-error
+from common import PipelineContext, get_setting  # pylint: disable=import-error
 from decorators import span_decorator  # pylint: disable=import-error
+from metrics import upstream_call  # pylint: disable=import-error
 from model import TargetQuery  # pylint: disable=import-error
 from model import ChainType, Sentiment  # pylint: disable=import-error
 from praw.models import MoreComments
+from sampler import (  # pylint: disable=import-error
+    CommentBudget,
+    iter_waves,
+    sample_sentiment,
+)
+
+# Errors that end the expansion of a single submission rather than failing
+# the chain. The comments read up to then are kept.
+FETCH_ERRORS = (
+    praw.exceptions.PRAWException,
+    prawcore.exceptions.PrawcoreException,
+    OSError,
+)
+
+# Number of submissions expanded concurrently per process.
+FETCH_WORKERS = get_setting("REDDIT_FETCH_WORKERS", 8)
+# Upper bound in seconds on how long a fetch waits for the rate limit window
+# to reset once the remaining request count runs low.
+MAX_RATE_LIMIT_WAIT = get_setting("REDDIT_MAX_RATE_LIMIT_WAIT", 10.0)
+# Submissions whose comments are fetched per sampling wave, and the most
+# submissions sampled per request.
+WAVE_SIZE = get_setting("REDDIT_WAVE_SIZE", 5)
+MAX_SUBMISSIONS = get_setting("REDDIT_MAX_SUBMISSIONS", 25)
+# Comments fetched per request at most, spread over the sampled submissions
+# by their comment counts.
+COMMENT_BUDGET = get_setting("REDDIT_COMMENT_BUDGET", 2500)
+
+FETCH_EXECUTOR = ThreadPoolExecutor(
+    max_workers=FETCH_WORKERS, thread_name_prefix="reddit"
+)
+
+# A sampled submission as (submission id, comment count).
+Submission = Tuple[str, int]
+
+
+def wait_for_rate_limit(reddit: praw.Reddit):
+    """
+    Block while Reddit's rate-limit headers report fewer remaining requests
+    than there are concurrent workers, so concurrent fetches cannot exhaust
+    the window.
+
+    Parameters
+    ----------
+    reddit : praw.Reddit
+        The shared Reddit client.
+    """
+    limits = reddit.auth.limits
+    remaining = limits.get("remaining")
+    reset_timestamp = limits.get("reset_timestamp")
+    if remaining is None or reset_timestamp is None:
+        return
+    if float(remaining) <= FETCH_WORKERS:
+        delay = min(float(reset_timestamp) - time.time(), MAX_RATE_LIMIT_WAIT)
+        if delay > 0:
+            time.sleep(delay)
+
+
+def fetch_submission_comments(submission: Tuple[str, int]) -> List[Comment]:
+    """
+    Load the comments of a submission, including replies, until its share of
+    the comment budget is read. The collapsed "load more comments" stubs
+    are expanded largest first, one call each. Only the comment ids and
+    texts are kept; the comment forest is dropped in the fetching thread.
+    If a call fails, the comments loaded before it are returned.
+
+    Parameters
+    ----------
+    submission : Tuple[str, int]
+        The submission id and the number of comments wanted from it.
+
+    Returns
+    -------
+    List[Comment]
+        A (comment id, text) pair for each loaded comment.
+    """
+    submission_id, limit = submission
+    reddit = get_reddit_client()
+    wait_for_rate_limit(reddit)
+    loaded = reddit.submission(submission_id)
+    # The submission is loaded lazily when its comments are first accessed.
+    try:
+        with upstream_call("reddit", "submission_comments"):
+            items = loaded.comments.list()
+    except FETCH_ERRORS as e:
+        print(f"Error: submission comments failed id={submission_id} e={e}")
+        return []
+    comments: List[Comment] = []
+    more: List[MoreComments] = []
+    while True:
+        for item in items:
+            if isinstance(item, MoreComments):
+                item.submission = loaded
+                # MoreComments orders the largest stub first.
+                heapq.heappush(more, item)
+            else:
+                comments.append((item.id, item.body))
+        if not more or len(comments) >= limit:
+            return comments
+        stub = heapq.heappop(more)
+        wait_for_rate_limit(reddit)
+        try:
+            with upstream_call("reddit", "more_comments"):
+                items = stub.comments(update=False)
+        except FETCH_ERRORS as e:
+            print(f"Error: more comments failed id={submission_id} e={e}")
+            return comments
+        if stub.count == 0:
+            # A "continue this thread" stub returns the thread as a forest of
+            # its top level comments; flatten it to reach the nested replies.
+            items = items.list()
 
 
-def reddit_extract_search_data() -> Generator[List[str], None, None]:
+@use("context")
+def reddit_extract_search_data(
+    context: PipelineContext,
+) -> Generator[List[Submission], None, None]:
     """
     Method to extract sewarch data suitable for pipeline usage.
 
+    Parameters
+    ----------
+    context : PipelineContext
+        The per-request pipeline context carrying the query.
+
     Yields
     ------
-    Generator[List[str], None, None]
+    Generator[List[Submission], None, None]
         A Generator containing the list of search data
     """
-    search_data = []
-    query = SERVICES["query"]
-    search_data = perform_reddit_extract_search_data(query)
+    search_data = perform_reddit_extract_search_data(context.query)
     yield search_data
 
 
 @span_decorator
-def perform_reddit_extract_search_data(query: TargetQuery) -> List[Any]:
+def perform_reddit_extract_search_data(query: TargetQuery) -> List[Submission]:
     """
-    Method that performs the actual search.
+    Method that performs the actual search. Only the submission ids and
+    comment counts are kept, not the listing objects, and submissions
+    without comments are left out.
 
     Parameters
     ----------
@@ -44,83 +166,108 @@ def perform_reddit_extract_search_data(query: TargetQuery) -> List[Any]:
 
     Returns
     -------
-    List[Any]
-        A list of search data results
+    List[Submission]
+        The matching submissions.
     """
     MAX_RESULTS = 100
-    client_id = get_secret("REDDIT_CLIENT_ID")
-    client_secret = get_secret("REDDIT_CLIENT_SECRET")
-    user_agent = "sdimig-user-agent"
     search_data = []
-    reddit = praw.Reddit(
-        client_id=client_id, client_secret=client_secret, user_agent=user_agent
-    )
+    reddit = get_reddit_client()
     subreddit = reddit.subreddit("AskReddit")
-    for submission in subreddit.search(query.target, limit=MAX_RESULTS):
-        search_data.append(submission)
+    with upstream_call("reddit", "search"):
+        for submission in subreddit.search(query.target, limit=MAX_RESULTS):
+            if submission.num_comments > 0:
+                search_data.append((submission.id, submission.num_comments))
     return search_data
 
 
 def reddit_extract_comment_thread_data(
-    search_data: List[str],
-) -> Generator[List[str], None, None]:
+    search_data: List[Submission],
+) -> Generator[Iterator[List[Comment]], None, None]:
     """
     Method to extract comment thread data suitable for pipeline execution
 
     Parameters
     ----------
-    search_data : List[str]
-       The search data results
+    search_data : List[Submission]
+       The matching submissions.
 
     Yields
     ------
-    Generator[List[str], None, None]
-        A generator including the list suitable as input to another
-        pipeline node.
+    Generator[Iterator[List[Comment]], None, None]
+        A generator including the lazy iterator over comment waves suitable
+        as input to another pipeline node.
     """
     yield perform_reddit_extract_comment_thread_data(search_data)
 
 
 @span_decorator
 def perform_reddit_extract_comment_thread_data(
-    search_data: List[str],
-) -> List[Any]:
+    search_data: List[Submission],
+) -> Iterator[List[Comment]]:
     """
-    Method that does the actual work of extracting pipeline data.
+    Method that sets up the extraction of pipeline data. Submissions are
+    sampled at random in waves of WAVE_SIZE, and a wave is only fetched when
+    the transform asks for it, up to MAX_SUBMISSIONS submissions and
+    COMMENT_BUDGET comments in total. Each wave's share of the budget is
+    split over its submissions by comment count.
 
     Parameters
     ----------
-    search_data : List[str]
-        A list of search data results.
+    search_data : List[Submission]
+        The matching submissions.
 
     Returns
     -------
-    List[Any]
-        A list of comment thread data
-    """
-    client_id = get_secret("REDDIT_CLIENT_ID")
-    client_secret = get_secret("REDDIT_CLIENT_SECRET")
-    user_agent = "sdimig-user-agent"
-    reddit = praw.Reddit(
-        client_id=client_id, client_secret=client_secret, user_agent=user_agent
-    )
-    n = 25
-    comment_thread_data = []
-
-    ids = search_data
-    if len(ids) > n:
-        ids = random.sample(search_data, n)
-    for id in ids:
-        submission = reddit.submission(id)
-        for top_level_comment in submission.comments:
-            if isinstance(top_level_comment, MoreComments):
-                continue
-            comment_thread_data.append(top_level_comment.body)
-    return comment_thread_data
+    Iterator[List[Comment]]
+        A lazy iterator over waves of (comment id, text) pairs.
+    """
+    submissions = random.sample(search_data, len(search_data))
+    return _fetch_waves(iter_waves(submissions, WAVE_SIZE, MAX_SUBMISSIONS))
+
+
+def _fetch_waves(waves: Iterator[List[Submission]]) -> Iterator[List[Comment]]:
+    budget = CommentBudget(COMMENT_BUDGET, MAX_SUBMISSIONS)
+    for wave in waves:
+        if budget.exhausted:
+            return
+        limits = budget.allocate([count for _, count in wave])
+        submissions = [
+            (submission_id, limit)
+            for (submission_id, _), limit in zip(wave, limits)
+            if limit > 0
+        ]
+        comments = fetch_comment_wave(submissions)
+        budget.spend(len(wave), len(comments))
+        yield comments
+
+
+@span_decorator
+def fetch_comment_wave(submissions: List[Submission]) -> List[Comment]:
+    """
+    Fetch the comments of one sampling wave. The waves are fetched while the
+    transform runs, so their span shows the extraction time of the chain.
+
+    Parameters
+    ----------
+    submissions : List[Submission]
+        The submission ids and the number of comments wanted from each.
+
+    Returns
+    -------
+    List[Comment]
+        The (comment id, text) pairs of the wave.
+    """
+    # Each submission's comments are a separate blocking round trip, so they
+    # are loaded concurrently on the shared executor.
+    return [
+        comment
+        for fetched in FETCH_EXECUTOR.map(fetch_submission_comments, submissions)
+        for comment in fetched
+    ]
 
 
 def reddit_transform_comment_thread_data(
-    comment_thread_data: List[str],
+    comment_thread_data: Iterable[List[Comment]],
 ) -> Generator[Tuple[ChainType, Sentiment], None, None]:
     """
     A method that transforms comment thread data into a sentiment
@@ -128,48 +275,35 @@ def reddit_transform_comment_thread_data(
 
     Parameters
     ----------
-    comment_thread_data : List[str]
-        A list of comment thread data
+    comment_thread_data : Iterable[List[Comment]]
+        Waves of (comment id, text) pairs
 
     Yields
     ------
     Generator[Tuple[ChainType, Sentiment], None, None]
         A generator containing the type and sentiment object.
     """
-    percentage = perform_reddit_transform_comment_thread_data(comment_thread_data)
-    yield (ChainType.REDDIT_SENTIMENT_DATA, Sentiment(score=percentage))
+    sentiment = perform_reddit_transform_comment_thread_data(comment_thread_data)
+    yield (ChainType.REDDIT_SENTIMENT_DATA, sentiment)
 
 
 @span_decorator
 def perform_reddit_transform_comment_thread_data(
-    comment_thread_data: List[str],
-) -> float:
+    comment_thread_data: Iterable[List[Comment]],
+) -> Sentiment:
     """
     This method does the actual work of generating a sentiment score from the
-    comment thread data.
+    comment thread data. Waves are scored as they are fetched, and no further
+    waves are fetched once the estimate has converged.
 
     Parameters
     ----------
-    comment_thread_data : List[str]
-        A list of comment thread data
+    comment_thread_data : Iterable[List[Comment]]
+        Waves of (comment id, text) pairs
 
     Returns
     -------
-    float
-       The sentiment score derived from the comment thread data.
-    """
-    POSITIVE_THRESHOLD = 0.1
-    NEGATIVE_THRESHOLD = -0.1
-    data = []
-    for comment_text in comment_thread_data:
-        score = perform_sentiment_analysis(comment_text)
-        data.append(score)
-    boolean_array = [
-        True if val >= POSITIVE_THRESHOLD else False
-        for val in data
-        if val >= POSITIVE_THRESHOLD or val <= NEGATIVE_THRESHOLD
-    ]
-    true_count = sum(boolean_array)
-    total_elements = len(boolean_array)
-    percentage = (true_count / total_elements) * 100
-    return percentage
+    Sentiment
+       The sentiment score with its sample size and confidence interval.
+    """
+    return sample_sentiment("reddit", comment_thread_data)
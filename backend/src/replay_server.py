@@ -0,0 +1,615 @@
+"""
+Local stand-in for every upstream service the backend calls, for benchmarks
+and load tests that must not reach the network. Responses are replayed from
+the recordings in fixtures/replay, with their ids rewritten per query, video
+and submission, so that different targets see different videos, comments
+and submissions, and pages follow each other as they do upstream. Point the
+backend at a server on port 8020 with the settings of
+upstream_settings("http://127.0.0.1:8020"), which the server also prints when
+it starts.
+"""
+
+import argparse
+import asyncio
+import copy
+import email.parser
+import hashlib
+import json
+import os
+import uuid
+from datetime import date, datetime, timezone
+from typing import Any, Callable, Dict, List
+from urllib.parse import parse_qs
+
+import openai_stub  # pylint: disable=import-error
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import HTMLResponse
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+REPLAY_FIXTURES = os.path.join(FIXTURES, "replay")
+
+# Seconds every response is delayed by, to imitate the real services.
+LATENCY = 0.0
+# Search result pages served per query, as YouTube stops at about five.
+SEARCH_PAGES = 5
+# Comment counts assigned to videos by the hash of their id. One in six
+# videos has comments disabled.
+COMMENT_COUNTS = [0, 3, 40, 250, 1200, 4800]
+# Reddit keys holding a fullname ("t1_abc"), whose id part is rewritten.
+FULLNAME_KEYS = ("name", "parent_id", "link_id")
+
+app = FastAPI()
+app.mount("/openai", openai_stub.app)
+
+
+def load_fixture(name: str) -> Any:
+    """
+    Read a recorded JSON response.
+
+    Parameters
+    ----------
+    name : str
+        File name in fixtures/replay.
+
+    Returns
+    -------
+    Any
+        The parsed response.
+    """
+    with open(os.path.join(REPLAY_FIXTURES, name), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def read_file(directory: str, name: str) -> bytes:
+    """
+    Read a recorded page or image.
+
+    Parameters
+    ----------
+    directory : str
+        The fixtures directory.
+    name : str
+        The file name.
+
+    Returns
+    -------
+    bytes
+        The file content.
+    """
+    with open(os.path.join(directory, name), "rb") as f:
+        return f.read()
+
+
+YOUTUBE_SEARCH = load_fixture("youtube_search.json")
+YOUTUBE_VIDEOS = load_fixture("youtube_videos.json")
+YOUTUBE_COMMENT_THREADS = load_fixture("youtube_comment_threads.json")
+REDDIT_SEARCH = load_fixture("reddit_search.json")
+REDDIT_COMMENTS = load_fixture("reddit_comments.json")
+REDDIT_MORECHILDREN = load_fixture("reddit_morechildren.json")
+POLYGON_AGGS = load_fixture("polygon_aggs.json")
+POLYGON_TICKERS = load_fixture("polygon_tickers.json")
+TICKER_LISTING = load_fixture("ticker_listing.json")
+STOCKANALYSIS_PAGE = read_file(FIXTURES, "stockanalysis_symbol_lookup.html")
+BRANDSOFTHEWORLD_PAGE = read_file(
+    FIXTURES, "brandsoftheworld_search.html"
+).decode("utf-8")
+LOGO_IMAGE = read_file(REPLAY_FIXTURES, "logo.png")
+
+
+def upstream_settings(base_url: str) -> Dict[str, str]:
+    """
+    The backend settings that send every upstream call to a replay server.
+
+    Parameters
+    ----------
+    base_url : str
+        Base url of the replay server, e.g. http://127.0.0.1:8020.
+
+    Returns
+    -------
+    Dict[str, str]
+        Environmental variables and their values, including dummy keys.
+    """
+    return {
+        "YOUTUBE_ROOT_URL": f"{base_url}/youtube/",
+        "REDDIT_BASE_URL": base_url,
+        "POLYGON_BASE_URL": base_url,
+        "OPENAI_BASE_URL": f"{base_url}/openai/v1",
+        "TICKER_LISTING_URL": f"{base_url}/sec/company_tickers.json",
+        "STOCK_INFO_URL": f"{base_url}/stockanalysis/symbol-lookup",
+        "LOGO_SEARCH_URL": f"{base_url}/brandsoftheworld/search/logo",
+        "GOOGLE_API_KEY": "replay",
+        "REDDIT_CLIENT_ID": "replay",
+        "REDDIT_CLIENT_SECRET": "replay",
+        "POLYGON_API_KEY": "replay",
+        "OPENAI_API_KEY": "replay",
+        "praw_check_for_updates": "False",
+    }
+
+
+def stable_id(*parts: Any, length: int = 11) -> str:
+    """
+    A deterministic id derived from its parts.
+
+    Parameters
+    ----------
+    *parts : Any
+        Values the id depends on.
+    length : int, optional
+        Number of characters, by default 11 like a YouTube video id.
+
+    Returns
+    -------
+    str
+        Lowercase hex characters.
+    """
+    key = "\x1f".join(str(part) for part in parts)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:length]
+
+
+def comment_count(video_id: str) -> int:
+    """
+    The comment count of a video, a deterministic function of its id.
+
+    Parameters
+    ----------
+    video_id : str
+        The video id.
+
+    Returns
+    -------
+    int
+        The number of comment threads the video has.
+    """
+    digest = hashlib.sha1(video_id.encode("utf-8")).digest()
+    return COMMENT_COUNTS[digest[0] % len(COMMENT_COUNTS)]
+
+
+def youtube_search(params: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Replay a search.list response. The page number is the page token.
+
+    Parameters
+    ----------
+    params : Dict[str, str]
+        The query parameters.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The response.
+    """
+    query = params.get("q", "")
+    page = int(params.get("pageToken") or 0)
+    size = int(params.get("maxResults", 5))
+    response = copy.deepcopy(YOUTUBE_SEARCH)
+    response["items"] = response["items"][:size]
+    for index, item in enumerate(response["items"]):
+        item["id"]["videoId"] = stable_id("video", query, page, index)
+    if page + 1 < SEARCH_PAGES:
+        response["nextPageToken"] = str(page + 1)
+    else:
+        response.pop("nextPageToken", None)
+    response["pageInfo"]["resultsPerPage"] = len(response["items"])
+    return response
+
+
+def youtube_videos(params: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Replay a videos.list response with the statistics of every video.
+
+    Parameters
+    ----------
+    params : Dict[str, str]
+        The query parameters.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The response.
+    """
+    response = copy.deepcopy(YOUTUBE_VIDEOS)
+    template = response["items"][0]
+    items = []
+    for video_id in params.get("id", "").split(","):
+        if video_id:
+            item = copy.deepcopy(template)
+            item["id"] = video_id
+            item["statistics"]["commentCount"] = str(comment_count(video_id))
+            items.append(item)
+    response["items"] = items
+    response["pageInfo"] = {
+        "totalResults": len(items),
+        "resultsPerPage": len(items),
+    }
+    return response
+
+
+def youtube_comment_threads(params: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Replay a commentThreads.list response. The recorded threads are repeated
+    until the video's comment count is served, and the page token is the
+    offset of the page.
+
+    Parameters
+    ----------
+    params : Dict[str, str]
+        The query parameters.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The response.
+    """
+    video_id = params.get("videoId", "")
+    start = int(params.get("pageToken") or 0)
+    end = min(comment_count(video_id), start + int(params.get("maxResults", 20)))
+    templates = YOUTUBE_COMMENT_THREADS["items"]
+    response = dict(YOUTUBE_COMMENT_THREADS)
+    response["items"] = []
+    for index in range(start, end):
+        thread = copy.deepcopy(templates[index % len(templates)])
+        thread_id = "Ug" + stable_id("thread", video_id, index, length=24)
+        thread["id"] = thread_id
+        thread["snippet"]["videoId"] = video_id
+        thread["snippet"]["topLevelComment"]["id"] = thread_id
+        for number, reply in enumerate(
+            thread.get("replies", {}).get("comments", [])
+        ):
+            reply["id"] = f"{thread_id}.{stable_id('reply', number, length=22)}"
+            reply["snippet"]["parentId"] = thread_id
+        response["items"].append(thread)
+    if end < comment_count(video_id):
+        response["nextPageToken"] = str(end)
+    else:
+        response.pop("nextPageToken", None)
+    response["pageInfo"] = {
+        "totalResults": len(response["items"]),
+        "resultsPerPage": len(response["items"]),
+    }
+    return response
+
+
+YOUTUBE_METHODS: Dict[str, Callable[[Dict[str, str]], Dict[str, Any]]] = {
+    "search": youtube_search,
+    "videos": youtube_videos,
+    "commentThreads": youtube_comment_threads,
+}
+
+
+@app.middleware("http")
+async def add_latency(request: Request, call_next):
+    """
+    Delay every response by LATENCY seconds.
+    """
+    if LATENCY > 0:
+        await asyncio.sleep(LATENCY)
+    return await call_next(request)
+
+
+@app.get("/health")
+def health() -> Dict[str, str]:
+    """
+    Report that the server is up.
+    """
+    return {"status": "ok"}
+
+
+@app.get("/youtube/youtube/v3/{method}")
+def youtube_list(method: str, request: Request) -> Response:
+    """
+    Replay a YouTube Data API list call.
+
+    Parameters
+    ----------
+    method : str
+        search, videos or commentThreads.
+    request : Request
+        The request.
+
+    Returns
+    -------
+    Response
+        The JSON response, or 404 for other methods.
+    """
+    replay = YOUTUBE_METHODS.get(method)
+    if replay is None:
+        return Response(status_code=404)
+    return Response(
+        json.dumps(replay(dict(request.query_params))),
+        media_type="application/json",
+    )
+
+
+def batch_part(content_id: str, request_line: str) -> str:
+    """
+    Answer one request of a batch.
+
+    Parameters
+    ----------
+    content_id : str
+        Content-ID of the request part.
+    request_line : str
+        The HTTP request line, e.g. "GET /youtube/v3/videos?id=x HTTP/1.1".
+
+    Returns
+    -------
+    str
+        The response part, without its boundary.
+    """
+    path = request_line.split(" ")[1]
+    path, _, query = path.partition("?")
+    replay = YOUTUBE_METHODS.get(path.rsplit("/", 1)[-1])
+    if replay is None:
+        status, body = "404 Not Found", "{}"
+    else:
+        params = {
+            key: values[-1]
+            for key, values in parse_qs(query, keep_blank_values=True).items()
+        }
+        status, body = "200 OK", json.dumps(replay(params))
+    return (
+        "Content-Type: application/http\r\n"
+        f"Content-ID: <response-{content_id.strip('<>')}>\r\n\r\n"
+        f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n\r\n{body}\r\n"
+    )
+
+
+@app.post("/youtube/batch")
+async def youtube_batch(request: Request) -> Response:
+    """
+    Replay a batch HTTP request of YouTube list calls.
+
+    Parameters
+    ----------
+    request : Request
+        A multipart/mixed request of application/http parts.
+
+    Returns
+    -------
+    Response
+        A multipart/mixed response with one part per request.
+    """
+    content_type = request.headers["content-type"]
+    header = f"Content-Type: {content_type}\r\n\r\n".encode("utf-8")
+    message = email.parser.BytesParser().parsebytes(header + await request.body())
+    boundary = uuid.uuid4().hex
+    parts = []
+    for part in message.get_payload():
+        request_line = part.get_payload().lstrip().split("\n", 1)[0].strip()
+        parts.append(batch_part(part["Content-ID"], request_line))
+    body = (
+        "".join(f"--{boundary}\r\n{part}" for part in parts) + f"--{boundary}--"
+    )
+    return Response(body, media_type=f"multipart/mixed; boundary={boundary}")
+
+
+@app.post("/api/v1/access_token")
+def reddit_access_token() -> Dict[str, Any]:
+    """
+    Grant an application-only Reddit token.
+    """
+    return {
+        "access_token": "replay",
+        "token_type": "bearer",
+        "expires_in": 86400,
+        "scope": "*",
+    }
+
+
+def rewrite_ids(value: Any, new_id: Callable[[str], str]) -> Any:
+    """
+    Rewrite the ids, fullnames and child lists of a Reddit listing in place.
+
+    Parameters
+    ----------
+    value : Any
+        A listing, thing or part of one.
+    new_id : Callable[[str], str]
+        Maps a recorded id to its replacement.
+
+    Returns
+    -------
+    Any
+        The rewritten value.
+    """
+    if isinstance(value, list):
+        for item in value:
+            rewrite_ids(item, new_id)
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            if key == "id" and isinstance(item, str):
+                value[key] = new_id(item)
+            elif key in FULLNAME_KEYS and isinstance(item, str):
+                kind, _, old = item.partition("_")
+                value[key] = f"{kind}_{new_id(old)}"
+            elif key == "children" and item and isinstance(item[0], str):
+                value[key] = [new_id(old) for old in item]
+            else:
+                rewrite_ids(item, new_id)
+    return value
+
+
+@app.get("/r/{subreddit}/search/")
+def reddit_search(subreddit: str, q: str = "", limit: int = 25) -> Dict[str, Any]:
+    """
+    Replay a subreddit search. All results fit on one page.
+    """
+    response = copy.deepcopy(REDDIT_SEARCH)
+    response["data"]["children"] = response["data"]["children"][:limit]
+    for child in response["data"]["children"]:
+        child["data"]["subreddit"] = subreddit
+    return rewrite_ids(
+        response, lambda old: stable_id("submission", q, old, length=7)
+    )
+
+
+@app.get("/comments/{submission_id}/")
+def reddit_comments(submission_id: str) -> List[Dict[str, Any]]:
+    """
+    Replay the submission and comment listings of a submission.
+    """
+    recorded_id = REDDIT_COMMENTS[0]["data"]["children"][0]["data"]["id"]
+
+    def new_id(old: str) -> str:
+        if old == recorded_id:
+            return submission_id
+        return stable_id("comment", submission_id, old, length=7)
+
+    return rewrite_ids(copy.deepcopy(REDDIT_COMMENTS), new_id)
+
+
+@app.post("/api/morechildren/")
+async def reddit_morechildren(request: Request) -> Dict[str, Any]:
+    """
+    Replay the comments of a "load more comments" stub. The recorded
+    comments are repeated under the requested ids.
+    """
+    form = parse_qs((await request.body()).decode("utf-8"))
+    children = form.get("children", [""])[-1]
+    link_id = form.get("link_id", [""])[-1]
+    response = copy.deepcopy(REDDIT_MORECHILDREN)
+    templates = response["json"]["data"]["things"]
+    things = []
+    for index, comment_id in enumerate(c for c in children.split(",") if c):
+        thing = copy.deepcopy(templates[index % len(templates)])
+        thing["data"].update(
+            id=comment_id,
+            name=f"t1_{comment_id}",
+            parent_id=link_id,
+            link_id=link_id,
+        )
+        things.append(thing)
+    response["json"]["data"]["things"] = things
+    return response
+
+
+def month_starts(first: date, last: date) -> List[date]:
+    """
+    The first days of the months from first to last.
+
+    Parameters
+    ----------
+    first : date
+        A day of the first month.
+    last : date
+        A day of the last month.
+
+    Returns
+    -------
+    List[date]
+        One date per month, in order.
+    """
+    months = []
+    year, month = first.year, first.month
+    while (year, month) <= (last.year, last.month):
+        months.append(date(year, month, 1))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+@app.get("/v2/aggs/ticker/{ticker}/range/{multiplier}/{timespan}/{start}/{end}")
+def polygon_aggs(
+    ticker: str, multiplier: int, timespan: str, start: str, end: str
+) -> Dict[str, Any]:
+    """
+    Replay monthly aggregates for the requested range. The recorded bars
+    are reused in order, starting at an offset that depends on the ticker.
+    """
+    response = copy.deepcopy(POLYGON_AGGS)
+    bars = response["results"]
+    offset = int(stable_id(ticker, length=4), 16)
+    results = []
+    months = month_starts(date.fromisoformat(start), date.fromisoformat(end))
+    for index, month in enumerate(months):
+        bar = dict(bars[(offset + index) % len(bars)])
+        midnight = datetime(month.year, month.month, 1, tzinfo=timezone.utc)
+        bar["t"] = int(midnight.timestamp() * 1000)
+        results.append(bar)
+    response.update(
+        ticker=ticker,
+        results=results,
+        queryCount=len(results),
+        resultsCount=len(results),
+        count=len(results),
+    )
+    return response
+
+
+@app.get("/v3/reference/tickers")
+def polygon_tickers() -> Dict[str, Any]:
+    """
+    Replay a ticker search.
+    """
+    return POLYGON_TICKERS
+
+
+@app.get("/sec/company_tickers.json")
+def sec_company_tickers() -> Dict[str, Any]:
+    """
+    Replay the SEC company ticker listing.
+    """
+    return TICKER_LISTING
+
+
+@app.get("/stockanalysis/symbol-lookup")
+def stockanalysis_symbol_lookup() -> HTMLResponse:
+    """
+    Replay the stockanalysis.com symbol lookup page.
+    """
+    return HTMLResponse(STOCKANALYSIS_PAGE)
+
+
+@app.get("/brandsoftheworld/search/logo")
+def brandsoftheworld_search(request: Request) -> HTMLResponse:
+    """
+    Replay the brandsoftheworld.com search results page, with its links
+    pointing to this server.
+    """
+    base_url = str(request.base_url).rstrip("/")
+    return HTMLResponse(
+        BRANDSOFTHEWORLD_PAGE.replace(
+            "https://www.brandsoftheworld.com", f"{base_url}/brandsoftheworld"
+        )
+    )
+
+
+@app.get("/brandsoftheworld/sites/{path:path}")
+def brandsoftheworld_file(path: str) -> Response:
+    """
+    Serve the recorded logo for every image of the results page.
+    """
+    return Response(LOGO_IMAGE, media_type="image/png")
+
+
+if __name__ == "__main__":
+
+    # 1. Create an ArgumentParser object
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for the upstream services of the backend"
+    )
+
+    # 2. Add arguments
+    parser.add_argument(
+        "--host", type=str, default="127.0.0.1", help="bind address"
+    )
+    parser.add_argument(
+        "--port", type=int, default=8020, help="port to listen on"
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="seconds every response is delayed by",
+    )
+
+    # 3. Parse the arguments
+    args = parser.parse_args()
+
+    # 4. Print the backend settings and serve the recordings
+    LATENCY = args.latency
+    settings = upstream_settings(f"http://{args.host}:{args.port}")
+    for key, value in settings.items():
+        print(f"export {key}={value}")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,392 @@
+"""
+Adaptive sampling of comment sentiment. Comments are fetched and scored in
+waves while a running estimate of the positive share is kept together with
+its confidence interval. Sampling stops as soon as the interval is narrow
+enough or the fetch budget is spent, so stable queries need far fewer
+upstream calls than the fixed sample sizes used before.
+"""
+
+import contextvars
+import itertools
+import math
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+import numpy as np
+from comment_archive import COMMENT_ARCHIVE  # pylint: disable=import-error
+from comment_archive import Comment  # pylint: disable=import-error
+from common import NEGATIVE_THRESHOLD  # pylint: disable=import-error
+from common import POSITIVE_THRESHOLD, get_setting  # pylint: disable=import-error
+from metrics import COMMENTS_FETCHED  # pylint: disable=import-error
+from metrics import COMMENTS_SCORED  # pylint: disable=import-error
+from model import Sentiment  # pylint: disable=import-error
+
+T = TypeVar("T")
+
+# Full width, in percentage points, of the confidence interval at which
+# sampling stops.
+CI_WIDTH = get_setting("SAMPLER_CI_WIDTH", 10.0)
+# z value of the confidence level, 1.96 for 95%.
+CONFIDENCE_Z = get_setting("SAMPLER_CONFIDENCE_Z", 1.96)
+# Number of positive or negative comments required before the interval is
+# trusted. The Wilson interval is too optimistic for very small samples.
+MIN_SAMPLE = get_setting("SAMPLER_MIN_SAMPLE", 30)
+# Fetch the next wave while the current one is scored. This overlaps
+# scoring with fetching at the cost of at most one wave fetched after the
+# estimate has converged.
+PREFETCH = get_setting("SAMPLER_PREFETCH", True)
+
+# Threads that pull the next wave from a wave generator, one per sampling
+# request in flight. The generators fetch on their own executors.
+PREFETCH_EXECUTOR = ThreadPoolExecutor(
+    max_workers=get_setting("SAMPLER_PREFETCH_WORKERS", 32),
+    thread_name_prefix="prefetch",
+)
+
+_DONE = object()
+
+
+def wilson_interval(positive: int, total: int, z: float) -> Tuple[float, float]:
+    """
+    Wilson score interval of a proportion. Unlike the normal approximation it
+    stays within [0, 1] and behaves well for shares close to 0 or 1.
+
+    Parameters
+    ----------
+    positive : int
+        Number of successes.
+    total : int
+        Number of trials.
+    z : float
+        z value of the confidence level.
+
+    Returns
+    -------
+    Tuple[float, float]
+        The lower and upper bound as fractions. (0.0, 1.0) when total is 0.
+    """
+    if total == 0:
+        return 0.0, 1.0
+    p = positive / total
+    z2 = z * z
+    denominator = 1.0 + z2 / total
+    centre = (p + z2 / (2.0 * total)) / denominator
+    half_width = (
+        z * math.sqrt(p * (1.0 - p) / total + z2 / (4.0 * total * total))
+    ) / denominator
+    return max(0.0, centre - half_width), min(1.0, centre + half_width)
+
+
+class SentimentSampler:
+    """
+    Running estimate of the share of positive comments of one request.
+    Neutral comments are counted but, as in compute_positive_percentage, do
+    not take part in the estimate.
+    """
+
+    def __init__(
+        self,
+        source: str,
+        ci_width: float = CI_WIDTH,
+        z: float = CONFIDENCE_Z,
+        min_sample: int = MIN_SAMPLE,
+    ):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        source : str
+            The platform the comments come from, e.g. "youtube".
+        ci_width : float, optional
+            Interval width in percentage points at which the estimate is
+            considered stable, by default CI_WIDTH
+        z : float, optional
+            z value of the confidence level, by default CONFIDENCE_Z
+        min_sample : int, optional
+            Minimum number of positive or negative comments before the
+            estimate can be stable, by default MIN_SAMPLE
+        """
+        self.source = source
+        self.ci_width = ci_width
+        self.z = z
+        self.min_sample = min_sample
+        self.comments = 0
+        self.scored = 0
+        self.positive = 0
+        self.negative = 0
+
+    @property
+    def sample_size(self) -> int:
+        """
+        Number of comments the estimate is based on.
+
+        Returns
+        -------
+        int
+            The positive plus negative comment count.
+        """
+        return self.positive + self.negative
+
+    def add(self, comments: Sequence[Comment]):
+        """
+        Score a wave of comments and add them to the estimate.
+
+        Parameters
+        ----------
+        comments : Sequence[Comment]
+            (comment id, text) pairs.
+        """
+        # Comments seen by an earlier request reuse their archived score.
+        scores, scored = COMMENT_ARCHIVE.score(self.source, comments)
+        self.scored += scored
+        self.add_scores(scores)
+
+    def add_scores(self, scores: np.ndarray):
+        """
+        Add already scored comments to the estimate.
+
+        Parameters
+        ----------
+        scores : np.ndarray
+            VADER compound scores.
+        """
+        self.comments += len(scores)
+        self.positive += int(np.count_nonzero(scores >= POSITIVE_THRESHOLD))
+        self.negative += int(np.count_nonzero(scores <= NEGATIVE_THRESHOLD))
+
+    def interval(self) -> Tuple[float, float]:
+        """
+        Confidence interval of the positive share.
+
+        Returns
+        -------
+        Tuple[float, float]
+            The lower and upper bound in percent.
+        """
+        low, high = wilson_interval(self.positive, self.sample_size, self.z)
+        return low * 100.0, high * 100.0
+
+    def converged(self) -> bool:
+        """
+        Whether the estimate is stable enough to stop sampling.
+
+        Returns
+        -------
+        bool
+            True once the interval is no wider than ci_width.
+        """
+        if self.sample_size < self.min_sample:
+            return False
+        low, high = self.interval()
+        return high - low <= self.ci_width
+
+    def sentiment(self) -> Sentiment:
+        """
+        The current estimate.
+
+        Returns
+        -------
+        Sentiment
+            The positive percentage with its sample size and interval.
+        """
+        total = self.sample_size
+        score = (self.positive / total) * 100.0 if total > 0 else 0.0
+        low, high = self.interval()
+        return Sentiment(
+            score=score,
+            sample_size=total,
+            comments=self.comments,
+            ci_low=low,
+            ci_high=high,
+        )
+
+
+class CommentBudget:
+    """
+    The comments one request may fetch, spread over its waves. Each wave
+    gets the share of the remaining budget that its items are of the
+    remaining item budget, so comments a wave does not use carry over to
+    later waves. Within a wave the share is split in proportion to the
+    engagement of the items.
+    """
+
+    def __init__(self, total: int, max_items: int):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        total : int
+            Comments that may be fetched in total.
+        max_items : int
+            The most items (videos, submissions) that are sampled.
+        """
+        self.remaining = total
+        self.items_left = max_items
+
+    @property
+    def exhausted(self) -> bool:
+        """
+        Whether nothing more may be fetched.
+
+        Returns
+        -------
+        bool
+            True once the comment or the item budget is spent.
+        """
+        return self.remaining <= 0 or self.items_left <= 0
+
+    def allocate(self, counts: Sequence[int]) -> List[int]:
+        """
+        Split the share of a wave over its items in proportion to their
+        comment counts. No item gets more than its count.
+
+        Parameters
+        ----------
+        counts : Sequence[int]
+            Number of comments each item of the wave has.
+
+        Returns
+        -------
+        List[int]
+            The number of comments to fetch from each item. Items whose
+            share rounds down to 0 are not fetched.
+        """
+        if self.exhausted or not counts:
+            return [0] * len(counts)
+        share = self.remaining * len(counts) / max(self.items_left, len(counts))
+        total = sum(counts)
+        if total <= share:
+            return list(counts)
+        return [int(count * share / total) for count in counts]
+
+    def spend(self, items: int, comments: int):
+        """
+        Record what a wave used.
+
+        Parameters
+        ----------
+        items : int
+            Items in the wave.
+        comments : int
+            Comments fetched.
+        """
+        self.items_left -= items
+        self.remaining -= comments
+
+
+def iter_waves(
+    items: Iterable[T], wave_size: int, budget: int
+) -> Iterator[List[T]]:
+    """
+    Split items into waves, reading no more than budget items. Items are
+    only pulled from the iterable when their wave is requested, so lazily
+    produced items (e.g. search result pages) are only fetched if needed.
+
+    Parameters
+    ----------
+    items : Iterable[T]
+        The items to sample from, in sampling order.
+    wave_size : int
+        Number of items per wave.
+    budget : int
+        Maximum number of items read in total.
+
+    Yields
+    ------
+    Iterator[List[T]]
+        Lists of at most wave_size items.
+    """
+    remaining = itertools.islice(items, max(budget, 0))
+    while True:
+        wave = list(itertools.islice(remaining, max(wave_size, 1)))
+        if not wave:
+            return
+        yield wave
+
+
+def prefetch(items: Iterable[T]) -> Iterator[T]:
+    """
+    Iterate over items while the next item is produced in the background.
+    The source is only advanced by one thread at a time, and it is closed
+    when the returned generator is closed.
+
+    Parameters
+    ----------
+    items : Iterable[T]
+        The items, typically a lazy generator that blocks on upstream calls.
+
+    Yields
+    ------
+    Iterator[T]
+        The items in order.
+    """
+    source = iter(items)
+    # Copy the context so that upstream calls made while prefetching belong
+    # to the caller's trace span.
+    pending: Future = PREFETCH_EXECUTOR.submit(
+        contextvars.copy_context().run, next, source, _DONE
+    )
+    try:
+        while True:
+            item = pending.result()
+            if item is _DONE:
+                return
+            pending = PREFETCH_EXECUTOR.submit(
+                contextvars.copy_context().run, next, source, _DONE
+            )
+            yield item
+    finally:
+        # A generator cannot be closed while another thread runs it.
+        if not pending.cancel():
+            try:
+                pending.result()
+            except Exception:  # pylint: disable=broad-except
+                pass
+        close = getattr(source, "close", None)
+        if close is not None:
+            close()
+
+
+def sample_sentiment(
+    source: str,
+    waves: Iterable[Sequence[Comment]],
+    sampler: Optional[SentimentSampler] = None,
+) -> Sentiment:
+    """
+    Feed waves of comments to a sampler until it converges or the waves run
+    out. With PREFETCH the next wave is fetched while the current one is
+    scored; waves after that are never requested, so their upstream calls
+    are not made.
+
+    Parameters
+    ----------
+    source : str
+        The platform the comments come from, e.g. "youtube".
+    waves : Iterable[Sequence[Comment]]
+        Waves of (comment id, text) pairs, typically a lazy generator.
+    sampler : Optional[SentimentSampler], optional
+        The sampler, by default one with the configured settings.
+
+    Returns
+    -------
+    Sentiment
+        The estimate.
+    """
+    if sampler is None:
+        sampler = SentimentSampler(source)
+    if PREFETCH:
+        waves = prefetch(waves)
+    try:
+        for comments in waves:
+            sampler.add(comments)
+            if sampler.converged():
+                break
+    finally:
+        close = getattr(waves, "close", None)
+        if close is not None:
+            close()
+    COMMENTS_FETCHED.labels(source).observe(sampler.comments)
+    COMMENTS_SCORED.labels(source).observe(sampler.scored)
+    return sampler.sentiment()
@@ -0,0 +1,186 @@
+"""
+Optional process pool for VADER scoring. VADER is pure Python, so a request
+that scores hundreds of comments holds the GIL on a single core and slows
+every other request in the process. With the pool enabled, large batches are
+split into chunks that are scored by worker processes, each of which loads
+the lexicon once at startup. Small batches are still scored in-process,
+where the cost of shipping the texts would outweigh the gain.
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from common import (  # pylint: disable=import-error
+    SENTIMENT_ANALYZER,
+    get_setting,
+    score_batch,
+)
+from model import ScoringPoolStats  # pylint: disable=import-error
+
+
+def _warm_worker():
+    # Runs once in every worker. Importing common has loaded the lexicon;
+    # scoring a sentence also imports the lazily loaded parts of nltk.
+    SENTIMENT_ANALYZER.polarity_scores("a good warm up")
+
+
+def _score_chunk(texts: List[str]) -> np.ndarray:
+    return score_batch(texts)
+
+
+class ScoringPool:
+    """
+    A pool of worker processes that score comments with VADER.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        min_batch: int,
+        chunk_size: int,
+        start_method: str = "spawn",
+        enabled: bool = True,
+    ):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        workers : int
+            Number of worker processes.
+        min_batch : int
+            Batches with fewer distinct texts are scored in-process.
+        chunk_size : int
+            Number of texts sent to a worker at a time.
+        start_method : str, optional
+            multiprocessing start method of the workers, by default "spawn".
+            Forking a process that runs threads is not safe.
+        enabled : bool, optional
+            When False every batch is scored in-process, by default True
+        """
+        self.workers = workers
+        self.min_batch = min_batch
+        self.chunk_size = chunk_size
+        self.start_method = start_method
+        self.enabled = enabled
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pooled_batches = 0
+        self._pooled_comments = 0
+        self._in_process_batches = 0
+        self._in_process_comments = 0
+        self._failures = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(self.start_method),
+                    initializer=_warm_worker,
+                )
+            return self._executor
+
+    def start(self):
+        """
+        Start the worker processes and wait until they have loaded the
+        lexicon, so the first large request does not pay for it.
+        """
+        if not self.enabled:
+            return
+        executor = self._get_executor()
+        list(executor.map(_score_chunk, [["warm up"]] * self.workers))
+
+    def stop(self):
+        """
+        Stop the worker processes.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def score(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        Score a batch of comments, in the worker processes when the batch is
+        large enough. Identical texts are only scored once.
+
+        Parameters
+        ----------
+        texts : Sequence[str]
+            The comments to be analyzed.
+
+        Returns
+        -------
+        np.ndarray
+            An array of VADER compound scores in the same order as texts.
+        """
+        unique = list(dict.fromkeys(texts))
+        if not self.enabled or len(unique) < self.min_batch:
+            with self._lock:
+                self._in_process_batches += 1
+                self._in_process_comments += len(unique)
+            return score_batch(texts)
+
+        chunks = [
+            unique[start : start + self.chunk_size]
+            for start in range(0, len(unique), self.chunk_size)
+        ]
+        try:
+            scored = np.concatenate(
+                list(self._get_executor().map(_score_chunk, chunks))
+            )
+        except BrokenProcessPool as e:
+            # A worker died. Score this batch here and start a new pool on
+            # the next one.
+            print(f"Error: scoring pool failed e={e}")
+            self.stop()
+            with self._lock:
+                self._failures += 1
+            return score_batch(texts)
+
+        with self._lock:
+            self._pooled_batches += 1
+            self._pooled_comments += len(unique)
+        index: Dict[str, float] = dict(zip(unique, scored.tolist()))
+        return np.fromiter(
+            (index[text] for text in texts), dtype=np.float64, count=len(texts)
+        )
+
+    def stats(self) -> ScoringPoolStats:
+        """
+        How many comments were scored by the workers versus in-process.
+
+        Returns
+        -------
+        ScoringPoolStats
+            The current statistics.
+        """
+        with self._lock:
+            return ScoringPoolStats(
+                enabled=self.enabled,
+                workers=self.workers if self.enabled else 0,
+                pooled_batches=self._pooled_batches,
+                pooled_comments=self._pooled_comments,
+                in_process_batches=self._in_process_batches,
+                in_process_comments=self._in_process_comments,
+                failures=self._failures,
+            )
+
+
+SCORING_POOL = ScoringPool(
+    workers=get_setting("SCORING_POOL_WORKERS", os.cpu_count() or 1),
+    # A sampling wave scores a few hundred comments (YouTube: 250, Reddit: 500
+    # with the default budgets), so the threshold has to sit below that for
+    # requests to use the pool at all. Shipping 100 texts to a worker costs
+    # a few milliseconds against about 30ms of scoring.
+    min_batch=get_setting("SCORING_POOL_MIN_BATCH", 100),
+    chunk_size=get_setting("SCORING_POOL_CHUNK_SIZE", 100),
+    start_method=get_setting("SCORING_POOL_START_METHOD", "spawn"),
+    enabled=get_setting("SCORING_POOL_ENABLED", False),
+)
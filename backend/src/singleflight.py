@@ -0,0 +1,121 @@
+"""
+Request coalescing for identical in-flight work. While a call for a key is
+running, later calls for the same key wait for its result instead of
+starting a duplicate.
+"""
+
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, TypeVar
+
+from model import SingleFlightStats  # pylint: disable=import-error
+
+T = TypeVar("T")
+
+
+class _Call:
+    """
+    An in-flight call and its outcome.
+    """
+
+    __slots__ = ("done", "value", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time and shares its outcome with every
+    caller that arrived while it was running.
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self._executed = 0
+        self._coalesced = 0
+
+    def do(
+        self, key: Hashable, fn: Callable[[], T], timeout: Optional[float] = None
+    ) -> T:
+        """
+        Run fn, or wait for the call already running for key.
+
+        Parameters
+        ----------
+        key : Hashable
+            Identifies identical work.
+        fn : Callable[[], T]
+            Produces the result. Only called if no call for key is running.
+        timeout : Optional[float], optional
+            Seconds to wait for a joined call, by default without limit. It
+            does not apply when fn is run by this caller.
+
+        Returns
+        -------
+        T
+            The result of fn, from this call or the one that was joined.
+            If that call raised, the same exception is raised here.
+
+        Raises
+        ------
+        TimeoutError
+            If the joined call did not finish within timeout.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                self._executed += 1
+                leader = True
+            else:
+                call.waiters += 1
+                self._coalesced += 1
+                leader = False
+
+        if not leader:
+            if not call.done.wait(timeout):
+                raise TimeoutError(
+                    f"joined call still running after {timeout:.1f}s"
+                )
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = fn()
+            return call.value
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> SingleFlightStats:
+        """
+        Counters showing how many calls were coalesced.
+
+        Returns
+        -------
+        SingleFlightStats
+            The current statistics.
+        """
+        with self._lock:
+            return SingleFlightStats(
+                executed=self._executed,
+                coalesced=self._coalesced,
+                in_flight=len(self._calls),
+                waiting=sum(call.waiters for call in self._calls.values()),
+            )
+
+
+SINGLE_FLIGHT = SingleFlight()
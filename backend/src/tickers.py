@@ -0,0 +1,487 @@
+"""
+Local index that resolves a company name to its ticker symbol. It is built
+from a bulk listing of listed companies, kept on disk, and refreshed in the
+background once it is older than its max age. A lookup is a few dictionary
+and bisect operations, with a Levenshtein fallback for misspellings, so no
+remote symbol search is needed per request.
+"""
+
+import bisect
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import Levenshtein
+from clients import HTTP_TIMEOUT, get_http_session  # pylint: disable=import-error
+from common import get_data_path, get_setting  # pylint: disable=import-error
+from metrics import upstream_call  # pylint: disable=import-error
+from model import TickerIndexStats  # pylint: disable=import-error
+
+DAY = 24 * 60 * 60.0
+
+# The SEC listing is ordered by market capitalization, which is used to
+# break ties between companies matching the same query.
+LISTING_URL = get_setting(
+    "TICKER_LISTING_URL", "https://www.sec.gov/files/company_tickers.json"
+)
+# The SEC asks automated clients to identify themselves with a contact.
+LISTING_USER_AGENT = get_setting(
+    "TICKER_LISTING_USER_AGENT", "stock-analyzer dimigstephenm@gmail.com"
+)
+
+# Common names that do not resemble the listed company name.
+# Keys are name keys, e.g. "atandt" for "AT&T".
+ALIASES: Dict[str, str] = {
+    "coke": "KO",
+    "google": "GOOGL",
+    "facebook": "META",
+    "jandj": "JNJ",
+    "atandt": "T",
+    "pandg": "PG",
+}
+
+# Trailing words of a listed name that users leave out.
+NAME_SUFFIXES = {
+    "inc",
+    "incorporated",
+    "corp",
+    "corporation",
+    "co",
+    "company",
+    "ltd",
+    "limited",
+    "plc",
+    "llc",
+    "lp",
+    "sa",
+    "nv",
+    "ag",
+    "se",
+    "holdings",
+    "holding",
+    "de",
+    "del",
+    "new",
+    "the",
+}
+
+# Minimum Levenshtein ratio for a fuzzy match, and the shortest query that is
+# matched fuzzily. Short names are too close to too many others.
+FUZZY_MIN_RATIO = get_setting("TICKER_FUZZY_MIN_RATIO", 0.85)
+FUZZY_MIN_LENGTH = get_setting("TICKER_FUZZY_MIN_LENGTH", 5)
+# Minimum share of a listed name that a single-word query must cover to
+# match it, e.g. "delta" covers 5 of the 13 letters of "Delta Air Lines".
+# Below it the query is left unresolved and callers use their remote lookup.
+WORD_MIN_SCORE = get_setting("TICKER_WORD_MIN_SCORE", 0.5)
+# Resolved queries are memoized up to this many entries.
+MEMO_SIZE = 10000
+# Seconds to wait before trying again when no listing could be loaded or a
+# refresh failed.
+LOAD_RETRY_INTERVAL = 60.0
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+_UNRESOLVED: Any = object()
+
+
+def name_tokens(text: str) -> List[str]:
+    """
+    Split a company name into lower case words, without the leading "the"
+    and trailing legal suffixes such as "inc" or "corp".
+
+    Parameters
+    ----------
+    text : str
+        A company name or query.
+
+    Returns
+    -------
+    List[str]
+        The significant words.
+    """
+    tokens = _NON_ALNUM.sub(" ", text.lower().replace("&", " and ")).split()
+    if tokens and tokens[0] == "the":
+        tokens = tokens[1:]
+    while len(tokens) > 1 and tokens[-1] in NAME_SUFFIXES:
+        tokens.pop()
+    return tokens
+
+
+def name_key(text: str) -> str:
+    """
+    Key under which a company name is indexed. Spacing is removed so that
+    "united health group" and "UnitedHealth Group Inc" share a key.
+
+    Parameters
+    ----------
+    text : str
+        A company name or query.
+
+    Returns
+    -------
+    str
+        The key.
+    """
+    return "".join(name_tokens(text))
+
+
+def parse_listing(document: Any) -> List[Tuple[str, str]]:
+    """
+    Read (ticker, company name) pairs from a listing document. Both the SEC
+    company_tickers.json layout (an object of numbered records) and a plain
+    list of records are accepted. Records use "ticker" and "title" or
+    "name".
+
+    Parameters
+    ----------
+    document : Any
+        The decoded JSON listing.
+
+    Returns
+    -------
+    List[Tuple[str, str]]
+        The pairs in listing order. Share class separators are written as "."
+        like Polygon and stockanalysis.com do (BRK.B).
+    """
+    records = document.values() if isinstance(document, dict) else document
+    listing = []
+    for record in records:
+        ticker = record.get("ticker")
+        name = record.get("title") or record.get("name")
+        if ticker and name:
+            listing.append((ticker.upper().replace("-", "."), name))
+    return listing
+
+
+class TickerMatch:
+    """
+    A resolved ticker.
+    """
+
+    __slots__ = ("symbol", "name", "kind")
+
+    def __init__(self, symbol: str, name: str, kind: str):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        symbol : str
+            The ticker symbol.
+        name : str
+            The listed company name.
+        kind : str
+            How the query matched: "alias", "name", "symbol", "prefix", "word"
+            or "fuzzy".
+        """
+        self.symbol = symbol
+        self.name = name
+        self.kind = kind
+
+    def __repr__(self) -> str:
+        return f"TickerMatch({self.symbol!r}, {self.name!r}, {self.kind!r})"
+
+
+class _Tables:
+    """
+    Immutable lookup tables built from one listing. A refresh builds new
+    tables and swaps them in, so readers never need the lock.
+    """
+
+    def __init__(self, listing: List[Tuple[str, str]], aliases: Dict[str, str]):
+        # Position in the listing. Lower ranks win ties.
+        self.rank: Dict[str, int] = {}
+        self.names: Dict[str, str] = {}
+        self.by_key: Dict[str, str] = {}
+        self.by_word: Dict[str, str] = {}
+        self.by_initial: Dict[str, List[str]] = {}
+        for symbol, name in listing:
+            if symbol in self.rank:
+                continue
+            self.rank[symbol] = len(self.rank)
+            self.names[symbol] = name
+            tokens = name_tokens(name)
+            key = "".join(tokens)
+            if key and key not in self.by_key:
+                self.by_key[key] = symbol
+                self.by_initial.setdefault(key[0], []).append(key)
+            for token in tokens:
+                self.by_word.setdefault(token, symbol)
+        self.keys = sorted(self.by_key)
+        self.aliases = {
+            key: symbol for key, symbol in aliases.items() if symbol in self.rank
+        }
+
+    def match(self, symbol: str, kind: str) -> TickerMatch:
+        return TickerMatch(symbol, self.names[symbol], kind)
+
+    def best_prefix(self, key: str) -> Optional[str]:
+        best = None
+        keys = self.keys
+        for index in range(bisect.bisect_left(keys, key), len(keys)):
+            if not keys[index].startswith(key):
+                break
+            symbol = self.by_key[keys[index]]
+            if best is None or self.rank[symbol] < self.rank[best]:
+                best = symbol
+        return best
+
+    def best_fuzzy(self, key: str) -> Optional[str]:
+        # Candidates are in listing order, so the first of equally close
+        # names wins.
+        if len(key) < FUZZY_MIN_LENGTH:
+            return None
+        best = None
+        best_ratio = 0.0
+        for candidate in self.by_initial.get(key[0], []):
+            if abs(len(candidate) - len(key)) > len(key) // 3 + 1:
+                continue
+            ratio = Levenshtein.ratio(key, candidate)
+            if ratio >= FUZZY_MIN_RATIO and ratio > best_ratio:
+                best = self.by_key[candidate]
+                best_ratio = ratio
+        return best
+
+    def resolve(self, target: str) -> Optional[TickerMatch]:
+        tokens = name_tokens(target)
+        key = "".join(tokens)
+        if not key:
+            return None
+        if key in self.aliases:
+            return self.match(self.aliases[key], "alias")
+        if key in self.by_key:
+            return self.match(self.by_key[key], "name")
+
+        # A short query may be a ticker ("gm") or the start of a name
+        # ("ford" for Ford Motor Co, while FORD is another company). The
+        # larger company wins.
+        candidates: List[Tuple[str, str]] = []
+        symbol = target.strip().upper()
+        if symbol in self.rank:
+            candidates.append((symbol, "symbol"))
+        prefix = self.best_prefix(key)
+        if prefix is not None:
+            candidates.append((prefix, "prefix"))
+        if len(tokens) == 1 and tokens[0] in self.by_word:
+            word_symbol = self.by_word[tokens[0]]
+            word_key = name_key(self.names[word_symbol])
+            if len(key) / len(word_key) >= WORD_MIN_SCORE:
+                candidates.append((word_symbol, "word"))
+        if candidates:
+            symbol, kind = min(candidates, key=lambda c: self.rank[c[0]])
+            return self.match(symbol, kind)
+
+        fuzzy = self.best_fuzzy(key)
+        if fuzzy is not None:
+            return self.match(fuzzy, "fuzzy")
+        return None
+
+
+class TickerIndex:
+    """
+    Process-wide ticker index backed by a listing file in the data
+    directory.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_age: float,
+        aliases: Dict[str, str],
+        enabled: bool = True,
+    ):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        path : str
+            Path of the cached listing file.
+        max_age : float
+            Seconds after which the listing is refreshed in the background.
+        aliases : Dict[str, str]
+            Extra names, as name keys, mapped to ticker symbols.
+        enabled : bool, optional
+            When False nothing is resolved and callers fall back to their
+            remote lookups, by default True
+        """
+        self.path = path
+        self.max_age = max_age
+        self.aliases = aliases
+        self.enabled = enabled
+        self._tables: Optional[_Tables] = None
+        self._loaded_at = 0.0
+        self._memo: Dict[str, Optional[TickerMatch]] = {}
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._load_failed_at = 0.0
+        self._refresh_failed_at = 0.0
+        self._refreshing = False
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="ticker-refresh"
+        )
+        self._hits = 0
+        self._misses = 0
+        self._refreshes = 0
+        self._refresh_errors = 0
+
+    def load(self):
+        """
+        Load the listing from disk, downloading it first if there is no local
+        copy. A copy older than max_age is used as is and refreshed in the
+        background.
+        """
+        # Serialized so that concurrent first requests download only once.
+        with self._load_lock:
+            if self._tables is not None:
+                return
+            if os.path.exists(self.path):
+                with open(self.path, "r") as f:
+                    saved = json.load(f)
+                with self._lock:
+                    self._install(
+                        [tuple(pair) for pair in saved["listing"]],
+                        saved["fetched_at"],
+                    )
+            else:
+                self.refresh()
+
+    def refresh(self):
+        """
+        Download the listing, save it and rebuild the index.
+        """
+        session = get_http_session()
+        with upstream_call("ticker_listing", "download"):
+            response = session.get(
+                LISTING_URL,
+                headers={"User-Agent": LISTING_USER_AGENT},
+                timeout=HTTP_TIMEOUT,
+            )
+            response.raise_for_status()
+        listing = parse_listing(response.json())
+        if not listing:
+            raise ValueError(f"empty ticker listing from {LISTING_URL}")
+        fetched_at = time.time()
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump({"fetched_at": fetched_at, "listing": listing}, f)
+        os.replace(temporary, self.path)
+        with self._lock:
+            self._install(listing, fetched_at)
+            self._refreshes += 1
+
+    def resolve(self, target: str) -> Optional[TickerMatch]:
+        """
+        Resolve a company name, alias or ticker symbol.
+
+        Parameters
+        ----------
+        target : str
+            The common name of the company.
+
+        Returns
+        -------
+        Optional[TickerMatch]
+            The match, or None if the index is disabled, could not be loaded
+            or has no match.
+        """
+        if not self.enabled:
+            return None
+        tables = self._tables
+        if tables is None:
+            if time.time() - self._load_failed_at < LOAD_RETRY_INTERVAL:
+                return None
+            try:
+                self.load()
+            except Exception as e:  # pylint: disable=broad-except
+                print(f"Error: ticker index load failed e={e}")
+                self._load_failed_at = time.time()
+                return None
+            tables = self._tables
+            if tables is None:
+                return None
+        self._refresh_if_stale()
+
+        # The memo belongs to the tables it was filled from. Both are read
+        # together and a result is only memoized if they were not swapped by
+        # a reload in the meantime.
+        with self._lock:
+            tables, memo = self._tables, self._memo
+        memo_key = " ".join(target.lower().split())
+        match = memo.get(memo_key, _UNRESOLVED)
+        resolved = match is _UNRESOLVED
+        if resolved:
+            match = tables.resolve(target)
+        with self._lock:
+            if resolved and self._memo is memo:
+                if len(memo) >= MEMO_SIZE:
+                    memo.clear()
+                memo[memo_key] = match
+            if match is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+        return match
+
+    def stats(self) -> TickerIndexStats:
+        """
+        Size, age and hit counters of the index.
+
+        Returns
+        -------
+        TickerIndexStats
+            The current statistics.
+        """
+        with self._lock:
+            tables = self._tables
+            return TickerIndexStats(
+                entries=len(tables.rank) if tables is not None else 0,
+                aliases=len(tables.aliases) if tables is not None else 0,
+                age=time.time() - self._loaded_at if tables is not None else 0.0,
+                hits=self._hits,
+                misses=self._misses,
+                refreshes=self._refreshes,
+                refresh_errors=self._refresh_errors,
+            )
+
+    def _install(self, listing: List[Tuple[str, str]], fetched_at: float):
+        # Called with the lock held.
+        self._tables = _Tables(listing, self.aliases)
+        self._loaded_at = fetched_at
+        self._memo = {}
+
+    def _refresh_if_stale(self):
+        with self._lock:
+            now = time.time()
+            if (
+                self._refreshing
+                or now - self._loaded_at < self.max_age
+                or now - self._refresh_failed_at < LOAD_RETRY_INTERVAL
+            ):
+                return
+            self._refreshing = True
+        self._executor.submit(self._refresh)
+
+    def _refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:  # pylint: disable=broad-except
+            # Keep serving the old listing.
+            print(f"Error: ticker index refresh failed e={e}")
+            with self._lock:
+                self._refresh_errors += 1
+                self._refresh_failed_at = time.time()
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+
+TICKER_INDEX = TickerIndex(
+    path=get_setting("TICKER_INDEX_PATH", "") or get_data_path("tickers.json"),
+    max_age=get_setting("TICKER_INDEX_MAX_AGE", DAY),
+    aliases=ALIASES,
+    enabled=get_setting("TICKER_INDEX_ENABLED", True),
+)
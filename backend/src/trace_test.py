@@ -2,7 +2,11 @@
 This module is a test driver for tracing.
 """
 
-from decorators import span_decorator  # pylint: disable=import-error
+from decorators import (  # pylint: disable=import-error
+    setup_tracing,
+    shutdown_tracing,
+    span_decorator,
+)
 
 
 @span_decorator
@@ -35,4 +39,6 @@ def main():
 
 
 if __name__ == "__main__":
+    setup_tracing()
     main()
+    shutdown_tracing()
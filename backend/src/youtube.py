@@ -3,227 +3,522 @@ This module implements the youtube sentiment analysis functions.
 """
 
 import random
-from typing import Any, Dict, Generator, List, Tuple
-
-import googleapiclient.discovery
-from common import (  # pylint: disable=import-error
-    SERVICES,
-    get_secret,
-    perform_sentiment_analysis,
-)
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Generator, Iterable, Iterator, List, Optional, Tuple
+
+import googleapiclient.errors
+import httplib2
+from bonobo.config import use
+from clients import get_youtube_client  # pylint: disable=import-error
+from comment_archive import Comment  # pylint: disable=import-error
+from common import PipelineContext, get_setting  # pylint: disable=import-error
 from decorators import span_decorator  # pylint: disable=import-error
+from metrics import upstream_call  # pylint: disable=import-error
+from model import TargetQuery  # pylint: disable=import-error
 from model import ChainType, Sentiment  # pylint: disable=import-error
+from sampler import (  # pylint: disable=import-error
+    CommentBudget,
+    iter_waves,
+    sample_sentiment,
+)
+
+# Errors that cause a single video to be skipped rather than failing the chain.
+FETCH_ERRORS = (googleapiclient.errors.HttpError, httplib2.HttpLib2Error, OSError)
+
+# Number of concurrent commentThreads calls per process.
+FETCH_WORKERS = get_setting("YOUTUBE_FETCH_WORKERS", 10)
+# When greater than 1, commentThreads calls are grouped into batch HTTP
+# requests of this size. Each worker sends one batch at a time.
+BATCH_SIZE = get_setting("YOUTUBE_BATCH_SIZE", 0)
+# Videos whose comments are fetched per sampling wave, and the most videos
+# sampled per request.
+WAVE_SIZE = get_setting("YOUTUBE_WAVE_SIZE", 10)
+MAX_VIDEOS = get_setting("YOUTUBE_MAX_VIDEOS", 100)
+# Comments (threads and their replies) fetched per request at most, spread
+# over the sampled videos by their comment counts.
+COMMENT_BUDGET = get_setting("YOUTUBE_COMMENT_BUDGET", 2500)
+# Comment threads per commentThreads page, the API maximum.
+MAX_THREADS_PER_PAGE = 100
+# Comment count assumed for a video whose statistics could not be read.
+UNKNOWN_COMMENT_COUNT = 20
+# Search results per page, and the most search pages read per request.
+MAX_RESULTS_PER_PAGE = 50
+# Video ids per videos call, the API maximum.
+MAX_IDS_PER_VIDEOS_CALL = 50
+MAX_SEARCH_PAGES = get_setting("YOUTUBE_MAX_SEARCH_PAGES", 5)
+
+FETCH_EXECUTOR = ThreadPoolExecutor(
+    max_workers=FETCH_WORKERS, thread_name_prefix="youtube"
+)
+
+# A sampled video as (video id, comment count).
+Video = Tuple[str, int]
 
 
-def extract_search_data() -> Generator[List[Tuple[str, str]], None, None]:
+def comments_of(response: Dict[str, Any]) -> List[Comment]:
     """
-    Search for videos that match a query string.
+    Collect the top level comments and replies of a commentThreads response.
 
     Parameters
     ----------
-    query : str
-        The query string used in the "q" parameter.
+    response : Dict[str, Any]
+        A commentThreads response.
 
-    Yields
-    ------
-    Generator[list[tuple[str, str]], None, None]
-        A list of tuple pairs (video_id, channel_id)
+    Returns
+    -------
+    List[Comment]
+        (comment id, text) pairs.
     """
-    search_data = perform_extract_search_data()
-    yield search_data
+    comments: List[Comment] = []
+    for comment_item in response.get("items", []):
+        top_level = comment_item.get("snippet", {}).get("topLevelComment", {})
+        comments.append(
+            (
+                top_level.get("id", ""),
+                top_level.get("snippet", {}).get("textOriginal", ""),
+            )
+        )
+        for reply in comment_item.get("replies", {}).get("comments", []):
+            comments.append(
+                (
+                    reply.get("id", ""),
+                    reply.get("snippet", {}).get("textOriginal", ""),
+                )
+            )
+    return comments
 
 
-@span_decorator
-def perform_extract_search_data() -> List[Any]:
+def comment_threads_request(
+    youtube: Any, video_id: str, limit: int, page_token: Optional[str] = None
+) -> Any:
     """
-    Method implements the code that does the actual work of
-    extracting the search data.
+    Build a commentThreads request.
+
+    Parameters
+    ----------
+    youtube : Any
+        The YouTube client.
+    video_id : str
+        The video id.
+    limit : int
+        Comments still wanted from the video. Fewer threads are requested
+        when a full page is not needed.
+    page_token : Optional[str], optional
+        The page to read, by default the first.
 
     Returns
     -------
-    List[Any]
-        A list of search data results.
+    Any
+        The request.
     """
-    MAX_RESULTS_PER_PAGE = 50
-    MAX_PAGES = 5
-    query = SERVICES["query"]
-
-    api_service_name = "youtube"
-    api_version = "v3"
-    api_key = get_secret("GOOGLE_API_KEY")
-    youtube = googleapiclient.discovery.build(
-        api_service_name, api_version, developerKey=api_key
-    )
-
-    response_list: List[Any] = []
     params = {
-        "part": "snippet",
-        "q": query.target,
-        "maxResults": MAX_RESULTS_PER_PAGE,
-        "safeSearch": "none",
+        "part": "id, replies, snippet",
+        "videoId": video_id,
+        "maxResults": max(1, min(MAX_THREADS_PER_PAGE, limit)),
     }
-    while True:
-        page_token = None
+    if page_token:
+        params["pageToken"] = page_token
+    return youtube.commentThreads().list(**params)  # type: ignore
+
+
+def read_comment_pages(
+    youtube: Any,
+    video_id: str,
+    limit: int,
+    comments: List[Comment],
+    page_token: Optional[str] = None,
+) -> List[Comment]:
+    """
+    Read pages of comment threads of a video until limit comments are
+    collected or the last page is read.
 
-        if len(response_list) >= MAX_PAGES:
+    Parameters
+    ----------
+    youtube : Any
+        The YouTube client.
+    video_id : str
+        The video id.
+    limit : int
+        Comments wanted from the video.
+    comments : List[Comment]
+        Comments already read. New comments are appended to it.
+    page_token : Optional[str], optional
+        The next page to read, by default the first.
+
+    Returns
+    -------
+    List[Comment]
+        comments, extended.
+    """
+    while len(comments) < limit:
+        request = comment_threads_request(
+            youtube, video_id, limit - len(comments), page_token
+        )
+        try:
+            with upstream_call("youtube", "comment_threads"):
+                response = request.execute()
+        except FETCH_ERRORS:
             break
+        comments.extend(comments_of(response))
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            break
+    return comments
+
+
+def fetch_comment_threads(video: Tuple[str, int]) -> List[Comment]:
+    """
+    Fetch the comment threads of a video, page by page, until its share of
+    the comment budget is read. Only the comment ids and texts are kept;
+    the raw responses are dropped in the fetching thread.
+
+    Parameters
+    ----------
+    video : Tuple[str, int]
+        The video id and the number of comments wanted from it.
+
+    Returns
+    -------
+    List[Comment]
+        (comment id, text) pairs. Empty if the first call failed (comments
+        disabled, timeout, ...).
+    """
+    video_id, limit = video
+    return read_comment_pages(get_youtube_client(), video_id, limit, [])
+
+
+def fetch_comment_threads_batch(videos: List[Tuple[str, int]]) -> List[Comment]:
+    """
+    Fetch the comment threads of several videos. The first pages are read
+    in a single batch HTTP request, further pages one call at a time.
+
+    Parameters
+    ----------
+    videos : List[Tuple[str, int]]
+        The video ids and the number of comments wanted from each.
+
+    Returns
+    -------
+    List[Comment]
+        (comment id, text) pairs of the successful calls.
+    """
+    youtube = get_youtube_client()
+    first_pages: Dict[str, Tuple[List[Comment], Optional[str]]] = {}
+
+    def callback(request_id, response, exception):
+        if exception is None:
+            first_pages[request_id] = (
+                comments_of(response),
+                response.get("nextPageToken"),
+            )
+
+    batch = youtube.new_batch_http_request(callback=callback)
+    for index, (video_id, limit) in enumerate(videos):
+        batch.add(
+            comment_threads_request(youtube, video_id, limit),
+            request_id=str(index),
+        )
+    try:
+        with upstream_call("youtube", "comment_threads_batch"):
+            batch.execute()
+    except FETCH_ERRORS:
+        pass
+
+    comments: List[Comment] = []
+    for index, (video_id, limit) in enumerate(videos):
+        page = first_pages.get(str(index))
+        if page is None:
+            continue
+        page_comments, page_token = page
+        if page_token:
+            read_comment_pages(
+                youtube, video_id, limit, page_comments, page_token
+            )
+        comments.extend(page_comments)
+    return comments
+
+
+def fetch_comment_counts(video_ids: List[str]) -> Dict[str, int]:
+    """
+    Read the comment counts of videos, MAX_IDS_PER_VIDEOS_CALL per videos
+    call.
 
+    Parameters
+    ----------
+    video_ids : List[str]
+        The video ids.
+
+    Returns
+    -------
+    Dict[str, int]
+        The comment count of every video, UNKNOWN_COMMENT_COUNT for the
+        videos of a call that failed. Videos with comments disabled report 0.
+    """
+    counts = {video_id: 0 for video_id in video_ids}
+    for start in range(0, len(video_ids), MAX_IDS_PER_VIDEOS_CALL):
+        batch = video_ids[start : start + MAX_IDS_PER_VIDEOS_CALL]
+        # maxResults may not be combined with id.
+        request = (
+            get_youtube_client()
+            .videos()
+            .list(part="statistics", id=",".join(batch))  # type: ignore
+        )
+        try:
+            with upstream_call("youtube", "videos"):
+                response = request.execute()
+        except FETCH_ERRORS as e:
+            print(f"Error: video statistics failed videos={len(batch)} e={e}")
+            counts.update((video_id, UNKNOWN_COMMENT_COUNT) for video_id in batch)
+            continue
+        for item in response.get("items", []):
+            statistics = item.get("statistics", {})
+            counts[item["id"]] = int(statistics.get("commentCount", 0))
+    return counts
+
+
+class VideoSearch:
+    """
+    Video search results that are fetched one page at a time. Later pages are
+    only requested once the sampler has used up the videos of earlier ones.
+    Every page is read together with the comment counts of its videos, and
+    videos without comments are left out.
+    """
+
+    def __init__(self, target: str):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        target : str
+            The common name of the company.
+        """
+        self.target = target
+        self.pages: List[List[Video]] = []
+        self._page_token: Optional[str] = None
+        self._exhausted = False
+
+    def fetch_page(self) -> bool:
+        """
+        Fetch the next page of results.
+
+        Returns
+        -------
+        bool
+            False if there are no more pages.
+        """
+        if self._exhausted or len(self.pages) >= MAX_SEARCH_PAGES:
+            return False
+        params = {
+            "part": "snippet",
+            "q": self.target,
+            "maxResults": MAX_RESULTS_PER_PAGE,
+            "safeSearch": "none",
+        }
+        if self._page_token:
+            params["pageToken"] = self._page_token
         try:
-            request = youtube.search().list(**params)  # type: ignore
-            response = request.execute()
-            response_list.append(response)
-            page_token = response.get("nextPageToken")
+            request = get_youtube_client().search().list(**params)  # type: ignore
+            with upstream_call("youtube", "search"):
+                response = request.execute()
         except googleapiclient.errors.HttpError as e:
             print(f"Error: unexpected exception e={e}")
+            self._exhausted = True
+            return False
+        self._page_token = response.get("nextPageToken")
+        self._exhausted = not self._page_token
+        video_ids = [
+            item["id"]["videoId"]
+            for item in response.get("items", [])
+            if item.get("id", {}).get("videoId")
+        ]
+        counts = fetch_comment_counts(video_ids) if video_ids else {}
+        videos = [(video_id, counts[video_id]) for video_id in video_ids]
+        videos = [video for video in videos if video[1] > 0]
+        # Videos are sampled in random order within a page, and pages in
+        # search rank order.
+        random.shuffle(videos)
+        self.pages.append(videos)
+        return True
+
+    def __iter__(self) -> Iterator[Video]:
+        index = 0
+        while True:
+            if index == len(self.pages) and not self.fetch_page():
+                return
+            yield from self.pages[index]
+            index += 1
+
+
+@use("context")
+def extract_search_data(
+    context: PipelineContext,
+) -> Generator[VideoSearch, None, None]:
+    """
+    Search for videos that match a query string.
 
-        if page_token:
-            params = {"part": "snippet", "q": query, "pageToken": page_token}
-        else:
-            break
-    search_data = []
-    for response in response_list:
-        for item in response.get("items", []):
-            video_id = item.get("id", {}).get("videoId")
-            channel_id = item.get("snippet", {}).get("channelId")
-            search_data.append((video_id, channel_id))
-    return search_data
+    Parameters
+    ----------
+    context : PipelineContext
+        The per-request pipeline context carrying the query.
+
+    Yields
+    ------
+    Generator[VideoSearch, None, None]
+        The search results.
+    """
+    search_data = perform_extract_search_data(context.query)
+    yield search_data
+
+
+@span_decorator
+def perform_extract_search_data(query: TargetQuery) -> VideoSearch:
+    """
+    Method implements the code that does the actual work of
+    extracting the search data. Only the first page is fetched here, the
+    others when the sampler asks for more videos.
+
+    Parameters
+    ----------
+    query : TargetQuery
+        The common name of the company.
+
+    Returns
+    -------
+    VideoSearch
+        The search results.
+    """
+    search = VideoSearch(query.target)
+    search.fetch_page()
+    return search
 
 
 def extract_comment_thread_data(
-    search_data: List[Tuple[str, str]]
-) -> Generator[Dict[str, List[Any]], None, None]:
+    search_data: Iterable[Video],
+) -> Generator[Iterator[List[Comment]], None, None]:
     """
-    Extract comments for all of the videos.
+    Extract comments for the sampled videos.
 
     Parameters
     ----------
-    search_data : list[tuple[str, str]]
-        A list of tuple pairs (video_id, channel_id)
+    search_data : Iterable[Video]
+        The videos in sampling order.
 
     Yields
     ------
-    Generator[dict[str, list[Any]], None, None]
-        Returs a dictionary with an "items" key whose value is the JSON data
-        of all of the responses.
+    Generator[Iterator[List[Comment]], None, None]
+        A lazy iterator over waves of (comment id, text) pairs.
     """
-    data: Dict[str, List[Any]] = perform_extract_comment_thread_data(search_data)
-    yield data
+    yield perform_extract_comment_thread_data(search_data)
 
 
 @span_decorator
 def perform_extract_comment_thread_data(
-    search_data: List[Tuple[str, str]]
-) -> Dict[str, List[Any]]:
+    search_data: Iterable[Video],
+) -> Iterator[List[Comment]]:
     """
-    This method implements the actual work of extracting the comment
-    thread data.
+    This method sets up the extraction of the comment thread data. Videos are
+    fetched in waves of WAVE_SIZE, and a wave is only fetched when the
+    transform asks for it, up to MAX_VIDEOS videos and COMMENT_BUDGET
+    comments in total. Each wave's share of the budget is split over its
+    videos by comment count, and a video's pages are read until its part is
+    spent.
 
     Parameters
     ----------
-    search_data : List[Tuple[str, str]]
-        A list of search data results.
+    search_data : Iterable[Video]
+        The videos in sampling order.
 
     Returns
     -------
-    Dict[str, List[Any]]
-        A dictionary with a key of "items", and a list of responses
-        containing comment thread data.
-    """
-    api_service_name = "youtube"
-    api_version = "v3"
-    api_key = get_secret("GOOGLE_API_KEY")
-    youtube = googleapiclient.discovery.build(
-        api_service_name, api_version, developerKey=api_key
-    )
-
-    data: Dict[str, List[Any]] = {}
-    data["items"] = []
-    videos: List[Any] = []
-    n = 100
-
-    # Create dictionary
-    for list_item in search_data:
-        video_id = list_item[0]
-        videos.append(video_id)
-
-    if len(videos) > n:
-        videos = random.sample(videos, n)
-    for video_id in videos:
-        try:
-            request = youtube.commentThreads().list(  # type: ignore
-                part="id, replies, snippet", videoId=video_id
-            )
-            response = request.execute()
-            data["items"].append(response)
-        except googleapiclient.errors.HttpError:
-            pass
-    return data
+    Iterator[List[Comment]]
+        A lazy iterator over waves of (comment id, text) pairs.
+    """
+    return _fetch_waves(iter_waves(search_data, WAVE_SIZE, MAX_VIDEOS))
+
+
+def _fetch_waves(waves: Iterator[List[Video]]) -> Iterator[List[Comment]]:
+    budget = CommentBudget(COMMENT_BUDGET, MAX_VIDEOS)
+    for wave in waves:
+        if budget.exhausted:
+            return
+        limits = budget.allocate([count for _, count in wave])
+        videos = [
+            (video_id, limit)
+            for (video_id, _), limit in zip(wave, limits)
+            if limit > 0
+        ]
+        comments = fetch_comment_wave(videos)
+        budget.spend(len(wave), len(comments))
+        yield comments
+
+
+@span_decorator
+def fetch_comment_wave(videos: List[Video]) -> List[Comment]:
+    """
+    Fetch the comments of one sampling wave. The waves are fetched while the
+    transform runs, so their span shows the extraction time of the chain.
+
+    Parameters
+    ----------
+    videos : List[Video]
+        The video ids and the number of comments wanted from each.
+
+    Returns
+    -------
+    List[Comment]
+        The (comment id, text) pairs of the wave.
+    """
+    # Fetch on the shared executor. Each worker thread uses its own client.
+    if BATCH_SIZE > 1:
+        chunks = [
+            videos[start : start + BATCH_SIZE]
+            for start in range(0, len(videos), BATCH_SIZE)
+        ]
+        results = FETCH_EXECUTOR.map(fetch_comment_threads_batch, chunks)
+    else:
+        results = FETCH_EXECUTOR.map(fetch_comment_threads, videos)
+    return [comment for fetched in results for comment in fetched]
 
 
 def transform_comment_thread_data(
-    comment_thread_data: Dict,
+    comment_thread_data: Iterable[List[Comment]],
 ) -> Generator[Tuple[ChainType, Sentiment], None, None]:
     """
-    Transform the comment_thread_data into a useable dataframe.
-    Parameters
+    Transform the comment_thread_data into a sentiment score.
 
     Parameters
     ----------
-    comment_thread_data : dict
-        A dictionary containing the comment thread data.
+    comment_thread_data : Iterable[List[Comment]]
+        Waves of (comment id, text) pairs.
 
     Yields
     ------
-    Generator[tuple[ChainType, pd.DataFrame], None, None]
-        A tuple pair (key, df) that contains the type of data and a
-        useable dataframe.
+    Generator[Tuple[ChainType, Sentiment], None, None]
+        A tuple pair (key, sentiment).
     """
 
-    percentage = perform_transform_comment_thread_data(comment_thread_data)
-    yield (ChainType.YOUTUBE_SENTIMENT_DATA, Sentiment(score=percentage))
+    sentiment = perform_transform_comment_thread_data(comment_thread_data)
+    yield (ChainType.YOUTUBE_SENTIMENT_DATA, sentiment)
 
 
 @span_decorator
-def perform_transform_comment_thread_data(comment_thread_data: Dict) -> float:
+def perform_transform_comment_thread_data(
+    comment_thread_data: Iterable[List[Comment]],
+) -> Sentiment:
     """
     Method that implements the actual work to transform the comment thread data
-    into a sentiment score.
+    into a sentiment score. Waves are scored as they are fetched, and no
+    further waves are fetched once the estimate has converged.
 
     Parameters
     ----------
-    comment_thread_data : Dict
-        A dictionary of comment thread data
+    comment_thread_data : Iterable[List[Comment]]
+        Waves of (comment id, text) pairs.
 
     Returns
     -------
-    float
-        The sentiment score
-    """
-    POSITIVE_THRESHOLD = 0.1
-    NEGATIVE_THRESHOLD = -0.1
-    data = []
-    for item in comment_thread_data.get("items", []):
-        for comment_item in item.get("items", []):
-            top_level = (
-                comment_item.get("snippet", {})
-                .get("topLevelComment", {})
-                .get("snippet", {})
-            )
-            comment_text = top_level.get("textOriginal", "")
-            score = perform_sentiment_analysis(comment_text)
-            data.append(score)
-            for reply in comment_item.get("replies", {}).get("comments", []):
-                comment_text = reply.get("snippet", {}).get("textOriginal", "")
-                score = perform_sentiment_analysis(comment_text)
-                data.append(score)
-    boolean_array = [
-        True if val >= POSITIVE_THRESHOLD else False
-        for val in data
-        if val >= POSITIVE_THRESHOLD or val <= NEGATIVE_THRESHOLD
-    ]
-    true_count = sum(boolean_array)
-    total_elements = len(boolean_array)
-    percentage = (
-        (true_count / total_elements) * 100.0 if total_elements > 0 else 0.0
-    )
-    return percentage
+    Sentiment
+        The sentiment score with its sample size and confidence interval.
+    """
+    return sample_sentiment("youtube", comment_thread_data)